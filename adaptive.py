@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Adaptive cadence of the continuous measures.
+
+A line is fitted to the last measures. The interval to the next measure is
+the time the sky takes to change by the step configured at the rate of the
+line, between the periodicity and the maximum periodicity. While the
+scatter of the measures around the line is larger than the step, as with
+passing clouds, the measures are taken at the periodicity. The interval
+grows at most to the double each measure and drops at once.
+"""
+
+import sys
+import math
+
+# Measures used to estimate the rate of change and the scatter.
+WINDOW_SIZE = 8
+
+# Maximum growth of the interval between two measures.
+MAX_GROWTH = 2.0
+
+# Change of magnitude between measures when it is not configured.
+DEFAULT_STEP = 0.05
+
+class AdaptiveCadence(object):
+    """Chooses the interval to the next measure from the last measures."""
+
+    def __init__(self, min_period, max_period, step,
+                 window_size=WINDOW_SIZE):
+        """Initializes the cadence at the minimum period.
+
+        Args:
+            min_period: Shortest interval between measures in seconds.
+            max_period: Longest interval between measures in seconds.
+            step: Change of magnitude expected between two measures.
+            window_size: Measures used to estimate the rate and scatter.
+        """
+
+        self._min_period = min_period
+        self._max_period = max_period
+        self._step = step
+        self._window_size = window_size
+
+        self.reset()
+
+    @property
+    def interval(self):
+        """Interval to the next measure in seconds."""
+
+        return self._interval
+
+    @property
+    def rate(self):
+        """Rate of change of the last measures in magnitudes per hour."""
+
+        return self._rate * 3600.0
+
+    @property
+    def scatter(self):
+        """Standard deviation of the last measures around their line."""
+
+        return self._scatter
+
+    def reset(self):
+        """Forget the measures, as after a pause, and return to the minimum
+        period.
+        """
+
+        self._times = []
+        self._values = []
+        self._rate = 0.0
+        self._scatter = 0.0
+        self._interval = self._min_period
+
+    def set_bounds(self, min_period, max_period, step):
+        """Change the bounds of the interval and the step, keeping the
+        measures.
+        """
+
+        self._min_period = min_period
+        self._max_period = max_period
+        self._step = step
+
+        self._interval = self._clamp(self._interval)
+
+    def _clamp(self, interval):
+
+        return min(self._max_period, max(self._min_period, interval))
+
+    def _fit(self):
+        """Fit a line to the measures of the window by least squares, the
+        rate is its slope and the scatter the deviation of the residuals.
+        """
+
+        n = len(self._times)
+
+        t0 = self._times[0]
+
+        t = [ x - t0 for x in self._times ]
+
+        mean_t = sum(t) / n
+        mean_v = sum(self._values) / n
+
+        stt = sum([ (x - mean_t) ** 2 for x in t ])
+
+        slope = 0.0
+
+        if stt > 0:
+            slope = sum([ (x - mean_t) * (v - mean_v)
+                          for x, v in zip(t, self._values) ]) / stt
+
+        residuals = [ v - mean_v - slope * (x - mean_t)
+                      for x, v in zip(t, self._values) ]
+
+        # Two degrees of freedom are used by the line.
+        scatter = 0.0
+
+        if n > 2:
+            scatter = math.sqrt(sum([ r * r for r in residuals ]) / (n - 2))
+
+        return slope, scatter
+
+    def update(self, timestamp, magnitude):
+        """Add a measure and choose the interval to the next one.
+
+        Args:
+            timestamp: Time of the measure in seconds since the epoch.
+            magnitude: Value measured.
+
+        Returns:
+            The interval to the next measure in seconds.
+        """
+
+        self._times.append(timestamp)
+        self._values.append(float(magnitude))
+
+        if len(self._times) > self._window_size:
+            del self._times[0]
+            del self._values[0]
+
+        interval = self._min_period
+
+        # Until the window is full the rate is not reliable.
+        if len(self._times) == self._window_size:
+            self._rate, self._scatter = self._fit()
+
+            if self._scatter < self._step:
+                if self._rate != 0:
+                    interval = self._step / abs(self._rate)
+                else:
+                    interval = self._max_period
+
+                interval = min(interval, self._interval * MAX_GROWTH)
+
+        self._interval = self._clamp(interval)
+
+        return self._interval
+
+def burst_value(measures):
+    """Returns the median of the measures of a burst, the value given to
+    the cadence once per period as the measures of a burst are taken too
+    close in time to estimate the rate of change.
+
+    Args:
+        measures: Values measured.
+    """
+
+    values = sorted([ float(m) for m in measures ])
+
+    middle = len(values) // 2
+
+    if len(values) % 2 == 1:
+        return values[middle]
+
+    return (values[middle - 1] + values[middle]) / 2.0
+
+def create_cadence(sqm_config):
+    """Returns the adaptive cadence set in the configuration, None for a
+    fixed periodicity.
+
+    Args:
+        sqm_config: Configuration parameters.
+    """
+
+    cadence = None
+
+    if sqm_config.cadence_adaptive:
+        cadence = AdaptiveCadence(float(sqm_config.periodicity),
+                                  sqm_config.max_periodicity,
+                                  sqm_config.adaptive_step)
+
+    return cadence
+
+if __name__ == "__main__":
+
+    # Shows the measures a continuous output file would have had with the
+    # adaptive cadence.
+    from outreader import read_continuous_file
+
+    if len(sys.argv) < 4:
+        print "Usage: %s file min_period max_period [step]" % sys.argv[0]
+        sys.exit(1)
+
+    cadence = AdaptiveCadence(float(sys.argv[2]), float(sys.argv[3]),
+                              float(sys.argv[4]) if len(sys.argv) > 4
+                              else DEFAULT_STEP)
+
+    next_time = None
+    kept = 0
+    total = 0
+
+    for timestamp, mjd, measure in read_continuous_file(sys.argv[1]):
+        if next_time is None or timestamp >= next_time:
+            next_time = timestamp + cadence.update(timestamp, measure)
+            kept += 1
+
+        total += 1
+
+    print "%d of %d measures kept (%.1f%%)" % \
+        (kept, total, 100.0 * kept / max(1, total))
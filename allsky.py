@@ -24,9 +24,13 @@ formats.
 
 import logging
 import time
+import math
 from config import *
 from outfile import *
 from sound import *
+from console import PlainConsole
+from sqmserial import SerialPortGroup
+from skyplan import create_plan, rig_offsets, RasterPlan, SerpentinePlan
 
 # Azimuths and vertical values.
 AZIMUTH_VALUES = [ 0, 30, 60, 90, 120, 150, 180, 210, 240, 270, 300, 330 ]
@@ -34,6 +38,12 @@ VERTICAL_VALUES = [ 20, 40, 60, 80 ]
 
 DELAY_BETWEEN_REPEATED_MEASURES = 0.5
 
+# Approximate time in seconds of a reading, to estimate the session time.
+ESTIMATED_READING_TIME = 1.0
+
+# Console used when none is indicated.
+DEFAULT_CONSOLE = PlainConsole()
+
 class AllSkyException(Exception):
     
     def __init__(self, msg):
@@ -57,20 +67,31 @@ class AllSkyMeasures(object):
         self._vert_dim = vert_dim
         self._matrix = [[0 for x in range(az_dim)] for x in range(vert_dim)] 
         self._zenith = None
+        self._comments = []
+        
+        # Number of readings and their deviation of each value, 0 and nan 
+        # when they are not known.
+        self._counts = [[0 for x in range(az_dim)] for x in range(vert_dim)]
+        self._spreads = [[float("nan") for x in range(az_dim)] 
+                         for x in range(vert_dim)]
                      
-    def set(self, az_index, vert_index, val):
+    def set(self, az_index, vert_index, val, count=0, spread=float("nan")):
         """Set the values for the coordinates received.
         
         Args:
             az_index: Azimuth coordinate.
             vert_index: Vertical coordinate.
             val: Value to set.
+            count: Number of readings of the value.
+            spread: Standard deviation of the readings of the value.
             
         """
         
         if az_index >= 0 and az_index < self._az_dim and \
             vert_index >= 0 and vert_index < self._vert_dim:
             self._matrix[vert_index][az_index] = val
+            self._counts[vert_index][az_index] = count
+            self._spreads[vert_index][az_index] = spread
         else:
             raise AllSkyException("set: Invalid coordinates: %d %d" % 
                                   (az_index, vert_index))
@@ -112,6 +133,9 @@ class AllSkyMeasures(object):
             
             output_file.write_com(info)       
             
+            for msg in self._comments:
+                output_file.write_com(msg)
+            
             for i in range(self._az_dim):
                 for j in range(self._vert_dim):
                     output_file.write("%s%s" %
@@ -146,6 +170,9 @@ class AllSkyMeasures(object):
             
             output_file.write_com(info)       
             
+            for msg in self._comments:
+                output_file.write_com(msg)
+            
             for i in range(self._vert_dim):
                 
                 val = [ float(v) for v in self._matrix[i] ]
@@ -159,6 +186,35 @@ class AllSkyMeasures(object):
         except OutputFileException as ofe:
             logging.error(ofe)            
     
+    def values_by_vertical(self):
+        """Returns the values as floats in a list for each vertical value."""
+        
+        return [ [ float(v) for v in row ] for row in self._matrix ]
+    
+    def counts_by_vertical(self):
+        """Returns the number of readings of each value in a list for each 
+        vertical value.
+        """
+        
+        return [ list(row) for row in self._counts ]
+    
+    def spreads_by_vertical(self):
+        """Returns the standard deviation of the readings of each value in a
+        list for each vertical value.
+        """
+        
+        return [ list(row) for row in self._spreads ]
+    
+    def write_com(self, msg):
+        """Keep a comment, as the reloads of the configuration, to write it
+        after the information in the files saved.
+        
+        Args:
+            msg: String to write.
+        """
+        
+        self._comments.append(msg)
+        
     @property
     def zenith(self):
         return self._zenith    
@@ -167,115 +223,310 @@ class AllSkyMeasures(object):
     def zenith(self, zenith):
         self._zenith = zenith
         
-def mean_measure(ser, sqm_config):
-    """Perform several measures and returns the mean value.
+def measure_stats(measures):
+    """Returns the mean value of several measures as a string, nan if there
+    isn't any, the number of measures and their standard deviation.
+    
+    Args:
+        measures: List of the values measured as floats.
+    """
+    
+    count = len(measures)
+    
+    if count > 0:
+        mean = sum(measures) / float(count)
+        
+        spread = math.sqrt(sum([ (m - mean) ** 2 for m in measures ]) / count)
+        
+        mean_value = str(mean)
+    else:
+        spread = float("nan")
+        
+        mean_value = str(float("nan"))
+    
+    return mean_value, count, spread
+
+def repeated_measures(ser, sqm_config):
+    """Perform several measures.
     
     Args:
         ser: Serial object used to communicate with SQM.     
         sqm_config: Configuration parameters.
         
     Returns.
-        The mean value of the measures taken as a string.
+        A list with the values of the valid measures as floats.
     """
     
-    mean_value = None
-
     measures = []
     
     for i in range(int(sqm_config.repetitions)):
-        measures.append(float(ser.get_sqm_measure()))
+        measure = ser.get_sqm_measure()
+        
+        # The measures not taken are gaps, not included in the mean.
+        if measure is not None:
+            measures.append(float(measure))
         
         # Delay between repeated measures
         time.sleep(DELAY_BETWEEN_REPEATED_MEASURES)
         
     logging.debug("Repeated measures taken: %s" % measures)
     
-    return str(sum(measures) / float(len(measures)))
+    return measures
+    
+def group_repeated_measures(group, sqm_config):
+    """Perform several measures with each SQM of a group at the same time.
+    
+    Args:
+        group: Group of the serial ports of the SQMs.     
+        sqm_config: Configuration parameters.
+        
+    Returns.
+        A list with a list of the values of the valid measures of each SQM
+        as floats.
+    """
+    
+    measures = [ [] for port in group.ports ]
+    
+    for i in range(int(sqm_config.repetitions)):
+        
+        for k, measure in enumerate(group.get_sqm_measures()):
+            if measure is not None:
+                measures[k].append(float(measure))
+        
+        time.sleep(DELAY_BETWEEN_REPEATED_MEASURES)
+        
+    logging.debug("Repeated measures taken: %s" % measures)
+    
+    return measures
+    
+def estimated_session_time(plan, sqm_config):
+    """Returns an estimation of the time to measure all the positions of a
+    plan, the zenith included.
+    
+    Args:
+        plan: Plan of the positions.
+        sqm_config: Configuration parameters.
+        
+    Returns:
+        The time estimated in seconds.
+    """
+    
+    position_time = int(sqm_config.repetitions) * \
+        (ESTIMATED_READING_TIME + DELAY_BETWEEN_REPEATED_MEASURES)
+    
+    return plan.slew_time(float(sqm_config.delay), 
+                          float(sqm_config.delay_bet_azi_ver)) + \
+        len(plan) * position_time + ESTIMATED_READING_TIME
+    
+def plan_session(sqm_config, rig_ports=None):
+    """Returns the plan of the positions to measure and the messages that
+    describe it.
+    
+    Args:
+        sqm_config: Configuration parameters.
+        rig_ports: Serial objects of the SQMs of the rig, None to measure 
+            only with a SQM.
+        
+    Returns:
+        A tuple with the plan and a list of the messages to show.
+    """
+    
+    offsets = None
+    
+    if rig_ports is not None:
+        offsets = rig_offsets(sqm_config.rig)
+    
+    plan = create_plan(sqm_config, AZIMUTH_VALUES, VERTICAL_VALUES, offsets)
+    
+    messages = []
+    
+    if plan.name == RasterPlan.NAME or plan.name == SerpentinePlan.NAME:
+        if sqm_config.order_is_azimuth:
+            messages.append("Order: Processing all the azimuths of each " +
+                            "vertical value before passing to the next " +
+                            "vertical value.")
+        else:
+            messages.append("Order: Processing all the vertical value " +
+                            "before passing next azimuths.")
+    
+    estimated_time = estimated_session_time(plan, sqm_config)
     
-def all_sky_measures(ser, sqm_config, output_filename):
+    messages.append("Plan %s: %d positions, %.0f degrees moved, estimated " 
+                    "time %d min %02d s." % 
+                    (plan.name, len(plan) + 1, plan.total_angle, 
+                     estimated_time // 60, estimated_time % 60))
+    
+    logging.info("Plan %s estimated time: %.1f s" % 
+                 (plan.name, estimated_time))
+    
+    return plan, messages
+
+def plan_delays(plan, sqm_config):
+    """Returns the delays before each position of the plan configured."""
+    
+    return plan.delays(float(sqm_config.delay), 
+                       float(sqm_config.delay_bet_azi_ver))
+
+def position_ports(plan, k, ser, rig_ports=None):
+    """Returns the pointings measured in a position of the plan and the 
+    serial ports that measure them.
+    
+    Args:
+        plan: Plan of the positions.
+        k: Index of the position in the plan.
+        ser: Serial object of the SQM, used without a rig.
+        rig_ports: Serial objects of the SQMs of the rig, if any.
+        
+    Returns:
+        A tuple with the list of pointings as indexes of azimuth and 
+        vertical value, and the list of their serial ports.
+    """
+    
+    if rig_ports is None:
+        pointings = [ plan.positions[k] ]
+        ports = [ ser ]
+    else:
+        assignment = plan.assignments[k]
+        
+        pointings = [ p for i, p in assignment ]
+        ports = [ rig_ports[i] for i, p in assignment ]
+        
+    return pointings, ports
+
+def store_position(all_sky_values, pointings, measures):
+    """Store the measures of the pointings of a position.
+    
+    Args:
+        all_sky_values: All sky measures.
+        pointings: Pointings as indexes of azimuth and vertical value.
+        measures: List of the values measured of each pointing as floats.
+        
+    Returns:
+        A list of tuples with the message and the value of each pointing, 
+        to show them.
+    """
+    
+    shown = []
+    
+    for pointing, readings in zip(pointings, measures):
+        measure, count, spread = measure_stats(readings)
+        
+        pointing_label = "Azimuth %d Vertical %d" % \
+            (AZIMUTH_VALUES[pointing[0]], VERTICAL_VALUES[pointing[1]])
+        
+        all_sky_values.set(pointing[0], pointing[1], measure, count, spread)
+        
+        logging.info("Measure: %s is %s" % (pointing_label, measure))
+        
+        shown.append(("Measure: %s is %s" % (pointing_label, measure), 
+                      measure))
+        
+    return shown
+
+def store_zenith(all_sky_values, measure):
+    """Store the measure of the zenith, nan if it hasn't been taken.
+    
+    Returns:
+        A tuple with the message and the value, to show them.
+    """
+    
+    if measure is None:
+        measure = str(float("nan"))
+    
+    all_sky_values.zenith = measure
+    
+    logging.info("Measure: zenith is %s" % measure)
+    
+    return "Measure: zenith is %s" % measure, measure
+
+def save_all_sky(all_sky_values, output_filename, sqm_config):
+    """Save the all sky measures as a list and by vertical value."""
+    
+    all_sky_values.save_as_list(output_filename, sqm_config.info)
+    all_sky_values.save_as_list_by_vertical(output_filename, sqm_config.info)
+
+def all_sky_measures(ser, sqm_config, output_filename, watcher=None,
+                     console=DEFAULT_CONSOLE, rig_ports=None):
     """Perform the all sky measures.
     
+    With a rig of several SQMs, all of them measure at the same time in each
+    orientation of the rig, the zenith is measured by the first one.
+    
     Args:
         ser: Serial object used to communicate with SQM.     
         sqm_config: Configuration parameters.
         output_filename: Object to write output messages.
+        watcher: Optional watcher to reload the configuration between measures.
+        console: Console to show the measures.
+        rig_ports: Serial objects of the SQMs of the rig, in the order of the
+            rig configured, None to measure only with ser.
+        
+    Returns:
+        The measures taken.
     """
     
     logging.debug("Starting all sky measures.")
     
-    external_loop_name = None
-    internal_loop_name = None
-    
-    # Depending on the order set the appropriate list for external and internal 
-    # loops. 
-    if sqm_config.order_is_azimuth:
-        external_loop_values = VERTICAL_VALUES
-        internal_loop_values = AZIMUTH_VALUES
-               
-        external_loop_name = "Vertical"
-        internal_loop_name = "Azimuth"        
-         
-        print "Order: Processing all the azimuths of each vertical value ", \
-            "before passing to the next vertical value."
-    else:
-        external_loop_values = AZIMUTH_VALUES
-        internal_loop_values = VERTICAL_VALUES
-               
-        external_loop_name = "Azimuth"
-        internal_loop_name = "Vertical"  
-                
-        print "Order: Processing all the vertical value before passing ", \
-            "next azimuths."
+    if rig_ports is not None:
+        ser = rig_ports[0]
+    
+    plan, messages = plan_session(sqm_config, rig_ports)
+    
+    for msg in messages:
+        console.message(msg)
             
     all_sky_values = AllSkyMeasures(len(AZIMUTH_VALUES), 
                                     len(VERTICAL_VALUES))
     
-    delay = int(sqm_config.delay)
-    delay_between_azimuth_vertical = int(sqm_config.delay_bet_azi_ver)
+    delays = plan_delays(plan, sqm_config)
+    
+    # Number of positions, the zenith included.
+    total_positions = len(plan) + 1
         
-    for i in range(len(external_loop_values)):
-        for j in range(len(internal_loop_values)): 
-            
-            for k in range(delay):
-                print "Waiting %d seconds before next measure ..." % (delay - k)
-                
-                if k == delay - 1:
-                    start_sound(sqm_config)
-            
-                time.sleep(1)            
-            
-            print "Measuring next value: %s %d %s %d" % \
-                (external_loop_name, external_loop_values[i], 
-                 internal_loop_name, internal_loop_values[j])    
-                
-            measure = mean_measure(ser, sqm_config)
-            
-            end_sound(sqm_config)
+    for k, position in enumerate(plan.positions): 
             
-            if sqm_config.order_is_azimuth:            
-                all_sky_values.set(j, i, measure)
-            else:
-                all_sky_values.set(i, j, measure)
-            
-            logging.info("Measure: %s %d %s %d is %s" % \
-                         (external_loop_name, external_loop_values[i], 
-                          internal_loop_name, internal_loop_values[j],
-                          measure))
-            
-        for k in range(delay_between_azimuth_vertical):
-            print "Waiting %d seconds to change between azimuth and vertical." % \
-                (delay_between_azimuth_vertical - k)
-            
-            time.sleep(1)
+        # Apply any configuration change before moving to next position, 
+        # the reloads are written in the files saved.
+        if watcher is not None and watcher.check(all_sky_values):
+            delays = plan_delays(plan, sqm_config)
+        
+        label = plan.label(position)
+        
+        console.progress(k, total_positions, label)
+        
+        console.countdown(delays[k], 
+                          "Waiting %d seconds before next measure ...",
+                          lambda: start_sound(sqm_config))
+        
+        console.message("Measuring next value: %s" % label)
+        
+        pointings, ports = position_ports(plan, k, ser, rig_ports)
+        
+        if rig_ports is None:
+            measures = [ repeated_measures(ser, sqm_config) ]
+        else:
+            measures = group_repeated_measures(SerialPortGroup(ports),
+                                               sqm_config)
+        
+        end_sound(sqm_config)
+        
+        for text, measure in store_position(all_sky_values, pointings, 
+                                            measures):
+            console.show_measure(text, measure)
             
-    print "Measuring next value: zenith."
+    console.progress(total_positions - 1, total_positions, "zenith")
     
-    measure = ser.get_sqm_measure()
+    console.countdown(delays[-1], 
+                      "Waiting %d seconds to move to the zenith.")
+            
+    console.message("Measuring next value: zenith.")
     
-    all_sky_values.zenith = measure
+    console.show_measure(*store_zenith(all_sky_values, 
+                                       ser.get_sqm_measure()))
     
-    logging.info("Measure: zenith is %s" % measure)
+    console.progress(total_positions, total_positions, "done")
     
     # Save to files in different formats.
-    all_sky_values.save_as_list(output_filename, sqm_config.info)
-    all_sky_values.save_as_list_by_vertical(output_filename, sqm_config.info)
\ No newline at end of file
+    save_all_sky(all_sky_values, output_filename, sqm_config)
+    
+    return all_sky_values
\ No newline at end of file
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Reloads the configuration file while the measures are running."""
+
+import os
+import logging
+import signal
+
+from config import SQMControlCfg, SQMControlException
+
+class ConfigWatcher(object):
+    """Watches the configuration file and reloads it when it changes or when
+    a SIGHUP signal is received.
+
+    The new configuration is read and checked completely before being applied,
+    if it is not valid the running configuration is not modified.
+    """
+
+    # These parameters determine the structure of the session.
+    _FIXED_PARAMETERS = ( "mode", "order", "plan", "night", "latitude",
+                          "longitude", "rig", "cadence" )
+
+    def __init__(self, sqm_config):
+        """Initializes the watcher.
+
+        Args:
+            sqm_config: Configuration parameters in use, updated on reloads.
+        """
+
+        self._sqm_config = sqm_config
+        self._reload_requested = False
+        self._mtime = self._get_mtime()
+
+        self._install_signal_handler()
+
+    def _get_mtime(self):
+        """Returns the modification time of the configuration file."""
+
+        try:
+            mtime = os.path.getmtime(self._sqm_config.file_name)
+        except OSError:
+            mtime = None
+
+        return mtime
+
+    def _install_signal_handler(self):
+        """Request a reload when SIGHUP is received, if available."""
+
+        if hasattr(signal, "SIGHUP"):
+            try:
+                signal.signal(signal.SIGHUP, self._on_sighup)
+
+                # The system calls interrupted by the signal are restarted.
+                signal.siginterrupt(signal.SIGHUP, False)
+            except ValueError:
+                # Signals can only be set from the main thread.
+                logging.debug("SIGHUP handler not installed, not main thread.")
+
+    def _on_sighup(self, signum, frame):
+
+        self._reload_requested = True
+
+    def _fixed_value(self, sqm_config, name):
+        """Returns the value of a parameter that can't be changed, None if it
+        hasn't been provided.
+        """
+
+        try:
+            value = getattr(sqm_config, name)
+        except (KeyError, ValueError):
+            value = None
+
+        return value
+
+    def check(self, output_file=None, console=None):
+        """Reloads the configuration if it has been requested or the file has
+        been modified. To be called at the scheduling boundaries.
+
+        Args:
+            output_file: Output file to write the reloads as comments, or
+                any object with a write_com method.
+            console: Console to show the reloads, for the modes without an
+                output file.
+
+        Returns:
+            True if a new configuration has been applied.
+        """
+
+        applied = False
+
+        mtime = self._get_mtime()
+
+        if self._reload_requested or mtime != self._mtime:
+
+            self._reload_requested = False
+            self._mtime = mtime
+
+            try:
+                new_config = SQMControlCfg(self._sqm_config.file_name)
+
+                fixed = [ p for p in ConfigWatcher._FIXED_PARAMETERS
+                          if self._fixed_value(new_config, p) !=
+                          self._fixed_value(self._sqm_config, p) ]
+
+                if len(fixed) > 0:
+                    raise SQMControlException(
+                        "%s can't be changed while measuring" %
+                        ", ".join(fixed))
+
+                changes = self._sqm_config.update(new_config)
+
+                msg = "Configuration reloaded: %s" % \
+                    (", ".join(changes) if len(changes) > 0 else "no changes")
+
+                applied = True
+
+                logging.info(msg)
+
+            except SQMControlException as sce:
+                msg = "Configuration reload rejected: %s" % sce
+
+                logging.warning(msg)
+
+            if output_file is not None:
+                output_file.write_com(msg)
+
+            if console is not None:
+                console.message(msg)
+
+        return applied
@@ -20,6 +20,7 @@
 """This module provides some functions on text files. """
 
 import os
+import math
 import logging
 import csv
 
@@ -50,6 +51,17 @@ class SQMControlCfg(object):
     _PLOT_COLORS_PAR_NAME = "PLOT_COLORS"
     _INFO_PAR_NAME = "INFO"
     _BEEP_PAR_NAME = "BEEP"
+    _BURST_PAR_NAME = "BURST"
+    _RETRIES_PAR_NAME = "RETRIES"
+    _LATENCY_BUDGET_PAR_NAME = "LATENCY_BUDGET"
+    _PLAN_PAR_NAME = "PLAN"
+    _NIGHT_PAR_NAME = "NIGHT"
+    _LATITUDE_PAR_NAME = "LATITUDE"
+    _LONGITUDE_PAR_NAME = "LONGITUDE"
+    _RIG_PAR_NAME = "RIG"
+    _CADENCE_PAR_NAME = "CADENCE"
+    _MAX_PERIODICITY_PAR_NAME = "MAX_PERIODICITY"
+    _ADAPTIVE_STEP_PAR_NAME = "ADAPTIVE_STEP"
     
     # Valid values for each parameter.
     _MODE_CONTINUOUS_NAME = "CONTINUOUS"
@@ -64,9 +76,33 @@ class SQMControlCfg(object):
     _ORDER_VALUES = ( "AZIMUTH", "ZENITH" )
     _PLOT_COLORS_VALUES = ( "FIXED", "EXTEND" )       
     _BEEP_VALUES = ( "YES", "NO" )
+    _BURST_MAX_VALUE = 100
+    _RETRIES_MAX_VALUE = 10
+    _LATENCY_BUDGET_MAX_VALUE = 60
+    _PLAN_VALUES = ( "RASTER", "SERPENTINE", "NEAREST" )
+    _NIGHT_VALUES = ( "ALWAYS", "CIVIL", "NAUTICAL", "ASTRONOMICAL" )
+    _LATITUDE_MAX_VALUE = 90
+    _LONGITUDE_MAX_VALUE = 180
+    _CADENCE_VALUES = ( "FIXED", "ADAPTIVE" )
+    _ADAPTIVE_STEP_MAX_VALUE = 5
+    
+    # Separators of the devices of the rig and of the device and its pointing.
+    _RIG_DEVICES_SEP = ","
+    _RIG_POINTING_SEP = ":"
+    
+    # Default values of the optional parameters.
+    _BURST_DEFAULT = 1
+    _RETRIES_DEFAULT = 3
+    _LATENCY_BUDGET_DEFAULT = 2.0
+    _PLAN_DEFAULT = _PLAN_VALUES[0]
+    _NIGHT_DEFAULT = _NIGHT_VALUES[0]
+    _CADENCE_DEFAULT = _CADENCE_VALUES[0]
+    _ADAPTIVE_STEP_DEFAULT = 0.05
     
     def __init__(self, file_name):
 
+        self._file_name = file_name
+
         self._cfg_params = {}
         
         self._error_params = 0
@@ -84,6 +120,37 @@ class SQMControlCfg(object):
     def __str__(self):        
         return str(self._cfg_params)
     
+    @property
+    def file_name(self):
+        return self._file_name
+    
+    def update(self, new_config):
+        """Replace the parameters with those of other configuration.
+        
+        The whole set of parameters is replaced at once, so a configuration
+        already validated is never seen partially applied.
+        
+        Args:
+            new_config: Configuration, already checked, to take the values from.
+            
+        Returns:
+            A list of strings describing the parameters changed.
+        """
+        
+        changes = []
+        
+        for param_name in sorted(new_config._cfg_params):
+            old_value = self._cfg_params.get(param_name)
+            new_value = new_config._cfg_params[param_name]
+            
+            if old_value != new_value:
+                changes.append("%s: %s -> %s" % 
+                               (param_name, old_value, new_value))
+        
+        self._cfg_params = new_config._cfg_params
+        
+        return changes
+    
     def get_info(self):
         """Returns a string with information about the mode and its parameters.
         """
@@ -96,8 +163,8 @@ class SQMControlCfg(object):
              self.duration)
             
         elif self.mode_all_sky:
-            str = "[Mode: %s]\t[Order: %s]\t[Delay: %s]\t[Delay between az and ve.: %s]" % \
-            (SQMControlCfg._MODE_SKY_NAME, self.order, self.delay,
+            str = "[Mode: %s]\t[Order: %s]\t[Plan: %s]\t[Delay: %s]\t[Delay between az and ve.: %s]" % \
+            (SQMControlCfg._MODE_SKY_NAME, self.order, self.plan, self.delay,
              self.delay_bet_azi_ver)
 
         elif self.mode_one:
@@ -175,6 +242,96 @@ class SQMControlCfg(object):
         return self._cfg_params[SQMControlCfg._BEEP_PAR_NAME] == \
             SQMControlCfg._BEEP_VALUES[0]
         
+    @property
+    def burst(self):
+        return int(self._cfg_params.get(SQMControlCfg._BURST_PAR_NAME,
+                                        SQMControlCfg._BURST_DEFAULT))
+        
+    @property
+    def retries(self):
+        return int(self._cfg_params.get(SQMControlCfg._RETRIES_PAR_NAME,
+                                        SQMControlCfg._RETRIES_DEFAULT))
+        
+    @property
+    def latency_budget(self):
+        return float(self._cfg_params.get(
+            SQMControlCfg._LATENCY_BUDGET_PAR_NAME,
+            SQMControlCfg._LATENCY_BUDGET_DEFAULT))
+        
+    @property
+    def plan(self):
+        return self._cfg_params.get(SQMControlCfg._PLAN_PAR_NAME,
+                                    SQMControlCfg._PLAN_DEFAULT)
+    
+    @property
+    def plan_raster(self):
+        return self.plan == SQMControlCfg._PLAN_VALUES[0]
+    
+    @property
+    def plan_serpentine(self):
+        return self.plan == SQMControlCfg._PLAN_VALUES[1]
+    
+    @property
+    def plan_nearest(self):
+        return self.plan == SQMControlCfg._PLAN_VALUES[2]
+
+    @property
+    def night(self):
+        return self._cfg_params.get(SQMControlCfg._NIGHT_PAR_NAME,
+                                    SQMControlCfg._NIGHT_DEFAULT)
+    
+    @property
+    def night_always(self):
+        return self.night == SQMControlCfg._NIGHT_VALUES[0]
+    
+    @property
+    def latitude(self):
+        return float(self._cfg_params[SQMControlCfg._LATITUDE_PAR_NAME])
+    
+    @property
+    def longitude(self):
+        return float(self._cfg_params[SQMControlCfg._LONGITUDE_PAR_NAME])
+    
+    @property
+    def cadence(self):
+        return self._cfg_params.get(SQMControlCfg._CADENCE_PAR_NAME,
+                                    SQMControlCfg._CADENCE_DEFAULT)
+    
+    @property
+    def cadence_adaptive(self):
+        return self.cadence == SQMControlCfg._CADENCE_VALUES[1]
+    
+    @property
+    def max_periodicity(self):
+        return float(self._cfg_params[SQMControlCfg._MAX_PERIODICITY_PAR_NAME])
+    
+    @property
+    def adaptive_step(self):
+        return float(self._cfg_params.get(
+            SQMControlCfg._ADAPTIVE_STEP_PAR_NAME,
+            SQMControlCfg._ADAPTIVE_STEP_DEFAULT))
+    
+    @property
+    def rig(self):
+        """Devices of the rig with the azimuth and vertical offsets of their
+        pointings in degrees, an empty list if there isn't any rig.
+        """
+        
+        rig = []
+        
+        value = self._cfg_params.get(SQMControlCfg._RIG_PAR_NAME, "")
+        
+        for device in value.split(SQMControlCfg._RIG_DEVICES_SEP):
+            fields = [ f.strip() for f in 
+                      device.split(SQMControlCfg._RIG_POINTING_SEP) ]
+            
+            if len(fields[0]) > 0:
+                offsets = [ float(f) for f in fields[1:] ] + [ 0.0, 0.0 ]
+                
+                rig.append((fields[0], offsets[0], offsets[1]))
+            
+        return rig
+
     def _read_cfg_file(self, file_name):
         """Read parameters from a text file containing a pair parameter/value
         in each line separated by an equal character.
@@ -221,10 +378,7 @@ class SQMControlCfg(object):
             err_msg = "Reading configuration file: %s" % (file_name)
             logging.error(err_msg)
             
-            SQMControlException(err_msg)
-            
-            # Assign an empty set.
-            self._cfg_params = set()   
+            raise SQMControlException(err_msg)
 
     def _check_cfg_values(self):
         """Check that all the parameters needed have been supplied and have
@@ -250,8 +404,26 @@ class SQMControlCfg(object):
         
         self._check_beep()  
         
+        self._check_plan()
+        
+        self._check_night()
+        
+        self._check_rig()
+        
+        self._check_cadence()
+        
+        self._check_optional_numeric_value(SQMControlCfg._BURST_PAR_NAME,
+                                           SQMControlCfg._BURST_MAX_VALUE)
+        
+        self._check_optional_numeric_value(SQMControlCfg._RETRIES_PAR_NAME,
+                                           SQMControlCfg._RETRIES_MAX_VALUE)
+        
+        self._check_optional_numeric_value(
+            SQMControlCfg._LATENCY_BUDGET_PAR_NAME,
+            SQMControlCfg._LATENCY_BUDGET_MAX_VALUE, False)
+        
         if self._error_params > 0:            
-            raise SQMControlException("There is one or more errors with ",
+            raise SQMControlException("There is one or more errors with " +
                                       "configuration parameters, see log.")
         
     def _check_mode(self):
@@ -263,12 +435,14 @@ class SQMControlCfg(object):
             m = self.mode
             
             if not m in SQMControlCfg._MODE_VALUES:
+                self._error_params += 1
                 logging.error(
                     "Value '%s' not valid for '%s'. Valid values are: %s" %
                     (m, SQMControlCfg._MODE_PAR_NAME, 
                      SQMControlCfg._MODE_VALUES))
                 
         except KeyError as ke:
+            self._error_params += 1
             logging.error("%s parameter is required." % 
                           SQMControlCfg._MODE_PAR_NAME)
        
@@ -280,9 +454,11 @@ class SQMControlCfg(object):
         try:          
             self._check_numeric_value(self.periodicity,
                                       SQMControlCfg._PERIODICITY_PAR_NAME,
-                                      SQMControlCfg._PERIODICITY_MAX_VALUE)
+                                      SQMControlCfg._PERIODICITY_MAX_VALUE,
+                                      False)
             
         except KeyError as ke:            
+            self._error_params += 1
             logging.error("%s parameter is required." %
                 SQMControlCfg._PERIODICITY_PAR_NAME)
     
@@ -294,9 +470,11 @@ class SQMControlCfg(object):
         try:          
             self._check_numeric_value(self.duration, 
                                       SQMControlCfg._DURATION_PAR_NAME,
-                                      SQMControlCfg._DURATION_MAX_VALUE)
+                                      SQMControlCfg._DURATION_MAX_VALUE,
+                                      False)
             
         except KeyError as ke:
+            self._error_params += 1
             logging.error("%s parameter is required." %
                 SQMControlCfg._DURATION_PAR_NAME)  
     
@@ -311,25 +489,50 @@ class SQMControlCfg(object):
                                       SQMControlCfg._REPETITIONS_MAX_VALUE)
             
         except KeyError as ke:
+            self._error_params += 1
             logging.error("%s parameter is required." %
                 SQMControlCfg._REPETITIONS_PAR_NAME)   
         
-    def _check_numeric_value(self, par_value, par_name, max_value):
+    def _check_numeric_value(self, par_value, par_name, max_value,
+                             integer=True):
         """Check this parameter has been provided and with a valid value.
+        
+        Args:
+            par_value: Value of the parameter.
+            par_name: Name of the parameter.
+            max_value: Maximum value valid.
+            integer: True if the value must be an integer, otherwise 
+                fractional values are accepted.
                     
         """
         
+        num_val = None
+        
         # Check it is a number.
         if par_value.isdigit():
-            
-            # Check it has a valid value.
             num_val = int(par_value)
+        elif not integer:
+            try:
+                num_val = float(par_value)
+            except ValueError:
+                pass
+            
+            # nan and inf pass the comparisons of the range.
+            if num_val is not None and \
+                (math.isnan(num_val) or math.isinf(num_val)):
+                num_val = None
+            
+        if num_val is not None:
             
+            # Check it has a valid value.
             if num_val <= 0 or num_val > max_value:
-                logging.error("'%s' parameter value %d is invalid [1-%d]." %
-                              (par_name, num_val, max_value))
+                self._error_params += 1
+                logging.error("'%s' parameter value %s is invalid (0-%d]." %
+                              (par_name, par_value, max_value))
         else:
-            logging.error("%s parameter must be numeric." % par_name)
+            self._error_params += 1
+            logging.error("%s parameter must be %s." % 
+                          (par_name, "an integer" if integer else "numeric"))
             
     def _check_delay(self):
         """Check this parameter has been provided and with a valid value.
@@ -342,6 +545,7 @@ class SQMControlCfg(object):
                                       SQMControlCfg._DELAY_MAX_VALUE)
             
         except KeyError as ke:
+            self._error_params += 1
             logging.error("%s parameter is required." %
                 SQMControlCfg._DELAY_PAR_NAME)   
             
@@ -356,6 +560,7 @@ class SQMControlCfg(object):
                                       SQMControlCfg._DELAY_BET_AZI_VER_MAX_VALUE)
             
         except KeyError as ke:
+            self._error_params += 1
             logging.error("%s parameter is required." %
                 SQMControlCfg._DELAY_BET_AZI_VER_PAR_NAME)           
     
@@ -368,11 +573,13 @@ class SQMControlCfg(object):
             m = self.order
             
             if not m in SQMControlCfg._ORDER_VALUES:
+                self._error_params += 1
                 logging.error("Value '%s' not valid for '%s'. Valid values are: %s" %
                     (m, SQMControlCfg._ORDER_PAR_NAME, 
                      SQMControlCfg._ORDER_VALUES))
                 
         except KeyError as ke:
+            self._error_params += 1
             logging.error("%s parameter is required." %
                 SQMControlCfg._ORDER_PAR_NAME)
          
@@ -383,36 +590,186 @@ class SQMControlCfg(object):
             m = self.plot_colors
             
             if not m in SQMControlCfg._PLOT_COLORS_VALUES:
+                self._error_params += 1
                 logging.error("Value '%s' not valid for '%s'. Valid values are: %s" %
                     (m, SQMControlCfg._PLOT_COLORS_PAR_NAME, 
                      SQMControlCfg._PLOT_COLORS_VALUES))
                 
         except KeyError as ke:
+           self._error_params += 1
            logging.error("%s parameter is required." %
                 SQMControlCfg._PLOT_COLORS_PAR_NAME) 
            
     def _check_beep(self):
+        """Check this parameter has been provided and with a valid value."""
+        
         try:
-            m = self.beep
+            m = self._cfg_params[SQMControlCfg._BEEP_PAR_NAME]
             
             if not m in SQMControlCfg._BEEP_VALUES:
+                self._error_params += 1
                 logging.error("Value '%s' not valid for '%s'. Valid values are: %s" %
                     (m, SQMControlCfg._BEEP_PAR_NAME, 
                      SQMControlCfg._BEEP_VALUES))
                 
         except KeyError as ke:
+           self._error_params += 1
            logging.error("%s parameter is required." %
                 SQMControlCfg._BEEP_PAR_NAME)         
            
+    def _check_plan(self):
+        """Check the value of this parameter if it has been provided."""
+        
+        if not self.plan in SQMControlCfg._PLAN_VALUES:
+            self._error_params += 1
+            logging.error("Value '%s' not valid for '%s'. Valid values are: %s" %
+                (self.plan, SQMControlCfg._PLAN_PAR_NAME, 
+                 SQMControlCfg._PLAN_VALUES))
+           
+    def _check_night(self):
+        """Check the value of this parameter if it has been provided, and
+        that the site is provided to measure only at night.
+        """
+        
+        if not self.night in SQMControlCfg._NIGHT_VALUES:
+            self._error_params += 1
+            logging.error("Value '%s' not valid for '%s'. Valid values are: %s" %
+                (self.night, SQMControlCfg._NIGHT_PAR_NAME, 
+                 SQMControlCfg._NIGHT_VALUES))
+            
+        elif not self.night_always:
+            self._check_coordinate(SQMControlCfg._LATITUDE_PAR_NAME,
+                                   SQMControlCfg._LATITUDE_MAX_VALUE)
+            
+            self._check_coordinate(SQMControlCfg._LONGITUDE_PAR_NAME,
+                                   SQMControlCfg._LONGITUDE_MAX_VALUE)
+            
+    def _check_cadence(self):
+        """Check the value of this parameter if it has been provided, and
+        the bounds of the adaptive cadence.
+        """
+        
+        if not self.cadence in SQMControlCfg._CADENCE_VALUES:
+            self._error_params += 1
+            logging.error("Value '%s' not valid for '%s'. Valid values are: %s" %
+                (self.cadence, SQMControlCfg._CADENCE_PAR_NAME, 
+                 SQMControlCfg._CADENCE_VALUES))
+            
+        elif self.cadence_adaptive:
+            errors = self._error_params
+            
+            try:
+                self._check_numeric_value(
+                    self._cfg_params[SQMControlCfg._MAX_PERIODICITY_PAR_NAME],
+                    SQMControlCfg._MAX_PERIODICITY_PAR_NAME,
+                    SQMControlCfg._PERIODICITY_MAX_VALUE, False)
+                
+                if self._error_params == errors and \
+                    self.max_periodicity < float(self.periodicity):
+                    self._error_params += 1
+                    logging.error("%s must not be lower than %s." %
+                                  (SQMControlCfg._MAX_PERIODICITY_PAR_NAME,
+                                   SQMControlCfg._PERIODICITY_PAR_NAME))
+                
+            except KeyError as ke:
+                self._error_params += 1
+                logging.error("%s parameter is required for the adaptive "
+                              "cadence." % 
+                              SQMControlCfg._MAX_PERIODICITY_PAR_NAME)
+                
+            except ValueError as ve:
+                # The periodicity has already been reported as invalid.
+                pass
+                
+            self._check_optional_numeric_value(
+                SQMControlCfg._ADAPTIVE_STEP_PAR_NAME,
+                SQMControlCfg._ADAPTIVE_STEP_MAX_VALUE, False)
+           
+    def _check_rig(self):
+        """Check the value of this parameter if it has been provided, a 
+        device and the optional azimuth and vertical offsets of its pointing
+        for each SQM of the rig.
+        """
+        
+        try:
+            rig = self.rig
+            
+            devices = [ d for d, az, vert in rig ]
+            
+            for d, az, vert in rig:
+                if math.isnan(az) or math.isinf(az) or \
+                    math.isnan(vert) or math.isinf(vert):
+                    raise ValueError("Offset not finite.")
+            
+            if len(set(devices)) != len(devices):
+                self._error_params += 1
+                logging.error("Devices repeated in '%s'." % 
+                              SQMControlCfg._RIG_PAR_NAME)
+                
+        except ValueError as ve:
+            self._error_params += 1
+            logging.error("Value '%s' not valid for '%s'. Valid values are "
+                          "device[:azimuth[:vertical]] separated by '%s'." %
+                (self._cfg_params[SQMControlCfg._RIG_PAR_NAME],
+                 SQMControlCfg._RIG_PAR_NAME, SQMControlCfg._RIG_DEVICES_SEP))
+           
+    def _check_coordinate(self, par_name, max_value):
+        """Check this parameter has been provided with a value in degrees
+        between -max_value and max_value.
+        
+        Args:
+            par_name: Name of the parameter.
+            max_value: Maximum absolute value valid.
+        
+        """
+        
+        try:
+            value = float(self._cfg_params[par_name])
+            
+            if math.isnan(value) or abs(value) > max_value:
+                self._error_params += 1
+                logging.error("'%s' parameter value %s is invalid [-%d, %d]." %
+                              (par_name, value, max_value, max_value))
+                
+        except KeyError as ke:
+            self._error_params += 1
+            logging.error("%s parameter is required to measure only at "
+                          "night." % par_name)
+            
+        except ValueError as ve:
+            self._error_params += 1
+            logging.error("%s parameter must be numeric." % par_name)
+           
+    def _check_optional_numeric_value(self, par_name, max_value, 
+                                      integer=True):
+        """Check the value of an optional parameter if it has been provided.
+        
+        Args:
+            par_name: Name of the parameter.
+            max_value: Maximum value valid.
+            integer: True if the value must be an integer.
+        
+        """
+        
+        if par_name in self._cfg_params:
+            self._check_numeric_value(self._cfg_params[par_name], par_name,
+                                      max_value, integer)
+           
     def str_continuous_par(self):
         """Returns a string with the values of the continuous mode."""
         
-        return "Mode %s - Periodicity: %s - Duration: %s" % \
+        return "Mode %s - Periodicity: %s - Duration: %s - Burst: %d - " \
+            "Night: %s - Cadence: %s" % \
             (SQMControlCfg._MODE_CONTINUOUS_NAME, self.periodicity, 
-             self.duration)
+             self.duration, self.burst, self.night, 
+             self.cadence if not self.cadence_adaptive else 
+             "%s %s-%s s step %s" % (self.cadence, self.periodicity, 
+                                     self.max_periodicity, 
+                                     self.adaptive_step))
         
     def str_all_sky_par(self):
         """Returns a string with the values of the all sky mode."""
         
-        return "Mode %s - Repetitions: %s - Order: %s" % \
-            (SQMControlCfg._MODE_SKY_NAME, self.repetitions, self.order)       
\ No newline at end of file
+        return "Mode %s - Repetitions: %s - Order: %s - Plan: %s - Rig: %d" % \
+            (SQMControlCfg._MODE_SKY_NAME, self.repetitions, self.order,
+             self.plan, max(1, len(self.rig)))       
\ No newline at end of file
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Shows the progress of the measures in the terminal."""
+
+import time
+
+class PlainConsole(object):
+    """Prints the messages of the measures as they happen."""
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def message(self, text):
+        """Show a message about the measures.
+
+        Args:
+            text: Text of the message.
+        """
+
+        print text
+
+    def show_measure(self, text, measure=None, measure_time=None):
+        """Show a measure taken.
+
+        Args:
+            text: Text describing the measure.
+            measure: Value measured.
+            measure_time: Time of the measure in seconds since the epoch.
+        """
+
+        print text
+
+    def show_gap(self, text):
+        """Show a measure that couldn't be taken.
+
+        Args:
+            text: Text describing the gap.
+        """
+
+        print text
+
+    def progress(self, done, total, label):
+        """Show the progress of a sequence of measures.
+
+        Args:
+            done: Number of measures done.
+            total: Number of measures of the sequence.
+            label: Text describing the current measure.
+        """
+
+        pass
+
+    def show_countdown(self, seconds, msg_format):
+        """Show the time remaining of a wait without waiting, for the
+        callers that wait by themselves.
+
+        Args:
+            seconds: Time remaining in seconds, 0 when the wait ends.
+            msg_format: Message to show with the seconds remaining.
+        """
+
+        if seconds > 0:
+            print msg_format % seconds
+
+    def countdown(self, seconds, msg_format, last_second_callback=None):
+        """Wait the seconds indicated showing the time remaining.
+
+        Args:
+            seconds: Time to wait in seconds.
+            msg_format: Message to show with the seconds remaining.
+            last_second_callback: Function to call a second before the end.
+        """
+
+        whole_seconds = int(seconds)
+
+        for i in range(whole_seconds):
+            print msg_format % (whole_seconds - i)
+
+            if i == whole_seconds - 1 and last_second_callback is not None:
+                last_second_callback()
+
+            time.sleep(1)
+
+        # Wait the fraction of second remaining.
+        if whole_seconds == 0 and last_second_callback is not None:
+            last_second_callback()
+
+        time.sleep(seconds - whole_seconds)
@@ -0,0 +1,506 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Runs sqmcontrol as a daemon controlled through a Unix socket.
+
+The daemon keeps the SQM open and receives commands as JSON objects, one per
+line, answering each of them with another JSON object in a line. The
+commands are:
+
+    {"command": "status"}
+    {"command": "read"}
+    {"command": "recent", "count": 10}
+    {"command": "recent", "seconds": 60}
+    {"command": "recent", "seconds": 86400, "points": 500}
+    {"command": "start_continuous"}
+    {"command": "start_all_sky"}
+    {"command": "stop"}
+    {"command": "shutdown"}
+
+The readings of recent are reduced to the number of points given keeping
+their shape, if there are more.
+
+Used as a script it sends a command to a daemon running and prints the
+answer, for example:
+
+    python daemon.py read
+    python daemon.py recent count=5
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import logging
+import argparse
+import threading
+import SocketServer
+
+from sqmserial import SerialPort, SerialPortException
+from outfile import OutputFileException
+from sprogargs import ProgramArguments
+from ringbuffer import ReadingsRingBuffer, DEFAULT_CAPACITY
+
+DEFAULT_SOCKET_PATH = ProgramArguments.DEFAULT_SOCKET_PATH
+
+# Permissions of the socket, only the user running the daemon can control it.
+DEFAULT_SOCKET_MODE = 0o600
+
+class SQMDaemonException(Exception):
+
+    def __init__(self, msg):
+
+        self._msg = msg
+
+    def __str__(self):
+
+        return self._msg
+
+class _LockedSerialPort(object):
+    """Serializes the access to the SQM from the jobs and the clients.
+
+    The temperature of each measure is kept for the thread that has taken
+    it, so a measure of another thread can't change it.
+    """
+
+    def __init__(self, ser):
+
+        self._ser = ser
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def measure_and_temperature(self):
+        """Returns the measure taken and its temperature."""
+
+        with self._lock:
+            measure = self._ser.get_sqm_measure()
+            temperature = self._ser.last_temperature
+
+        self._local.temperature = temperature
+
+        return measure, temperature
+
+    def get_sqm_measure(self):
+
+        return self.measure_and_temperature()[0]
+
+    @property
+    def device(self):
+        return self._ser.device
+
+    @property
+    def last_temperature(self):
+        """Temperature of the last measure taken by the current thread."""
+        return getattr(self._local, "temperature", None)
+
+class SQMDaemon(object):
+    """Keeps the SQM open and performs the measures requested by clients."""
+
+    def __init__(self, sqm_config, socket_path=DEFAULT_SOCKET_PATH,
+                 shm_path=None, rollup_dir=None, raw_archive=None,
+                 memory_interval=None, socket_mode=DEFAULT_SOCKET_MODE):
+        """Initializes the daemon.
+
+        Args:
+            sqm_config: Configuration parameters.
+            socket_path: Path of the Unix socket to listen for commands.
+            shm_path: Path of the shared memory segment to publish the
+                readings, not published if None.
+            rollup_dir: Directory of the rollups of the readings, not kept
+                if None.
+            raw_archive: File of the archive of the raw replies, not kept
+                if None.
+            memory_interval: Seconds between the samples of the memory
+                used, not monitored if None.
+            socket_mode: Permissions of the socket.
+        """
+
+        self._sqm_config = sqm_config
+        self._socket_path = socket_path
+        self._socket_mode = socket_mode
+        self._serial_port = SerialPort()
+        self._ser = _LockedSerialPort(self._serial_port)
+        self._recent = ReadingsRingBuffer(DEFAULT_CAPACITY)
+        self._sinks = [ self._recent ]
+        self._publisher = None
+
+        if shm_path is not None:
+            from shmpub import SharedReadingsPublisher
+
+            self._publisher = SharedReadingsPublisher(shm_path)
+            self._sinks.append(self._publisher)
+
+        self._rollups = None
+
+        if rollup_dir is not None:
+            from rollup import RollupSink
+
+            self._rollups = RollupSink(rollup_dir)
+            self._sinks.append(self._rollups)
+
+        self._archive = None
+
+        if raw_archive is not None:
+            from rawarchive import RawArchiveWriter
+
+            self._archive = RawArchiveWriter(raw_archive)
+            self._serial_port.set_archive(self._archive)
+
+        self._memory = None
+
+        if memory_interval is not None:
+            from memdiag import MemoryMonitor
+
+            self._memory = MemoryMonitor(memory_interval)
+            self._sinks.append(self._memory)
+
+        self._server = None
+        self._start_time = None
+        self._job = None
+        self._job_name = None
+        self._job_error = None
+        self._stop_event = threading.Event()
+
+        self._commands = { "status" : self._status,
+                           "read" : self._read,
+                           "recent" : self._recent_readings,
+                           "start_continuous" : self._start_continuous,
+                           "start_all_sky" : self._start_all_sky,
+                           "stop" : self._stop,
+                           "shutdown" : self._shutdown }
+
+    def _job_running(self):
+
+        return self._job is not None and self._job.is_alive()
+
+    def _run_job(self, job_function, *args):
+        """Runs a job catching its errors to report them in the status."""
+
+        try:
+            job_function(*args)
+        except (SerialPortException, OutputFileException) as e:
+            logging.error(e)
+            self._job_error = str(e)
+
+    def _start_job(self, job_name, job_function, *args):
+
+        if self._job_running():
+            raise SQMDaemonException("Job '%s' is already running." %
+                                     self._job_name)
+
+        self._stop_event.clear()
+        self._job_name = job_name
+        self._job_error = None
+        self._job = threading.Thread(target=self._run_job,
+                                     args=(job_function,) + args)
+        self._job.daemon = True
+        self._job.start()
+
+        logging.info("Job started: %s" % job_name)
+
+        return { "job" : job_name }
+
+    def _status(self, request):
+
+        return { "device" : self._ser.device,
+                 "mode" : self._sqm_config.mode,
+                 "uptime" : time.time() - self._start_time,
+                 "job" : self._job_name if self._job_running() else None,
+                 "last_job" : self._job_name,
+                 "last_job_error" : self._job_error,
+                 "readings" : len(self._recent) }
+
+    def _read(self, request):
+
+        measure_time = time.time()
+
+        measure, temperature = self._ser.measure_and_temperature()
+
+        if measure is not None:
+            for sink in self._sinks:
+                sink.add_reading(measure_time, measure, temperature)
+
+        return { "time" : measure_time, "measure" : measure,
+                 "temperature" : temperature }
+
+    def _recent_readings(self, request):
+
+        if "seconds" in request:
+            times, magnitudes, temperatures = \
+                self._recent.since(float(request["seconds"]), time.time(),
+                                   copy=True)
+        else:
+            times, magnitudes, temperatures = \
+                self._recent.last(int(request.get("count", 1)), copy=True)
+
+        # Only the points that keep the shape of the readings are sent.
+        if "points" in request and len(times) > int(request["points"]):
+            from decimate import lttb_indexes
+
+            chosen = lttb_indexes(times, magnitudes, int(request["points"]))
+
+            times = times[chosen]
+            magnitudes = magnitudes[chosen]
+            temperatures = temperatures[chosen]
+
+        # NaN is not valid JSON, temperatures unknown are null.
+        return { "readings" : [ { "time" : t, "measure" : m,
+                                  "temperature" : None if tc != tc else tc }
+                                for t, m, tc in zip(times.tolist(),
+                                                    magnitudes.tolist(),
+                                                    temperatures.tolist()) ] }
+
+    def _start_continuous(self, request):
+
+        from sqmcontrol import continuous_measures, \
+            DEFAULT_CONT_OUT_FILE_NAME, DEFAULT_CONSOLE
+        from nightsched import create_scheduler
+        from adaptive import create_cadence
+
+        return self._start_job("continuous", continuous_measures, self._ser,
+                               self._sqm_config, DEFAULT_CONT_OUT_FILE_NAME,
+                               None, self._sinks, self._stop_event,
+                               DEFAULT_CONSOLE,
+                               create_scheduler(self._sqm_config),
+                               create_cadence(self._sqm_config))
+
+    def _start_all_sky(self, request):
+
+        from sqmcontrol import DEFAULT_SKY_OUT_FILE_NAME
+        from allsky import all_sky_measures
+
+        return self._start_job("all_sky", all_sky_measures, self._ser,
+                               self._sqm_config, DEFAULT_SKY_OUT_FILE_NAME)
+
+    def _stop(self, request):
+
+        if not self._job_running():
+            raise SQMDaemonException("There is no job running.")
+
+        # All sky sessions are not interrupted, they finish the session.
+        self._stop_event.set()
+
+        return { "job" : self._job_name }
+
+    def _shutdown(self, request):
+
+        self._stop_event.set()
+
+        # The server must be shut down from other thread than the serving one.
+        threading.Thread(target=self._server.shutdown).start()
+
+        return {}
+
+    def process_request(self, request):
+        """Process a request received from a client.
+
+        Args:
+            request: Dictionary with the request.
+
+        Returns:
+            A dictionary with the answer.
+        """
+
+        try:
+            if not isinstance(request, dict):
+                raise SQMDaemonException("Request must be an object: %s" %
+                                         json.dumps(request))
+
+            command = self._commands.get(request.get("command"))
+
+            if command is None:
+                raise SQMDaemonException("Unknown command: %s" %
+                                         request.get("command"))
+
+            answer = command(request)
+            answer["ok"] = True
+
+        except (SQMDaemonException, SerialPortException, ValueError) as e:
+            answer = { "ok" : False, "error" : str(e) }
+
+        # Any other error is answered too, the client must get a reply and
+        # the daemon go on.
+        except Exception as e:
+            logging.exception("Processing request %r" % (request,))
+
+            answer = { "ok" : False, "error" : "%s: %s" %
+                       (type(e).__name__, e) }
+
+        return answer
+
+    def serve(self):
+        """Open the SQM and attend the requests until shutdown."""
+
+        self._serial_port.init_port()
+        self._serial_port.open()
+        self._serial_port.set_retry_policy(self._sqm_config.retries,
+                                           self._sqm_config.latency_budget)
+
+        if os.path.exists(self._socket_path):
+            os.remove(self._socket_path)
+
+        self._server = _SQMServer(self._socket_path, self, self._socket_mode)
+        self._start_time = time.time()
+
+        try:
+            signal.signal(signal.SIGTERM, self._on_sigterm)
+        except ValueError:
+            # Signals can only be set from the main thread.
+            logging.debug("SIGTERM handler not installed, not main thread.")
+
+        msg = "Daemon listening at %s" % self._socket_path
+        logging.info(msg)
+        print msg
+
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            logging.debug("Exiting from daemon by Ctrl-C.")
+        finally:
+            self._stop_event.set()
+            self._server.server_close()
+            self._serial_port.close()
+
+            if self._publisher is not None:
+                self._publisher.close()
+
+            if self._rollups is not None:
+                self._rollups.close()
+
+            if self._archive is not None:
+                self._archive.close()
+
+            if self._memory is not None:
+                self._memory.close()
+
+            if os.path.exists(self._socket_path):
+                os.remove(self._socket_path)
+
+    def _on_sigterm(self, signum, frame):
+
+        self._shutdown({})
+
+class _SQMRequestHandler(SocketServer.StreamRequestHandler):
+    """Reads requests in JSON, one per line, and writes the answers."""
+
+    def handle(self):
+
+        for line in self.rfile:
+
+            if len(line.strip()) == 0:
+                continue
+
+            try:
+                request = json.loads(line)
+
+                answer = self.server.sqm_daemon.process_request(request)
+            except ValueError as ve:
+                answer = { "ok" : False, "error" : "Invalid JSON: %s" % ve }
+
+            self.wfile.write(json.dumps(answer) + "\n")
+            self.wfile.flush()
+
+class _SQMServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, sqm_daemon, socket_mode):
+
+        self.sqm_daemon = sqm_daemon
+        self.socket_mode = socket_mode
+
+        SocketServer.UnixStreamServer.__init__(self, socket_path,
+                                               _SQMRequestHandler)
+
+    def server_bind(self):
+        """Create the socket with its permissions, without a moment with
+        those of the umask.
+        """
+
+        previous_umask = os.umask(0o777 & ~self.socket_mode)
+
+        try:
+            SocketServer.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(previous_umask)
+
+        os.chmod(self.server_address, self.socket_mode)
+
+def send_command(command, socket_path=DEFAULT_SOCKET_PATH, **params):
+    """Send a command to the daemon and returns its answer.
+
+    Args:
+        command: Name of the command.
+        socket_path: Path of the Unix socket of the daemon.
+        params: Parameters of the command.
+
+    Returns:
+        A dictionary with the answer.
+    """
+
+    request = dict(params)
+    request["command"] = command
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        sock.connect(socket_path)
+
+        sock_file = sock.makefile("rw")
+        sock_file.write(json.dumps(request) + "\n")
+        sock_file.flush()
+
+        answer = json.loads(sock_file.readline())
+
+        sock_file.close()
+    finally:
+        sock.close()
+
+    return answer
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Send a command to the " +
+                                     "sqmcontrol daemon.")
+
+    parser.add_argument("-s", dest="socket_path", default=DEFAULT_SOCKET_PATH,
+                        help="Unix socket of the daemon.")
+
+    parser.add_argument("command", help="Command to send.")
+
+    parser.add_argument("params", nargs="*", metavar="name=value",
+                        help="Parameters of the command.")
+
+    args = parser.parse_args()
+
+    try:
+        params = dict([ p.split("=", 1) for p in args.params ])
+
+        print json.dumps(send_command(args.command, args.socket_path,
+                                      **params), indent=2)
+
+    except ValueError:
+        print "Parameters must be given as name=value."
+        sys.exit(1)
+    except socket.error as se:
+        print "Error connecting to daemon at %s: %s" % (args.socket_path, se)
+        sys.exit(1)
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Live status view of the measures in the terminal.
+
+The dashboard is redrawn from its own thread at a fixed rate, the measures
+only store the values to show, so the output to the terminal never delays
+the measures whatever their cadence or the speed of the terminal.
+"""
+
+import sys
+import time
+import threading
+
+import numpy as np
+
+from console import PlainConsole
+from ringbuffer import ReadingsRingBuffer
+
+class Dashboard(PlainConsole):
+    """Status view of the measures redrawn at a fixed rate."""
+
+    # Seconds between redraws.
+    REFRESH_PERIOD = 0.5
+
+    # Number of readings shown in the sparkline.
+    SPARKLINE_WIDTH = 60
+
+    SPARKLINE_CHARS = u"▁▂▃▄▅▆▇█"
+
+    PROGRESS_BAR_WIDTH = 40
+
+    # ANSI sequences to move the cursor home and clear the screen.
+    _CLEAR_SCREEN = "\x1b[H\x1b[J"
+
+    def __init__(self, readings=None, periodicity=None, out=sys.stdout):
+        """Initializes the dashboard.
+
+        Args:
+            readings: Ring buffer with the recent readings, if not provided
+                the dashboard keeps the measures shown.
+            periodicity: Expected seconds between measures, if any.
+            out: File to draw the dashboard.
+        """
+
+        self._own_readings = readings is None
+
+        if self._own_readings:
+            readings = ReadingsRingBuffer(Dashboard.SPARKLINE_WIDTH)
+
+        self._readings = readings
+        self._periodicity = periodicity
+        self._out = out
+        self._status = ""
+        self._last_measure = ""
+        self._gaps = 0
+        self._progress = None
+        self._countdown_end = None
+        self._countdown_format = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start drawing the dashboard in its own thread."""
+
+        self._stop_event.clear()
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop drawing the dashboard, drawing it a last time."""
+
+        self._stop_event.set()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+
+        while not self._stop_event.is_set():
+            self._draw()
+
+            self._stop_event.wait(Dashboard.REFRESH_PERIOD)
+
+        self._draw()
+
+    # The methods called from the measures only store the values to show.
+    def message(self, text):
+
+        self._status = text
+
+    def show_measure(self, text, measure=None, measure_time=None):
+
+        self._last_measure = text
+
+        if self._own_readings and measure is not None:
+            self._readings.add_reading(
+                time.time() if measure_time is None else measure_time,
+                measure)
+
+    def show_gap(self, text):
+
+        self._gaps += 1
+        self._status = text
+
+    def progress(self, done, total, label):
+
+        self._progress = (done, total, label)
+
+    def show_countdown(self, seconds, msg_format):
+
+        self._countdown_format = msg_format
+        self._countdown_end = time.time() + seconds if seconds > 0 else None
+
+    def countdown(self, seconds, msg_format, last_second_callback=None):
+
+        self._countdown_format = msg_format
+        self._countdown_end = time.time() + seconds
+
+        if seconds >= 1 and last_second_callback is not None:
+            time.sleep(seconds - 1)
+            last_second_callback()
+            time.sleep(1)
+        else:
+            if last_second_callback is not None:
+                last_second_callback()
+
+            time.sleep(seconds)
+
+        self._countdown_end = None
+
+    def _sparkline(self, magnitudes):
+        """Returns a line of characters with the heights of the values."""
+
+        line = u""
+
+        valid = magnitudes[np.isfinite(magnitudes)]
+
+        if len(valid) > 0:
+            low = valid.min()
+            span = valid.max() - low
+
+            levels = len(Dashboard.SPARKLINE_CHARS) - 1
+
+            for m in valid:
+                level = int(round((m - low) / span * levels)) if span > 0 \
+                    else levels // 2
+                line += Dashboard.SPARKLINE_CHARS[level]
+
+            line += u"  [%.2f - %.2f]" % (low, low + span)
+
+        return line
+
+    def _cadence(self, times):
+        """Returns a line describing the intervals between measures."""
+
+        line = "Cadence: -"
+
+        if len(times) > 1:
+            intervals = np.diff(times)
+
+            line = "Cadence: %.3f s mean, %.3f s max" % \
+                (intervals.mean(), intervals.max())
+
+            if self._periodicity is not None:
+                late = np.count_nonzero(intervals > 1.5 * self._periodicity)
+
+                line += " (expected %.3f s, %d late)" % \
+                    (self._periodicity, late)
+
+        return line + ", gaps: %d" % self._gaps
+
+    def _progress_bar(self):
+        """Returns a line with the progress of a sequence of measures."""
+
+        done, total, label = self._progress
+
+        filled = Dashboard.PROGRESS_BAR_WIDTH * done // max(total, 1)
+
+        return "Progress: [%s%s] %d/%d %s" % \
+            ("#" * filled, "-" * (Dashboard.PROGRESS_BAR_WIDTH - filled),
+             done, total, label)
+
+    def _draw(self):
+
+        times, magnitudes, temperatures = \
+            self._readings.last(Dashboard.SPARKLINE_WIDTH, copy=True)
+
+        lines = [ "sqmcontrol - %s" % time.strftime("%d-%m-%Y %H:%M:%S") ]
+
+        latest = self._readings.latest()
+
+        if latest is not None:
+            lines.append("Current: %.2f at %s%s" %
+                         (latest[1],
+                          time.strftime("%H:%M:%S", time.localtime(latest[0])),
+                          "" if np.isnan(latest[2]) else
+                          ", temperature %.1f C" % latest[2]))
+        else:
+            lines.append("Current: -")
+
+        lines.append("Last: %s" % self._last_measure)
+        lines.append(self._sparkline(magnitudes).encode("utf-8"))
+        lines.append(self._cadence(times))
+
+        if self._progress is not None:
+            lines.append(self._progress_bar())
+
+        countdown_end = self._countdown_end
+
+        if countdown_end is not None:
+            lines.append(self._countdown_format %
+                         max(0, round(countdown_end - time.time())))
+        else:
+            lines.append(self._status)
+
+        self._out.write(Dashboard._CLEAR_SCREEN + "\n".join(lines) + "\n")
+        self._out.flush()
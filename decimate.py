@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Reduces the continuous measures to a number of points to show them,
+keeping the shape of the series.
+
+Two methods are available, both calculated on arrays for all the buckets at
+once:
+
+* lttb, Largest Triangle Three Buckets, takes the point of each bucket that
+  forms the largest triangle with the point taken in the previous bucket and
+  the mean of the next one. The point of each bucket depends on that of the
+  previous one, so the points of all the buckets are calculated again from
+  those of the previous pass until they don't change.
+* minmax takes the minimum and the maximum of each bucket, an envelope that
+  never loses a peak.
+
+The measures of a file can be decimated once at several zoom levels, kept
+in a file next to it, so any range of times is shown reading only a few
+points.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+# Points returned by default, about two for each pixel of a plot.
+DEFAULT_POINTS = 2000
+
+# Ratio between the points of two consecutive zoom levels.
+ZOOM_FACTOR = 4
+
+# Passes of lttb, it usually converges in a few.
+_MAX_LTTB_PASSES = 20
+
+LTTB_METHOD = "lttb"
+MINMAX_METHOD = "minmax"
+
+PYRAMID_EXT = "dec.npz"
+
+def _bucket_edges(first, last, buckets):
+    """Returns the edges of the buckets splitting the indexes from first to
+    last, not included, in parts of the same size or one less.
+    """
+
+    return np.linspace(first, last, buckets + 1).astype(np.int64)
+
+def _bucket_matrix(edges):
+    """Returns a matrix with the indexes of each bucket in a row and the
+    mask of the indexes valid, the rows of the smaller buckets are filled
+    with their first index.
+    """
+
+    sizes = np.diff(edges)
+
+    columns = np.arange(sizes.max())
+
+    valid = columns[np.newaxis, :] < sizes[:, np.newaxis]
+
+    indexes = np.where(valid, edges[:-1, np.newaxis] + columns[np.newaxis, :],
+                       edges[:-1, np.newaxis])
+
+    return indexes, valid
+
+def lttb_indexes(times, values, points):
+    """Returns the indexes of the points chosen by lttb.
+
+    Args:
+        times: Array of times, in increasing order.
+        values: Array of values.
+        points: Maximum number of points, at least 3.
+
+    Returns:
+        Array of indexes in increasing order.
+    """
+
+    n = len(times)
+
+    if n <= points or points < 3:
+        return np.arange(n) if n <= points else \
+            np.linspace(0, n - 1, points).astype(np.int64)
+
+    # The first and last points are always taken.
+    edges = _bucket_edges(1, n - 1, points - 2)
+
+    indexes, valid = _bucket_matrix(edges)
+
+    # Relative to the first time to keep the precision.
+    t = times - times[0]
+
+    sizes = np.diff(edges).astype(np.float64)
+
+    # The last point is not in any bucket.
+    mean_t = np.add.reduceat(t[:-1], edges[:-1]) / sizes
+    mean_v = np.add.reduceat(values[:-1], edges[:-1]) / sizes
+
+    # The third point of each bucket is the mean of the next one, the last
+    # point for the last bucket.
+    next_t = np.append(mean_t[1:], t[-1])
+    next_v = np.append(mean_v[1:], values[-1])
+
+    candidate_t = t[indexes]
+    candidate_v = values[indexes]
+
+    # Start with the means of the previous buckets as the points taken.
+    previous_t = np.append(t[0], mean_t[:-1])
+    previous_v = np.append(values[0], mean_v[:-1])
+
+    chosen = None
+
+    for _ in range(_MAX_LTTB_PASSES):
+        # Twice the area of the triangles, the factor doesn't matter.
+        areas = np.abs((previous_t - next_t)[:, np.newaxis] *
+                       (candidate_v - previous_v[:, np.newaxis]) -
+                       (previous_t[:, np.newaxis] - candidate_t) *
+                       (next_v - previous_v)[:, np.newaxis])
+
+        areas[~valid] = -1
+
+        new_chosen = indexes[np.arange(len(indexes)), np.argmax(areas, axis=1)]
+
+        if chosen is not None and np.array_equal(new_chosen, chosen):
+            break
+
+        chosen = new_chosen
+
+        previous_t = np.append(t[0], t[chosen[:-1]])
+        previous_v = np.append(values[0], values[chosen[:-1]])
+
+    return np.concatenate(([ 0 ], chosen, [ n - 1 ]))
+
+def minmax_indexes(times, values, points):
+    """Returns the indexes of the minimum and maximum of each bucket.
+
+    Args:
+        times: Array of times, in increasing order.
+        values: Array of values.
+        points: Maximum number of points, at least 2.
+
+    Returns:
+        Array of indexes in increasing order.
+    """
+
+    n = len(times)
+
+    if n <= points or points < 2:
+        return np.arange(n) if n <= points else np.array([ 0, n - 1 ])
+
+    indexes, valid = _bucket_matrix(_bucket_edges(0, n, points // 2))
+
+    bucket_values = values[indexes]
+
+    rows = np.arange(len(indexes))
+
+    lowest = indexes[rows, np.argmin(np.where(valid, bucket_values, np.inf),
+                                     axis=1)]
+    highest = indexes[rows, np.argmax(np.where(valid, bucket_values, -np.inf),
+                                      axis=1)]
+
+    return np.unique(np.concatenate((lowest, highest)))
+
+METHODS = { LTTB_METHOD : lttb_indexes, MINMAX_METHOD : minmax_indexes }
+
+def decimate(times, values, points=DEFAULT_POINTS, start_time=None,
+             end_time=None, method=LTTB_METHOD):
+    """Returns at most a number of points of the measures in a range of
+    times, the measures not valid are discarded.
+
+    Args:
+        times: Array of times, in increasing order.
+        values: Array of values.
+        points: Maximum number of points.
+        start_time: First time of the range, from the first measure if None.
+        end_time: Time after the range, to the last measure if None.
+        method: Method to choose the points, lttb or minmax.
+
+    Returns:
+        A tuple with the arrays of times and values.
+    """
+
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+
+    begin = 0 if start_time is None else \
+        np.searchsorted(times, start_time, "left")
+    end = len(times) if end_time is None else \
+        np.searchsorted(times, end_time, "left")
+
+    times = times[begin:end]
+    values = values[begin:end]
+
+    finite = np.isfinite(values)
+
+    if not finite.all():
+        times = times[finite]
+        values = values[finite]
+
+    chosen = METHODS[method](times, values, points)
+
+    return times[chosen], values[chosen]
+
+def pyramid_file_name(filename):
+    """Returns the name of the file with the zoom levels of an output file."""
+
+    return "%s.%s" % (os.path.splitext(filename)[0], PYRAMID_EXT)
+
+class ZoomPyramid(object):
+    """Measures of a continuous output file decimated at several zoom
+    levels, each one with ZOOM_FACTOR times the points of the previous one.
+    A range of times is shown from the coarsest level with enough points in
+    it, or from the file if none has.
+    """
+
+    def __init__(self, filename, levels, points=DEFAULT_POINTS,
+                 method=LTTB_METHOD):
+        """Initializes the pyramid.
+
+        Args:
+            filename: Name of the output file.
+            levels: List of tuples with the arrays of times and values of
+                each level, the coarsest first.
+            points: Points of the coarsest level.
+            method: Method used to decimate.
+        """
+
+        self._filename = filename
+        self._levels = levels
+        self._points = points
+        self._method = method
+
+    @property
+    def levels(self):
+        return list(self._levels)
+
+    @property
+    def method(self):
+        return self._method
+
+    @staticmethod
+    def build(filename, times, values, points=DEFAULT_POINTS,
+              method=LTTB_METHOD):
+        """Decimate the measures of a file at the zoom levels, each level
+        from the next finer one.
+
+        Args:
+            filename: Name of the output file.
+            times: Array of times of its measures.
+            values: Array of values of its measures.
+            points: Points of the coarsest level.
+            method: Method to decimate.
+        """
+
+        finite = np.isfinite(values)
+
+        times = np.asarray(times, dtype=np.float64)[finite]
+        values = np.asarray(values, dtype=np.float64)[finite]
+
+        sizes = []
+        size = points
+
+        # The finest level has at most a fraction of the measures.
+        while size * ZOOM_FACTOR <= len(times):
+            sizes.append(size)
+            size *= ZOOM_FACTOR
+
+        levels = []
+
+        for size in reversed(sizes):
+            chosen = METHODS[method](times, values, size)
+
+            times = times[chosen]
+            values = values[chosen]
+
+            levels.insert(0, (times, values))
+
+        return ZoomPyramid(filename, levels, points, method)
+
+    @staticmethod
+    def from_file(filename, points=DEFAULT_POINTS, method=LTTB_METHOD):
+        """Returns the pyramid of an output file, read from its file if it
+        has been saved after the last change of the output file, or built
+        and saved otherwise.
+
+        Args:
+            filename: Name of the output file.
+            points: Points of the coarsest level.
+            method: Method to decimate.
+        """
+
+        from outreader import ContinuousFileReader
+
+        pyramid = ZoomPyramid.load(filename, points, method)
+
+        if pyramid is None:
+            with ContinuousFileReader(filename) as reader:
+                times, mjds, values = reader[:]
+
+            pyramid = ZoomPyramid.build(filename, times, values, points,
+                                        method)
+
+            try:
+                pyramid.save()
+            except (IOError, OSError):
+                pass
+
+        return pyramid
+
+    def save(self):
+        """Save the levels next to the output file, with its size and time
+        of modification to know if they are still valid.
+        """
+
+        stat = os.stat(self._filename)
+
+        arrays = { "source" : np.array([ stat.st_size, stat.st_mtime ]),
+                   "points" : np.array([ self._points ]),
+                   "method" : np.array([ self._method ]) }
+
+        for k, (times, values) in enumerate(self._levels):
+            arrays["times_%d" % k] = times
+            arrays["values_%d" % k] = values
+
+        # Written at once, a reader never sees a file half written.
+        temp_name = "%s.%d.npz" % (pyramid_file_name(self._filename),
+                                   os.getpid())
+
+        np.savez(temp_name, **arrays)
+
+        os.rename(temp_name, pyramid_file_name(self._filename))
+
+    @staticmethod
+    def load(filename, points=DEFAULT_POINTS, method=LTTB_METHOD):
+        """Returns the pyramid saved of an output file, None if it hasn't
+        been saved or the output file has changed since then.
+        """
+
+        pyramid = None
+
+        try:
+            stat = os.stat(filename)
+
+            data = np.load(pyramid_file_name(filename))
+
+            try:
+                if tuple(data["source"]) == (stat.st_size, stat.st_mtime) \
+                    and data["points"][0] == points \
+                    and data["method"][0] == method:
+
+                    levels = []
+
+                    while "times_%d" % len(levels) in data.files:
+                        levels.append((data["times_%d" % len(levels)],
+                                       data["values_%d" % len(levels)]))
+
+                    pyramid = ZoomPyramid(filename, levels, points, method)
+            finally:
+                data.close()
+
+        except (IOError, OSError, KeyError, ValueError):
+            pass
+
+        return pyramid
+
+    def query(self, start_time=None, end_time=None, points=DEFAULT_POINTS):
+        """Returns at most a number of points of the measures in a range of
+        times.
+
+        Args:
+            start_time: First time of the range, from the first measure if
+                None.
+            end_time: Time after the range, to the last measure if None.
+            points: Maximum number of points.
+
+        Returns:
+            A tuple with the arrays of times and values.
+        """
+
+        chosen = None
+
+        for times, values in self._levels:
+            begin = 0 if start_time is None else \
+                np.searchsorted(times, start_time, "left")
+            end = len(times) if end_time is None else \
+                np.searchsorted(times, end_time, "left")
+
+            # A level with several times the points needed keeps the shape.
+            if end - begin >= ZOOM_FACTOR * points:
+                chosen = (times[begin:end], values[begin:end])
+                break
+
+        if chosen is None:
+            # Zoomed in more than the finest level, the range of the file
+            # is short.
+            from outreader import ContinuousFileReader
+
+            with ContinuousFileReader(self._filename) as reader:
+                if start_time is None and end_time is None:
+                    times, mjds, values = reader[:]
+                else:
+                    times, mjds, values = reader.between(
+                        -np.inf if start_time is None else start_time,
+                        np.inf if end_time is None else end_time)
+
+            chosen = (times, values)
+
+        return decimate(chosen[0], chosen[1], points, start_time, end_time,
+                        self._method)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Decimate the continuous " +
+                                     "output files at several zoom levels.")
+
+    parser.add_argument("files", nargs="+", help="Continuous output files.")
+
+    parser.add_argument("-n", dest="points", type=int,
+                        default=DEFAULT_POINTS,
+                        help="Points of the coarsest level.")
+
+    parser.add_argument("-m", dest="method", choices=sorted(METHODS),
+                        default=LTTB_METHOD, help="Method to decimate.")
+
+    args = parser.parse_args()
+
+    for f in args.files:
+        start = time.time()
+
+        pyramid = ZoomPyramid.from_file(f, args.points, args.method)
+
+        print "%s: levels of %s points in %.2f s" % \
+            (f, ", ".join([ str(len(t)) for t, v in pyramid.levels ]),
+             time.time() - start)
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Exports the measures to FITS and NumPy files.
+
+The all sky measures are written to FITS as image extensions VALUES, COUNTS
+and SPREAD, the mean of the readings of each position, their number and
+their standard deviation, with the azimuth and the altitude as the axes of
+the images described by WCS keywords. The zenith is in the primary header.
+
+The continuous measures are written as a binary table of FITS or as a
+structured array of NumPy, .npy, or its arrays in a .npz file. The FITS and
+.npy files are read memory mapped, so only the rows used are read from the
+disk.
+"""
+
+import os
+import time
+import logging
+import argparse
+
+import numpy as np
+from astropy.io import fits
+
+from outfile import OutputFileException
+
+FITS_FORMAT = "fits"
+NPY_FORMAT = "npy"
+NPZ_FORMAT = "npz"
+EXPORT_FORMATS = ( FITS_FORMAT, NPY_FORMAT, NPZ_FORMAT )
+
+# Columns of the continuous measures, the time in seconds since the epoch.
+CONTINUOUS_DTYPE = np.dtype([ ("time", "f8"), ("mjd", "f8"), ("mag", "f4") ])
+
+# Extensions of the all sky images.
+ALL_SKY_EXTENSIONS = ( "VALUES", "COUNTS", "SPREAD" )
+
+def export_file_name(filename, export_format):
+    """Returns the name of the export of an output file.
+
+    Args:
+        filename: Name of the output file.
+        export_format: Format of the export.
+    """
+
+    return "%s.%s" % (os.path.splitext(filename)[0], export_format)
+
+def session_export_name(name, export_format=FITS_FORMAT):
+    """Returns the name of the export of the measures taken now, as that of
+    their output file.
+
+    Args:
+        name: Name of the measures.
+        export_format: Format of the export.
+    """
+
+    return "%s_%s.%s" % (time.strftime("%Y%m%d%H%M%S", time.localtime()),
+                         name, export_format)
+
+def _export_format(filename):
+    """Returns the format of an export from the extension of its name."""
+
+    export_format = os.path.splitext(filename)[1][1:].lower()
+
+    if export_format not in EXPORT_FORMATS:
+        raise OutputFileException("Format of export not known: %s" % filename)
+
+    return export_format
+
+def _axis_keywords(header, axis, ctype, values):
+    """Add the WCS keywords of an axis of a regular grid to a header.
+
+    Args:
+        header: FITS header.
+        axis: Number of the axis, 1 for the columns of the image.
+        ctype: Type of the coordinate.
+        values: Coordinate of each pixel of the axis, equally spaced.
+    """
+
+    header["CTYPE%d" % axis] = ctype
+    header["CUNIT%d" % axis] = "deg"
+    header["CRPIX%d" % axis] = 1.0
+    header["CRVAL%d" % axis] = float(values[0])
+    header["CDELT%d" % axis] = float(values[1] - values[0]) \
+        if len(values) > 1 else 1.0
+
+def _fits_text(text):
+    """Returns a text as the printable ASCII characters a FITS header can
+    hold, the others replaced by ? and the control characters removed.
+
+    Args:
+        text: Text, in UTF-8 if it isn't unicode.
+    """
+
+    if not isinstance(text, unicode):
+        text = str(text).decode("utf-8", "replace")
+
+    text = text.replace(u"\t", u" ").encode("ascii", "replace")
+
+    return "".join([ c for c in text if " " <= c <= "~" ])
+
+def export_all_sky(all_sky_values, filename, info="", measure_time=None):
+    """Write the all sky measures to a FITS file.
+
+    Args:
+        all_sky_values: All sky measures.
+        filename: Name of the FITS file.
+        info: Information of the measures, written only with the characters
+            a FITS header can hold.
+        measure_time: Time of the measures in seconds since the epoch,
+            the current time if not provided.
+    """
+
+    from allsky import AZIMUTH_VALUES, VERTICAL_VALUES
+
+    if measure_time is None:
+        measure_time = time.time()
+
+    primary = fits.PrimaryHDU()
+
+    primary.header["DATE-OBS"] = time.strftime("%Y-%m-%dT%H:%M:%S",
+                                               time.gmtime(measure_time))
+    primary.header["INFO"] = _fits_text(info)
+    primary.header["ZENITH"] = (float(all_sky_values.zenith),
+                                "Magnitude at the zenith")
+
+    hdus = [ primary ]
+
+    # Rows by altitude and columns by azimuth, as the values by vertical.
+    images = ( np.array(all_sky_values.values_by_vertical(), dtype="f4"),
+               np.array(all_sky_values.counts_by_vertical(), dtype="i2"),
+               np.array(all_sky_values.spreads_by_vertical(), dtype="f4") )
+
+    for name, data in zip(ALL_SKY_EXTENSIONS, images):
+        hdu = fits.ImageHDU(data, name=name)
+
+        _axis_keywords(hdu.header, 1, "AZ", AZIMUTH_VALUES)
+        _axis_keywords(hdu.header, 2, "ALT", VERTICAL_VALUES)
+
+        hdus.append(hdu)
+
+    try:
+        fits.HDUList(hdus).writeto(filename, overwrite=True)
+    except (IOError, OSError, ValueError) as e:
+        raise OutputFileException("Writing file %s: %s" % (filename, e))
+
+def read_all_sky_export(filename):
+    """Read the all sky measures of a FITS file, memory mapped.
+
+    Args:
+        filename: Name of the FITS file.
+
+    Returns:
+        A tuple with the primary header and a dictionary with the image of
+        each extension, the rows by altitude and the columns by azimuth.
+    """
+
+    try:
+        hdul = fits.open(filename, memmap=True)
+    except (IOError, OSError) as e:
+        raise OutputFileException("Reading file %s: %s" % (filename, e))
+
+    return hdul[0].header, dict([ (name, hdul[name].data)
+                                  for name in ALL_SKY_EXTENSIONS ])
+
+def continuous_array(times, mjds, values):
+    """Returns the continuous measures in a structured array.
+
+    Args:
+        times: Times of the measures in seconds since the epoch.
+        mjds: MJD of the measures.
+        values: Values measured.
+    """
+
+    readings = np.empty(len(times), dtype=CONTINUOUS_DTYPE)
+
+    readings["time"] = times
+    readings["mjd"] = mjds
+    readings["mag"] = values
+
+    return readings
+
+def export_continuous(times, mjds, values, filename):
+    """Write the continuous measures to a file, its format is that of the
+    extension of its name.
+
+    Args:
+        times: Times of the measures in seconds since the epoch.
+        mjds: MJD of the measures.
+        values: Values measured.
+        filename: Name of the file.
+    """
+
+    export_format = _export_format(filename)
+
+    readings = continuous_array(times, mjds, values)
+
+    try:
+        if export_format == FITS_FORMAT:
+            table = fits.BinTableHDU(readings, name="CONTINUOUS")
+
+            table.header["TUNIT1"] = "s"
+            table.header["TUNIT2"] = "d"
+            table.header["TUNIT3"] = "mag/arcsec2"
+
+            fits.HDUList([ fits.PrimaryHDU(), table ]).writeto(
+                filename, overwrite=True)
+        elif export_format == NPY_FORMAT:
+            np.save(filename, readings)
+        else:
+            np.savez(filename, **dict([ (name, readings[name])
+                                        for name in CONTINUOUS_DTYPE.names ]))
+    except (IOError, OSError) as e:
+        raise OutputFileException("Writing file %s: %s" % (filename, e))
+
+def read_continuous_export(filename):
+    """Read the continuous measures of an export.
+
+    The FITS and .npy files are memory mapped, the arrays of a .npz file are
+    read completely.
+
+    Args:
+        filename: Name of the file.
+
+    Returns:
+        A structured array with the fields time, mjd and mag.
+    """
+
+    export_format = _export_format(filename)
+
+    try:
+        if export_format == FITS_FORMAT:
+            readings = fits.open(filename, memmap=True)[1].data
+        elif export_format == NPY_FORMAT:
+            readings = np.load(filename, mmap_mode="r")
+        else:
+            data = np.load(filename)
+
+            try:
+                readings = continuous_array(
+                    *[ data[name] for name in CONTINUOUS_DTYPE.names ])
+            finally:
+                data.close()
+
+    except (IOError, OSError, KeyError) as e:
+        raise OutputFileException("Reading file %s: %s" % (filename, e))
+
+    return readings
+
+def export_output_file(filename, export_format=FITS_FORMAT):
+    """Export an output file, continuous or all sky saved as a list.
+
+    Args:
+        filename: Name of the output file.
+        export_format: Format of the continuous measures, the all sky
+            measures are always exported to FITS.
+
+    Returns:
+        The name of the export.
+    """
+
+    from outreader import ContinuousFileReader, is_continuous_file, \
+        read_all_sky_file
+
+    if is_continuous_file(filename):
+        with ContinuousFileReader(filename) as reader:
+            times, mjds, values = reader[:]
+
+        export_name = export_file_name(filename, export_format)
+
+        export_continuous(times, mjds, values, export_name)
+    else:
+        from allsky import AllSkyMeasures, AZIMUTH_VALUES, VERTICAL_VALUES
+
+        info, azimuths, zenith = read_all_sky_file(filename,
+                                                   len(VERTICAL_VALUES))
+
+        all_sky_values = AllSkyMeasures(len(AZIMUTH_VALUES),
+                                        len(VERTICAL_VALUES))
+
+        for i, vertical_values in enumerate(azimuths):
+            for j, value in enumerate(vertical_values):
+                all_sky_values.set(i, j, value)
+
+        all_sky_values.zenith = zenith
+
+        export_name = export_file_name(filename, FITS_FORMAT)
+
+        export_all_sky(all_sky_values, export_name, info,
+                       os.path.getmtime(filename))
+
+    return export_name
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Export output files to "
+                                     "FITS or NumPy files next to them.")
+
+    parser.add_argument("files", nargs="+", help="Output files.")
+
+    parser.add_argument("-f", dest="export_format", choices=EXPORT_FORMATS,
+                        default=FITS_FORMAT,
+                        help="Format of the continuous measures, the all "
+                        "sky measures are always exported to FITS.")
+
+    args = parser.parse_args()
+
+    for filename in args.files:
+        try:
+            print "%s -> %s" % (filename,
+                                export_output_file(filename,
+                                                   args.export_format))
+        except OutputFileException as ofe:
+            logging.error(ofe)
+            print ofe
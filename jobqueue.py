@@ -0,0 +1,479 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Runs a queue of measurement jobs keeping the SQM open between them.
+
+A job file has a pair parameter/value in each line separated by an equal
+character, as the configuration file. Each JOB line starts a job with the
+configuration file of its measures, relative to the job file, and the lines
+that follow until the next JOB set:
+
+- START, time of the day HH:MM[:SS] to start the job. The job starts at the
+  next time of the day after the start of the previous job, so the jobs of a
+  night can pass midnight. Without it the job starts when the previous ends.
+- REPEAT, times the job is run, 1 by default.
+- EVERY, seconds from the start of a run of the job to the next, 0 by
+  default to run them one after another.
+- SKIP_IF_BRIGHTER, a run of the job is skipped if a measure taken before
+  it is lower than this magnitude, the sky is brighter.
+"""
+
+import os
+import csv
+import time
+import signal
+import logging
+import threading
+
+from config import SQMControlCfg
+from outfile import OutputFileException
+
+class JobQueueException(Exception):
+
+    def __init__(self, msg):
+
+        self._msg = msg
+
+    def __str__(self):
+        return self._msg
+
+class Job(object):
+    """A job of the queue, the measures of a configuration file."""
+
+    def __init__(self, cfg_file_name, start=None, repeat=1, every=0.0,
+                 skip_if_brighter=None):
+        """Initializes the job reading its configuration.
+
+        Args:
+            cfg_file_name: Configuration file of the measures.
+            start: Time of the day to start as (hour, minute, second), None
+                to start when the previous job ends.
+            repeat: Times the job is run.
+            every: Seconds from the start of a run to the next.
+            skip_if_brighter: Magnitude below which a run is skipped, None
+                to run it always.
+        """
+
+        self._sqm_config = SQMControlCfg(cfg_file_name)
+        self._start = start
+        self._repeat = repeat
+        self._every = every
+        self._skip_if_brighter = skip_if_brighter
+
+    def __str__(self):
+        return "%s (%s)" % (self._sqm_config.file_name, self._sqm_config.mode)
+
+    @property
+    def sqm_config(self):
+        return self._sqm_config
+
+    @property
+    def start(self):
+        return self._start
+
+    @property
+    def repeat(self):
+        return self._repeat
+
+    @property
+    def every(self):
+        return self._every
+
+    @property
+    def skip_if_brighter(self):
+        return self._skip_if_brighter
+
+def next_time_of_day(time_of_day, reference):
+    """Returns the first time at or after the reference with the time of the
+    day indicated, in seconds since the epoch.
+
+    Args:
+        time_of_day: Time of the day as (hour, minute, second).
+        reference: Time in seconds since the epoch.
+    """
+
+    lt = time.localtime(reference)
+
+    day = 0
+
+    while True:
+        # mktime normalizes the days beyond the end of the month.
+        candidate = time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday + day) +
+                                tuple(time_of_day) + (0, 0, -1))
+
+        if candidate >= reference:
+            return candidate
+
+        day += 1
+
+class JobQueue(object):
+    """Reads the jobs of a job file and runs them in order with the same
+    devices.
+    """
+
+    # Names of the parameters of the job file.
+    _JOB_PAR_NAME = "JOB"
+    _START_PAR_NAME = "START"
+    _REPEAT_PAR_NAME = "REPEAT"
+    _EVERY_PAR_NAME = "EVERY"
+    _SKIP_IF_BRIGHTER_PAR_NAME = "SKIP_IF_BRIGHTER"
+
+    _JOB_FILE_SEP_CHAR = "="
+    _COMMENT_CHARACTER = "#"
+
+    _START_FORMATS = ( "%H:%M:%S", "%H:%M" )
+    _REPEAT_MAX_VALUE = 1000
+
+    # Seconds after its start time a job is reported as late.
+    _LATE_TOLERANCE = 60
+
+    def __init__(self, file_name):
+        """Reads the job file and the configuration of every job, so the
+        errors are found before measuring.
+
+        Args:
+            file_name: Name of the job file.
+        """
+
+        self._file_name = file_name
+
+        self._jobs = self._read_job_file(file_name)
+
+        # Ports opened by device path, the first one is used by the jobs
+        # that detect the device.
+        self._ports = {}
+        self._default_port = None
+        self._archive = None
+
+        self._stop_event = threading.Event()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    @property
+    def jobs(self):
+        return self._jobs
+
+    def _read_job_file(self, file_name):
+        """Returns the jobs of the job file.
+
+        Args:
+            file_name: Name of the job file.
+        """
+
+        logging.debug("Reading jobs from file: %s" % file_name)
+
+        job_dir = os.path.dirname(os.path.abspath(file_name))
+
+        rows = []
+
+        try:
+            with open(file_name, 'rb') as fr:
+                reader = csv.reader(fr, delimiter=JobQueue._JOB_FILE_SEP_CHAR)
+
+                for row in reader:
+                    # Discard the empty lines and the comments.
+                    if len(row) > 0 and len(row[0].strip()) > 0 and \
+                        row[0].strip()[0] <> JobQueue._COMMENT_CHARACTER:
+
+                        if len(row) <> 2:
+                            raise JobQueueException("Format invalid in '%s' "
+                                                    "of job file %s." %
+                                                    (row, file_name))
+
+                        rows.append((row[0].strip(), row[1].strip()))
+
+        except IOError:
+            raise JobQueueException("Reading job file: %s" % file_name)
+
+        jobs = []
+
+        params = None
+
+        # Each JOB line closes the parameters of the previous job.
+        for name, value in rows + [ (JobQueue._JOB_PAR_NAME, None) ]:
+            if name == JobQueue._JOB_PAR_NAME:
+                if params is not None:
+                    jobs.append(self._create_job(job_dir, params))
+
+                params = { name : value }
+            elif params is None:
+                raise JobQueueException("Parameter %s before the first %s in "
+                                        "job file %s." %
+                                        (name, JobQueue._JOB_PAR_NAME,
+                                         file_name))
+            elif name in params:
+                raise JobQueueException("Parameter %s repeated in job %s." %
+                                        (name,
+                                         params[JobQueue._JOB_PAR_NAME]))
+            else:
+                params[name] = value
+
+        if len(jobs) == 0:
+            raise JobQueueException("No jobs in job file %s." % file_name)
+
+        logging.debug("Read %d jobs from %s" % (len(jobs), file_name))
+
+        return jobs
+
+    def _create_job(self, job_dir, params):
+        """Returns the job of the parameters read from the job file.
+
+        Args:
+            job_dir: Directory of the job file.
+            params: Dictionary with the parameters of the job.
+        """
+
+        cfg_file_name = os.path.join(job_dir, params.pop(
+            JobQueue._JOB_PAR_NAME))
+
+        start = None
+
+        start_value = params.pop(JobQueue._START_PAR_NAME, None)
+
+        if start_value is not None:
+            for time_format in JobQueue._START_FORMATS:
+                try:
+                    start = time.strptime(start_value, time_format)[3:6]
+                    break
+                except ValueError:
+                    pass
+
+            if start is None:
+                raise JobQueueException("Start time '%s' of job %s is not "
+                                        "HH:MM or HH:MM:SS." %
+                                        (start_value, cfg_file_name))
+
+        try:
+            repeat = int(params.pop(JobQueue._REPEAT_PAR_NAME, 1))
+            every = float(params.pop(JobQueue._EVERY_PAR_NAME, 0))
+
+            skip_if_brighter = params.pop(
+                JobQueue._SKIP_IF_BRIGHTER_PAR_NAME, None)
+
+            if skip_if_brighter is not None:
+                skip_if_brighter = float(skip_if_brighter)
+        except ValueError as ve:
+            raise JobQueueException("Value not valid in job %s: %s" %
+                                    (cfg_file_name, ve))
+
+        if repeat < 1 or repeat > JobQueue._REPEAT_MAX_VALUE or every < 0:
+            raise JobQueueException("%s must be between 1 and %d and %s not "
+                                    "negative in job %s." %
+                                    (JobQueue._REPEAT_PAR_NAME,
+                                     JobQueue._REPEAT_MAX_VALUE,
+                                     JobQueue._EVERY_PAR_NAME, cfg_file_name))
+
+        if len(params) > 0:
+            raise JobQueueException("Parameters not recognized in job %s: %s"
+                                    % (cfg_file_name,
+                                       ", ".join(sorted(params))))
+
+        job = Job(cfg_file_name, start, repeat, every, skip_if_brighter)
+
+        # Independent measures only end by Ctrl-C, that stops the queue.
+        if job.sqm_config.mode_one and repeat > 1:
+            logging.warning("Job %s of independent measures repeated, only "
+                            "Ctrl-C ends them." % job)
+
+        return job
+
+    def _open(self, sqm_config):
+        """Returns the serial port and the ports of the rig of a job, opening
+        only the devices not opened by a previous job.
+
+        Args:
+            sqm_config: Configuration parameters of the job.
+        """
+
+        from sqmcontrol import open_port
+
+        rig_ports = None
+
+        if sqm_config.mode_all_sky and len(sqm_config.rig) > 1:
+            rig_ports = [ self._port(sqm_config, device)
+                          for device, az, vert in sqm_config.rig ]
+
+            ser = rig_ports[0]
+        elif self._default_port is not None:
+            ser = self._default_port
+        else:
+            ser = open_port(sqm_config)
+
+            self._ports[ser.device] = ser
+
+        if self._default_port is None:
+            self._default_port = ser
+
+        # The retries could be different for each job.
+        for port in rig_ports or [ ser ]:
+            port.set_retry_policy(sqm_config.retries,
+                                  sqm_config.latency_budget)
+
+            port.set_archive(self._archive)
+
+        return ser, rig_ports
+
+    def _port(self, sqm_config, device):
+        """Returns the serial port of a device, opening it the first time."""
+
+        from sqmcontrol import open_port
+
+        if device not in self._ports:
+            self._ports[device] = open_port(sqm_config, device)
+
+        return self._ports[device]
+
+    def _too_bright(self, job, ser):
+        """Returns True if the sky is brighter than the limit of the job.
+
+        Args:
+            job: The job to check.
+            ser: Serial object used to communicate with SQM.
+        """
+
+        too_bright = False
+
+        if job.skip_if_brighter is not None:
+            measure = ser.get_sqm_measure()
+
+            # Without a valid measure the job is run.
+            if measure is None:
+                logging.warning("No valid measure to check the sky before "
+                                "job %s, running it." % job)
+            else:
+                too_bright = float(measure) < job.skip_if_brighter
+
+                logging.info("Sky at %s before job %s, limit %.2f." %
+                             (measure, job, job.skip_if_brighter))
+
+        return too_bright
+
+    def _interrupt(self, signum, frame):
+        """Stop the queue on Ctrl-C besides ending the current measures."""
+
+        self._stop_event.set()
+
+        raise KeyboardInterrupt
+
+    def _wait(self, start_time, job):
+        """Wait until the start time of a run of a job.
+
+        Returns:
+            True if the wait is not interrupted.
+        """
+
+        if start_time > time.time():
+            msg = "Waiting until %s to start job %s" % \
+                (time.strftime("%d-%m-%Y %H:%M:%S",
+                               time.localtime(start_time)), job)
+
+            logging.info(msg)
+            print msg
+
+            self._stop_event.wait(start_time - time.time())
+
+        return not self._stop_event.is_set()
+
+    def run(self, progargs):
+        """Run the jobs in order.
+
+        Args:
+            progargs: Program arguments.
+        """
+
+        from sqmcontrol import run_measures, create_archive
+
+        self._archive = create_archive(progargs)
+
+        previous_signal = signal.signal(signal.SIGINT, self._interrupt)
+
+        self._stop_event.clear()
+
+        reference = time.time()
+
+        try:
+            for i, job in enumerate(self._jobs):
+                start_time = reference
+
+                if job.start is not None:
+                    start_time = next_time_of_day(job.start, reference)
+
+                for run in range(job.repeat):
+                    if not self._wait(start_time, job):
+                        break
+
+                    late = time.time() - start_time
+
+                    # The previous job could end after the start time.
+                    if job.start is not None and run == 0 and \
+                        late > JobQueue._LATE_TOLERANCE:
+                        logging.warning("Job %s starts %d seconds late." %
+                                        (job, late))
+
+                    reference = max(start_time, time.time())
+
+                    msg = "Job %d of %d, run %d of %d: %s" % \
+                        (i + 1, len(self._jobs), run + 1, job.repeat, job)
+
+                    logging.info(msg)
+                    print msg
+
+                    ser, rig_ports = self._open(job.sqm_config)
+
+                    if self._too_bright(job, ser):
+                        msg = "Sky brighter than %.2f, job %s skipped." % \
+                            (job.skip_if_brighter, job)
+
+                        logging.info(msg)
+                        print msg
+                    else:
+                        try:
+                            run_measures(progargs, job.sqm_config, ser,
+                                         rig_ports, self._stop_event)
+                        except OutputFileException as ofe:
+                            logging.error(ofe)
+                            print ofe
+
+                    start_time = reference + job.every
+
+                if self._stop_event.is_set():
+                    break
+        except KeyboardInterrupt:
+            logging.debug("Exiting from the job queue by Ctrl-C.")
+        finally:
+            signal.signal(signal.SIGINT, previous_signal)
+
+            self.close()
+
+        if self._stop_event.is_set():
+            print "Job queue stopped by Ctrl-C."
+
+    def close(self):
+        """Close the devices opened by the jobs and the archive."""
+
+        for port in self._ports.values():
+            port.close()
+
+        self._ports = {}
+        self._default_port = None
+
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
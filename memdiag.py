@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Monitors the growth of the memory used while measuring.
+
+A sample is taken at intervals of the time of the readings: the resident
+memory of the process and the number of objects of each type tracked by the
+garbage collector. The types that have grown the most since the previous
+sample and since the first one are logged. With tracemalloc available, in
+Python 3, a snapshot is also taken and the lines that have allocated the
+most since the first snapshot are logged.
+"""
+
+import gc
+import time
+import logging
+import resource
+import collections
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Seconds between samples by default.
+DEFAULT_INTERVAL = 3600
+
+# Types or lines logged in each sample.
+TOP_GROWTH = 10
+
+# Frames kept by tracemalloc for each allocation.
+_TRACE_FRAMES = 1
+
+# Samples kept, the first one is always kept as the reference.
+MAX_SAMPLES = 1000
+
+def rss_bytes():
+    """Returns the resident memory of the process in bytes, the maximum
+    reached where /proc is not available.
+    """
+
+    try:
+        with open("/proc/self/statm") as fr:
+            return int(fr.read().split()[1]) * resource.getpagesize()
+    except (IOError, IndexError, ValueError):
+        # In kilobytes in Linux, bytes in OS X.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def type_counts():
+    """Returns a Counter with the number of objects of each type tracked by
+    the garbage collector.
+    """
+
+    return collections.Counter([ type(o).__name__ for o in gc.get_objects() ])
+
+def memory_slope(samples):
+    """Returns the growth of the resident memory in bytes per hour, the
+    slope of the line fitted to the samples.
+
+    Args:
+        samples: List of MemorySample.
+    """
+
+    slope = 0.0
+
+    if len(samples) > 1:
+        t0 = samples[0].timestamp
+
+        t = [ (s.timestamp - t0) / 3600.0 for s in samples ]
+        r = [ float(s.rss) for s in samples ]
+
+        mean_t = sum(t) / len(t)
+        mean_r = sum(r) / len(r)
+
+        stt = sum([ (x - mean_t) ** 2 for x in t ])
+
+        if stt > 0:
+            slope = sum([ (x - mean_t) * (y - mean_r)
+                          for x, y in zip(t, r) ]) / stt
+
+    return slope
+
+MemorySample = collections.namedtuple("MemorySample",
+                                      [ "timestamp", "readings", "rss",
+                                        "objects" ])
+
+class MemoryMonitor(object):
+    """Sink of the readings that takes samples of the memory used at
+    intervals of the time of the readings.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, top=TOP_GROWTH,
+                 use_tracemalloc=True):
+        """Initializes the monitor, the first sample is taken with the first
+        reading.
+
+        Args:
+            interval: Seconds between samples.
+            top: Types or lines logged in each sample.
+            use_tracemalloc: Take tracemalloc snapshots when available.
+        """
+
+        self._interval = interval
+        self._top = top
+        self._samples = []
+        self._readings = 0
+        self._next_time = None
+
+        self._first_counts = None
+        self._last_counts = None
+        self._first_snapshot = None
+
+        self._tracing = use_tracemalloc and tracemalloc is not None
+
+        if self._tracing:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(_TRACE_FRAMES)
+        elif use_tracemalloc:
+            logging.info("tracemalloc not available, only the objects by "
+                         "type are counted.")
+
+    @property
+    def samples(self):
+        return list(self._samples)
+
+    def add_reading(self, timestamp, measure, temperature=None):
+        """Count a reading and take a sample if the interval has passed.
+
+        Args:
+            timestamp: Time of the reading in seconds since the epoch.
+            measure: Value measured.
+            temperature: Temperature of the SQM.
+        """
+
+        self._readings += 1
+
+        if self._next_time is None or timestamp >= self._next_time:
+            self.sample(timestamp)
+
+            self._next_time = timestamp + self._interval
+
+    def sample(self, timestamp=None):
+        """Take a sample and log the growth since the previous one.
+
+        Args:
+            timestamp: Time of the sample, the current time if None.
+
+        Returns:
+            The sample taken.
+        """
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        # Only the objects alive are counted.
+        gc.collect()
+
+        counts = type_counts()
+
+        sample = MemorySample(timestamp, self._readings, rss_bytes(),
+                              sum(counts.values()))
+
+        if len(self._samples) >= MAX_SAMPLES:
+            del self._samples[1]
+
+        self._samples.append(sample)
+
+        if self._first_counts is None:
+            self._first_counts = counts
+        else:
+            logging.info("Memory after %d readings: RSS %.1f MB (%+.1f MB), "
+                         "%d objects (%+d), %.1f MB per hour" %
+                         (sample.readings, sample.rss / 1048576.0,
+                          (sample.rss - self._samples[0].rss) / 1048576.0,
+                          sample.objects,
+                          sample.objects - self._samples[0].objects,
+                          memory_slope(self._samples) / 1048576.0))
+
+            self._log_growth("since the previous sample", counts,
+                             self._last_counts)
+            self._log_growth("since the first sample", counts,
+                             self._first_counts)
+
+        self._last_counts = counts
+
+        if self._tracing:
+            self._log_snapshot()
+
+        return sample
+
+    def _log_growth(self, label, counts, previous):
+        """Log the types whose number of objects has grown the most."""
+
+        growth = counts.copy()
+        growth.subtract(previous)
+
+        grown = [ (name, n) for name, n in growth.most_common(self._top)
+                  if n > 0 ]
+
+        if len(grown) > 0:
+            logging.info("Objects grown %s: %s" %
+                         (label, ", ".join([ "%s %+d" % g for g in grown ])))
+
+    def _log_snapshot(self):
+        """Log the lines that have allocated the most since the first
+        snapshot.
+        """
+
+        snapshot = tracemalloc.take_snapshot()
+
+        if self._first_snapshot is None:
+            self._first_snapshot = snapshot
+        else:
+            for stat in snapshot.compare_to(self._first_snapshot,
+                                            "lineno")[:self._top]:
+                if stat.size_diff > 0:
+                    logging.info("Allocated since the first sample: %s" %
+                                 stat)
+
+    def close(self):
+        """Take a last sample and stop tracing."""
+
+        self.sample()
+
+        if self._tracing:
+            tracemalloc.stop()
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Merges the continuous measures of several SQMs and aligns them in time.
+
+The continuous files of each SQM, or their exports to FITS or NumPy, are
+read as streams sorted by time and merged into a single stream, keeping only
+a reading of each file in memory. The merged stream is resampled on a
+common grid of times a window at a time, interpolating the readings of each
+SQM around each time of the grid. The times whose readings around are
+farther apart than the maximum gap are masked as not measured.
+
+The result is a table with the time, the MJD and a column for each SQM.
+"""
+
+import os
+import sys
+import heapq
+import logging
+import argparse
+
+import numpy as np
+
+from outfile import OutputFile, OutputFileException, unix_to_mjd
+
+# Seconds between the times of the grid by default.
+DEFAULT_STEP = 60.0
+
+# Maximum seconds between the readings interpolated by default.
+DEFAULT_MAX_GAP = 300.0
+
+# Times of the grid resampled at once.
+WINDOW_SIZE = 512
+
+# Rows of an export read at once.
+_EXPORT_CHUNK = 65536
+
+def read_series(filename):
+    """Read the times and values of the continuous measures of a file.
+
+    The continuous output files are read line by line, the FITS and .npy
+    exports memory mapped a chunk at a time.
+
+    Args:
+        filename: Name of the continuous file or of its export.
+
+    Returns:
+        A generator of tuples with the time in seconds since the epoch and
+        the value measured.
+    """
+
+    extension = os.path.splitext(filename)[1][1:].lower()
+
+    if extension == OutputFile.FILE_EXT:
+        from outreader import read_continuous_file
+
+        for timestamp, mjd, measure in read_continuous_file(filename):
+            try:
+                yield timestamp, float(measure)
+            except ValueError:
+                logging.debug("Measure not valid in %s: %s" %
+                              (filename, measure))
+    else:
+        from export import read_continuous_export
+
+        readings = read_continuous_export(filename)
+
+        for start in range(0, len(readings), _EXPORT_CHUNK):
+            chunk = readings[start:start + _EXPORT_CHUNK]
+
+            for timestamp, value in zip(chunk["time"].tolist(),
+                                        chunk["mag"].tolist()):
+                yield timestamp, value
+
+def _ordered(readings, index, filename):
+    """Add the index of its file to each reading, skipping those out of
+    order as the merge needs each stream sorted by time.
+    """
+
+    last_time = None
+
+    for timestamp, value in readings:
+        if last_time is not None and timestamp < last_time:
+            logging.warning("Reading out of order in %s skipped: %.3f" %
+                            (filename, timestamp))
+        else:
+            last_time = timestamp
+
+            yield timestamp, index, value
+
+def merge_series(filenames):
+    """Merge the continuous measures of several files by time.
+
+    Args:
+        filenames: Names of the continuous files or of their exports.
+
+    Returns:
+        A generator of tuples with the time in seconds since the epoch, the
+        index of the file in filenames and the value measured, sorted by
+        time.
+    """
+
+    return heapq.merge(*[ _ordered(read_series(filename), i, filename)
+                          for i, filename in enumerate(filenames) ])
+
+def _resample(times, values, grid, max_gap):
+    """Interpolate the readings of a SQM at the times of the grid.
+
+    Args:
+        times: Times of the readings, sorted.
+        values: Values of the readings.
+        grid: Times of the grid.
+        max_gap: Maximum seconds between the readings interpolated.
+
+    Returns:
+        The values at the times of the grid, NaN where the readings around
+        are farther apart than max_gap or there aren't readings on both
+        sides.
+    """
+
+    resampled = np.full(len(grid), np.nan)
+
+    if len(times) > 0:
+        times = np.asarray(times)
+
+        # Last reading at or before and first reading at or after each time.
+        after = np.searchsorted(times, grid, side="left")
+        before = np.searchsorted(times, grid, side="right") - 1
+
+        valid = (before >= 0) & (after < len(times))
+
+        valid[valid] = times[after[valid]] - times[before[valid]] <= max_gap
+
+        resampled[valid] = np.interp(grid[valid], times, values)
+
+    return resampled
+
+def align_series(merged, count, step=DEFAULT_STEP, max_gap=DEFAULT_MAX_GAP,
+                 window_size=WINDOW_SIZE):
+    """Resample a merged stream of readings on a common grid of times.
+
+    The grid starts at the multiple of step at or before the first reading
+    and ends at the last one, the intervals longer than max_gap without
+    readings of any SQM are skipped. The readings are kept only while they
+    could be interpolated in the current window of the grid.
+
+    Args:
+        merged: Readings sorted by time as returned by merge_series.
+        count: Number of SQMs of the stream.
+        step: Seconds between the times of the grid.
+        max_gap: Maximum seconds between the readings interpolated.
+        window_size: Times of the grid resampled at once.
+
+    Returns:
+        A generator of tuples with the times of a window of the grid and
+        an array of its values, a column for each SQM.
+    """
+
+    times = [ [] for i in range(count) ]
+    values = [ [] for i in range(count) ]
+
+    window_start = None
+    last_time = None
+
+    pending = next(merged, None)
+
+    while pending is not None or \
+        (last_time is not None and window_start <= last_time):
+
+        if window_start is None:
+            window_start = np.floor(pending[0] / step) * step
+        elif pending is not None and pending[0] - window_start > max_gap and \
+            all([ len(t) == 0 or t[-1] < window_start for t in times ]):
+            # Nothing to interpolate until the next reading.
+            window_start += np.floor((pending[0] - window_start) / step) * \
+                step
+
+        grid = window_start + step * np.arange(window_size)
+
+        # The readings after the window farther than max_gap can't be
+        # interpolated in it.
+        limit = grid[-1] + max_gap
+
+        while pending is not None and pending[0] <= limit:
+            timestamp, index, value = pending
+
+            times[index].append(timestamp)
+            values[index].append(value)
+
+            last_time = timestamp
+
+            pending = next(merged, None)
+
+        if pending is None:
+            # The grid ends at the last reading.
+            grid = grid[grid <= last_time]
+
+        if len(grid) > 0:
+            yield grid, np.column_stack([ _resample(times[i], values[i], grid,
+                                                    max_gap)
+                                          for i in range(count) ])
+
+        window_start += step * window_size
+
+        # Keep the last reading before the next window and the following.
+        for i in range(count):
+            first = max(0, np.searchsorted(times[i], window_start) - 1)
+
+            del times[i][:first]
+            del values[i][:first]
+
+def write_aligned(filenames, output, step=DEFAULT_STEP,
+                  max_gap=DEFAULT_MAX_GAP):
+    """Write the measures of several files aligned in a table.
+
+    Args:
+        filenames: Names of the continuous files or of their exports.
+        output: File object to write the table.
+        step: Seconds between the times of the grid.
+        max_gap: Maximum seconds between the readings interpolated.
+
+    Returns:
+        The number of rows written.
+    """
+
+    names = [ os.path.splitext(os.path.basename(f))[0] for f in filenames ]
+
+    output.write("%s Merged every %g s, gaps longer than %g s masked as "
+                 "nan\n" % (OutputFile.COMMENT_CHAR, step, max_gap))
+    output.write("%s time mjd %s\n" % (OutputFile.COMMENT_CHAR,
+                                       " ".join(names)))
+
+    row_format = "%.3f %.8f" + " %.2f" * len(filenames)
+
+    rows = 0
+
+    for grid, table in align_series(merge_series(filenames), len(filenames),
+                                    step, max_gap):
+
+        np.savetxt(output, np.column_stack((grid, unix_to_mjd(grid), table)),
+                   fmt=row_format)
+
+        rows += len(grid)
+
+    return rows
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Merge the continuous "
+                                     "measures of several SQMs in a table "
+                                     "with a column for each one.")
+
+    parser.add_argument("files", nargs="+", help="Continuous output files "
+                        "or their exports to FITS or NumPy.")
+
+    parser.add_argument("-s", dest="step", type=float, default=DEFAULT_STEP,
+                        help="Seconds between the rows of the table.")
+
+    parser.add_argument("-g", dest="max_gap", type=float,
+                        default=DEFAULT_MAX_GAP,
+                        help="Maximum seconds between the readings "
+                        "interpolated.")
+
+    parser.add_argument("-o", dest="output", help="File of the table, the "
+                        "standard output if not given.")
+
+    args = parser.parse_args()
+
+    try:
+        if args.output is None:
+            write_aligned(args.files, sys.stdout, args.step, args.max_gap)
+        else:
+            with open(args.output, "w") as fw:
+                rows = write_aligned(args.files, fw, args.step, args.max_gap)
+
+            print "%d rows written to %s" % (rows, args.output)
+
+    except (OutputFileException, IOError) as e:
+        logging.error(e)
+        print e
+        sys.exit(1)
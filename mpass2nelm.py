@@ -56,6 +56,21 @@ def read_file(file_name):
     
     return rows
 
+def mpass_to_nelm(mpass):
+    """Convert a measure in MPASS unit to NELM using the calculation
+    described in:
+    http://www.unihedron.com/projects/darksky/NELM2BCalc.html
+    
+    Args:
+        mpass: Value in MPASS.
+        
+    Returns:
+        The NELM value.
+        
+    """
+    
+    return 7.93 - 5 * log(pow(10, 4.316 - (mpass / 5.0)) + 1, 10)
+
 def convert_values(data):
     """Convert the values of the data received. All the float values received
     are processed as MPASS values and converted to NELM ones using the
@@ -81,7 +96,7 @@ def convert_values(data):
             try:
                 mpass = float(item)
                 
-                nelm = 7.93 - 5 * log(pow(10, 4.316 - (mpass / 5.0)) + 1, 10)
+                nelm = mpass_to_nelm(mpass)
                 
                 new_row.append(nelm)
                 
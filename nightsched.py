@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Schedules the measures between dusk and dawn at the site configured.
+
+The altitudes of the Sun and the Moon are calculated with astropy once for
+each night, from noon to noon, in a table that is kept in memory and in a
+cache directory. The dusk and dawn and the altitudes at the time of each
+measure are interpolated from the table.
+"""
+
+import os
+import sys
+import time
+import logging
+import warnings
+
+import numpy as np
+
+# Altitude of the Sun at the end of each twilight.
+TWILIGHT_ALTITUDES = { "CIVIL" : -6.0, "NAUTICAL" : -12.0,
+                       "ASTRONOMICAL" : -18.0 }
+
+# Seconds between the times of the tables.
+TABLE_STEP = 300
+
+# Nights are counted from noon to noon, local time.
+NOON_HOUR = 12
+
+# Tables kept in memory.
+_MAX_TABLES_IN_MEMORY = 3
+
+# Nights searched for a dusk, in polar summer there could be none.
+_MAX_NIGHTS_SEARCHED = 7
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".sqmcontrol",
+                                 "ephemeris")
+
+def night_start(timestamp):
+    """Returns the noon starting the night of a time, the previous noon.
+
+    Args:
+        timestamp: Time in seconds since the epoch.
+    """
+
+    lt = time.localtime(timestamp)
+
+    noon = time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday, NOON_HOUR, 0, 0,
+                        0, 0, -1))
+
+    if noon > timestamp:
+        lt = time.localtime(timestamp - 24 * 3600)
+
+        noon = time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday, NOON_HOUR, 0,
+                            0, 0, 0, -1))
+
+    return noon
+
+def calculate_altitudes(latitude, longitude, times):
+    """Calculate the altitudes of the Sun and the Moon with astropy.
+
+    Args:
+        latitude: Latitude of the site in degrees.
+        longitude: Longitude of the site in degrees, east positive.
+        times: Array of times in seconds since the epoch.
+
+    Returns:
+        A tuple with the arrays of the altitudes of the Sun and the Moon in
+        degrees.
+    """
+
+    import astropy.units as u
+    from astropy.time import Time
+    from astropy.utils import iers
+    from astropy.coordinates import EarthLocation, AltAz, get_sun, get_moon
+
+    # The precision of the tables included is enough for the altitudes.
+    iers.conf.auto_download = False
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+
+        location = EarthLocation(lat=latitude * u.deg, lon=longitude * u.deg)
+
+        obstime = Time(times, format="unix")
+
+        frame = AltAz(obstime=obstime, location=location)
+
+        sun = get_sun(obstime).transform_to(frame).alt.deg
+        moon = get_moon(obstime, location).transform_to(frame).alt.deg
+
+    return np.asarray(sun), np.asarray(moon)
+
+class EphemerisTable(object):
+    """Altitudes of the Sun and the Moon along a night."""
+
+    def __init__(self, times, sun, moon):
+        """Initializes the table.
+
+        Args:
+            times: Array of times in seconds since the epoch.
+            sun: Array of altitudes of the Sun.
+            moon: Array of altitudes of the Moon.
+        """
+
+        self._times = times
+        self._sun = sun
+        self._moon = moon
+
+    @property
+    def start(self):
+        return self._times[0]
+
+    @property
+    def end(self):
+        return self._times[-1]
+
+    def sun_altitude(self, timestamp):
+        return float(np.interp(timestamp, self._times, self._sun))
+
+    def moon_altitude(self, timestamp):
+        return float(np.interp(timestamp, self._times, self._moon))
+
+    def night_window(self, altitude):
+        """Returns the dusk and dawn of the night, when the Sun is below the
+        altitude given.
+
+        Args:
+            altitude: Altitude of the Sun in degrees.
+
+        Returns:
+            A tuple with the times of dusk and dawn, the start or end of the
+            table if the Sun is below all the time, or None if the Sun is
+            never below.
+        """
+
+        below = self._sun <= altitude
+
+        window = None
+
+        if below.any():
+            first = np.argmax(below)
+            last = len(below) - 1 - np.argmax(below[::-1])
+
+            dusk = self._crossing(first - 1, altitude) if first > 0 \
+                else self._times[0]
+
+            dawn = self._crossing(last, altitude) if last < len(below) - 1 \
+                else self._times[-1]
+
+            window = (dusk, dawn)
+
+        return window
+
+    def _crossing(self, i, altitude):
+        """Returns the time when the Sun crosses the altitude between the
+        times i and i + 1 of the table.
+        """
+
+        fraction = (altitude - self._sun[i]) / \
+            (self._sun[i + 1] - self._sun[i])
+
+        return self._times[i] + \
+            fraction * (self._times[i + 1] - self._times[i])
+
+    def save(self, file_name):
+
+        np.savez(file_name, times=self._times, sun=self._sun, moon=self._moon)
+
+    @staticmethod
+    def load(file_name):
+
+        data = np.load(file_name)
+
+        return EphemerisTable(data["times"], data["sun"], data["moon"])
+
+class NightScheduler(object):
+    """Knows when it is night at a site and the altitudes of the Sun and the
+    Moon at any time.
+    """
+
+    def __init__(self, latitude, longitude, twilight,
+                 cache_dir=DEFAULT_CACHE_DIR):
+        """Initializes the scheduler.
+
+        Args:
+            latitude: Latitude of the site in degrees.
+            longitude: Longitude of the site in degrees, east positive.
+            twilight: Twilight that ends the day, CIVIL, NAUTICAL or
+                ASTRONOMICAL.
+            cache_dir: Directory to keep the tables calculated.
+        """
+
+        self._latitude = latitude
+        self._longitude = longitude
+        self._twilight = twilight
+        self._sun_limit = TWILIGHT_ALTITUDES[twilight]
+        self._cache_dir = cache_dir
+        self._tables = {}
+
+    @property
+    def twilight(self):
+        return self._twilight
+
+    def _cache_file_name(self, start):
+
+        return os.path.join(self._cache_dir, "%+08.3f_%+09.3f_%s.npz" %
+                            (self._latitude, self._longitude,
+                             time.strftime("%Y%m%d", time.localtime(start))))
+
+    def table(self, timestamp):
+        """Returns the table of the night of a time, calculating it only if
+        it isn't in memory or in the cache directory.
+
+        Args:
+            timestamp: Time in seconds since the epoch.
+        """
+
+        start = night_start(timestamp)
+
+        table = self._tables.get(start)
+
+        if table is None:
+            file_name = self._cache_file_name(start)
+
+            try:
+                table = EphemerisTable.load(file_name)
+            except (IOError, OSError, KeyError, ValueError):
+                table = self._calculate(start)
+
+                try:
+                    if not os.path.isdir(self._cache_dir):
+                        os.makedirs(self._cache_dir)
+
+                    table.save(file_name)
+
+                except (IOError, OSError) as e:
+                    logging.warning("Ephemeris not cached: %s" % e)
+
+            if len(self._tables) >= _MAX_TABLES_IN_MEMORY:
+                del self._tables[min(self._tables)]
+
+            self._tables[start] = table
+
+        return table
+
+    def _calculate(self, start):
+        """Calculate the table of the night starting at the time given."""
+
+        logging.debug("Calculating ephemeris of the night of %s" %
+                      time.strftime("%d-%m-%Y", time.localtime(start)))
+
+        # A step more to include the next noon with days of 25 hours.
+        times = start + np.arange(0, 25 * 3600 + TABLE_STEP, TABLE_STEP,
+                                  dtype=np.float64)
+
+        sun, moon = calculate_altitudes(self._latitude, self._longitude,
+                                        times)
+
+        return EphemerisTable(times, sun, moon)
+
+    def altitudes(self, timestamp):
+        """Returns the altitudes of the Sun and the Moon at a time.
+
+        Args:
+            timestamp: Time in seconds since the epoch.
+        """
+
+        table = self.table(timestamp)
+
+        return table.sun_altitude(timestamp), table.moon_altitude(timestamp)
+
+    def is_night(self, timestamp):
+        """Returns True if the Sun is below the twilight altitude.
+
+        Args:
+            timestamp: Time in seconds since the epoch.
+        """
+
+        return self.table(timestamp).sun_altitude(timestamp) <= self._sun_limit
+
+    def next_dusk(self, timestamp):
+        """Returns when the next night starts, the time given if it's night.
+
+        Args:
+            timestamp: Time in seconds since the epoch.
+
+        Returns:
+            The time in seconds since the epoch, None if there isn't any
+            night in the next days.
+        """
+
+        dusk = None
+
+        if self.is_night(timestamp):
+            dusk = timestamp
+        else:
+            night_time = timestamp
+
+            for _ in range(_MAX_NIGHTS_SEARCHED):
+                window = self.table(night_time).night_window(self._sun_limit)
+
+                if window is not None and window[1] > timestamp:
+                    dusk = max(window[0], timestamp)
+                    break
+
+                # Noon of the next night, with a margin for the summer time.
+                night_time = night_start(night_time) + 26 * 3600
+
+        return dusk
+
+    def dawn(self, timestamp):
+        """Returns when the night of a time ends.
+
+        Args:
+            timestamp: Time in seconds since the epoch.
+
+        Returns:
+            The time in seconds since the epoch, None if the Sun is never
+            below the twilight altitude that night.
+        """
+
+        window = self.table(timestamp).night_window(self._sun_limit)
+
+        return window[1] if window is not None else None
+
+def create_scheduler(sqm_config):
+    """Returns the scheduler for the night set in the configuration, None to
+    measure at any time.
+
+    Args:
+        sqm_config: Configuration parameters.
+    """
+
+    scheduler = None
+
+    if not sqm_config.night_always:
+        scheduler = NightScheduler(sqm_config.latitude, sqm_config.longitude,
+                                   sqm_config.night)
+
+    return scheduler
+
+if __name__ == "__main__":
+
+    # Shows the nights of the next days at a site.
+    if len(sys.argv) < 3:
+        print "Usage: %s latitude longitude [twilight [days]]" % sys.argv[0]
+        sys.exit(1)
+
+    scheduler = NightScheduler(float(sys.argv[1]), float(sys.argv[2]),
+                               sys.argv[3] if len(sys.argv) > 3
+                               else "ASTRONOMICAL")
+
+    now = time.time()
+
+    for day in range(int(sys.argv[4]) if len(sys.argv) > 4 else 3):
+        night_time = night_start(now) + day * 24 * 3600 + 3600
+
+        window = scheduler.table(night_time).night_window(
+            TWILIGHT_ALTITUDES[scheduler.twilight])
+
+        if window is None:
+            print "%s: no night" % time.strftime("%d-%m-%Y",
+                                                 time.localtime(night_time))
+        else:
+            print "%s: dusk %s dawn %s" % \
+                (time.strftime("%d-%m-%Y", time.localtime(night_time)),
+                 time.strftime("%H:%M", time.localtime(window[0])),
+                 time.strftime("%H:%M", time.localtime(window[1])))
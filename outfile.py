@@ -23,6 +23,37 @@
 import logging
 import time
 
+# Modified Julian Date of the Unix epoch and seconds of a day.
+MJD_UNIX_EPOCH = 40587.0
+SECONDS_PER_DAY = 86400.0
+
+def unix_to_mjd(unix_time):
+    """Convert a time in seconds since the epoch to Modified Julian Date.
+    
+    The result is the same that astropy gives for UTC from unix time, as both
+    don't count the leap seconds, without its cost for each measure.
+    
+    Args:
+        unix_time: Time in seconds since the epoch.
+        
+    Returns:
+        The Modified Julian Date.
+    """
+    
+    return MJD_UNIX_EPOCH + unix_time / SECONDS_PER_DAY
+
+def mjd_to_unix(mjd):
+    """Convert a Modified Julian Date to seconds since the epoch.
+    
+    Args:
+        mjd: Modified Julian Date.
+        
+    Returns:
+        The time in seconds since the epoch.
+    """
+    
+    return (mjd - MJD_UNIX_EPOCH) * SECONDS_PER_DAY
+
 class OutputFileException(Exception):
     
     def __init__(self, msg):
@@ -36,8 +67,8 @@ class OutputFileException(Exception):
 class OutputFile(object):
     """This class manages the output file."""
     
-    _COMMENT_CHAR = "#"
-    _FILE_EXT = "out"
+    COMMENT_CHAR = "#"
+    FILE_EXT = "out"
     
     def __init__(self, original_filename):
         
@@ -74,7 +105,7 @@ class OutputFile(object):
         """
         
         return "%s_%s.%s" % (time.strftime("%Y%m%d%H%M%S", time.localtime()),
-                             original_filename, OutputFile._FILE_EXT)
+                             original_filename, OutputFile.FILE_EXT)
             
     def write(self, msg):
         """Write the message received to the output file.
@@ -97,5 +128,5 @@ class OutputFile(object):
         """   
         
         if self._file is not None:
-            self._file.write("%s %s\n" % (OutputFile._COMMENT_CHAR, msg))
+            self._file.write("%s %s\n" % (OutputFile.COMMENT_CHAR, msg))
             self._file.flush()             
\ No newline at end of file
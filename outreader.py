@@ -0,0 +1,561 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Reads the output files written by the measures."""
+
+import os
+import mmap
+import time
+import logging
+
+import numpy as np
+
+from outfile import OutputFile, OutputFileException
+
+# Format of the local time of the continuous measures, with optional
+# milliseconds after a dot.
+CONTINUOUS_TIME_FORMAT = "%d-%m-%Y %H:%M:%S"
+
+# To separate time from measure in the continuous files, as written by
+# sqmcontrol.
+CONTINUOUS_SEP_STR = "->"
+
+ALL_SKY_VALUES_SEP = ","
+
+def _local_time_to_unix(date_str, time_str):
+    """Convert the local date and time of a continuous file to seconds since
+    the epoch. The fields are sliced directly as strptime is the slowest part
+    of reading a file.
+
+    Args:
+        date_str: Date as dd-mm-YYYY.
+        time_str: Time as HH:MM:SS.
+
+    Returns:
+        The time in seconds since the epoch.
+    """
+
+    if len(date_str) == 10 and len(time_str) == 8:
+        time_tuple = (int(date_str[6:10]), int(date_str[3:5]),
+                      int(date_str[0:2]), int(time_str[0:2]),
+                      int(time_str[3:5]), int(time_str[6:8]), 0, 0, -1)
+    else:
+        time_tuple = time.strptime("%s %s" % (date_str, time_str),
+                                   CONTINUOUS_TIME_FORMAT)
+
+    return time.mktime(time_tuple)
+
+def parse_continuous_line(line):
+    """Parse a line of a continuous output file.
+
+    Args:
+        line: Line to parse.
+
+    Returns:
+        A tuple with the time in seconds since the epoch, the MJD and the
+        measure as a string, or None if the line is a comment or not valid.
+    """
+
+    reading = None
+
+    if not line.startswith(OutputFile.COMMENT_CHAR):
+
+        fields = line.split(CONTINUOUS_SEP_STR)
+
+        if len(fields) == 2:
+
+            try:
+                # Left side: date, time and MJD between parentheses.
+                date_str, time_str, mjd_str = fields[0].split()
+
+                seconds_str, dot, millis_str = time_str.partition(".")
+
+                timestamp = _local_time_to_unix(date_str, seconds_str)
+
+                if len(millis_str) > 0:
+                    timestamp += float("0." + millis_str)
+
+                mjd = float(mjd_str.strip("()"))
+
+                # Right side: the measure followed by optional fields.
+                measure = fields[1].split()[0]
+
+                reading = (timestamp, mjd, measure)
+
+            except (ValueError, IndexError):
+                logging.debug("Invalid continuous line: %s" % line.strip())
+
+    return reading
+
+def read_continuous_file(filename, start=0, end=None):
+    """Read the measures of a continuous output file.
+
+    Args:
+        filename: Name of the file.
+        start: Offset of the first line to read.
+        end: Offset where the reading stops, the end of the file if None.
+
+    Returns:
+        A generator of tuples with the time in seconds since the epoch, the
+        MJD and the measure as a string.
+    """
+
+    try:
+        with open(filename, "r") as fr:
+            fr.seek(start)
+
+            position = start
+
+            for line in fr:
+                if end is not None and position >= end:
+                    break
+
+                position += len(line)
+
+                reading = parse_continuous_line(line)
+
+                if reading is not None:
+                    yield reading
+
+    except IOError as ioe:
+        raise OutputFileException("Reading file %s: %s" % (filename, ioe))
+
+def is_continuous_file(filename):
+    """Returns True if the file has the format of the continuous measures.
+
+    Args:
+        filename: Name of the file.
+    """
+
+    continuous = False
+
+    try:
+        with open(filename, "r") as fr:
+            for line in fr:
+                if not line.startswith(OutputFile.COMMENT_CHAR):
+                    continuous = parse_continuous_line(line) is not None
+                    break
+
+    except IOError as ioe:
+        raise OutputFileException("Reading file %s: %s" % (filename, ioe))
+
+    return continuous
+
+def read_all_sky_file(filename, vert_dim):
+    """Read the measures of an all sky file saved as a list.
+
+    Args:
+        filename: Name of the file.
+        vert_dim: Number of vertical values of each azimuth.
+
+    Returns:
+        A tuple with the information in the first comment of the file, the
+        others are the reloads of the configuration, a list with a list of
+        the values of each azimuth and the value of the zenith.
+    """
+
+    info = None
+    values = []
+
+    try:
+        with open(filename, "r") as fr:
+            for line in fr:
+                if line.startswith(OutputFile.COMMENT_CHAR):
+                    if info is None:
+                        info = line[len(OutputFile.COMMENT_CHAR):].strip()
+                elif len(line.strip()) > 0:
+                    values.extend([ v.strip() for v in
+                                   line.split(ALL_SKY_VALUES_SEP) ])
+
+    except IOError as ioe:
+        raise OutputFileException("Reading file %s: %s" % (filename, ioe))
+
+    # Each azimuth is saved as its vertical values followed by the zenith.
+    group_size = vert_dim + 1
+
+    if len(values) == 0 or len(values) % group_size != 0:
+        raise OutputFileException("Invalid all sky file: %s" % filename)
+
+    azimuths = [ values[i:i + vert_dim]
+                for i in range(0, len(values), group_size) ]
+
+    zenith = values[vert_dim]
+
+    return info or "", azimuths, zenith
+
+class ContinuousFileReader(object):
+    """Reads a continuous output file through a memory map without loading
+    it.
+
+    The starts of the lines are found scanning the bytes of the map for the
+    new lines with numpy, in chunks and only as far as the rows requested,
+    from the start for the first rows and from the end for the last ones.
+    Only the rows requested are parsed, the comments are not rows. The rows
+    can be indexed and sliced as a sequence, a row is a tuple with its time
+    in seconds since the epoch, MJD and measure, and a slice is a tuple with
+    an array of each one.
+    """
+
+    # Bytes scanned each time looking for new lines.
+    CHUNK_SIZE = 1 << 22
+
+    _NEW_LINE = ord("\n")
+    _COMMENT = ord(OutputFile.COMMENT_CHAR)
+
+    def __init__(self, filename):
+        """Map the file, nothing is read.
+
+        Args:
+            filename: Name of the file.
+        """
+
+        self._filename = filename
+        self._mmap = None
+
+        try:
+            with open(filename, "rb") as fr:
+                size = os.fstat(fr.fileno()).st_size
+
+                # Empty files can't be mapped.
+                if size > 0:
+                    self._mmap = mmap.mmap(fr.fileno(), 0,
+                                           access=mmap.ACCESS_READ)
+
+        except (IOError, OSError, mmap.error) as e:
+            raise OutputFileException("Mapping file %s: %s" % (filename, e))
+
+        self._size = size
+        self._bytes = np.frombuffer(self._mmap, dtype=np.uint8) \
+            if size > 0 else np.zeros(0, dtype=np.uint8)
+
+        # Starts of the rows found from the start up to _head_end and from
+        # _tail_begin to the end, both limits are starts of lines.
+        self._head = []
+        self._head_count = 0
+        self._head_end = 0
+        self._tail = []
+        self._tail_count = 0
+        self._tail_begin = size
+
+        self._starts = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+
+        self._bytes = None
+
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    @property
+    def filename(self):
+        return self._filename
+
+    def _row_starts(self, begin, end):
+        """Returns the starts of the rows of the lines between two offsets,
+        the first one must be the start of a line.
+        """
+
+        new_lines = np.flatnonzero(
+            self._bytes[begin:end] == ContinuousFileReader._NEW_LINE)
+
+        starts = np.concatenate(([ begin ], begin + new_lines + 1))
+        starts = starts[starts < end]
+
+        # Not the comments nor the empty lines.
+        first_bytes = self._bytes[starts]
+
+        return starts[(first_bytes != ContinuousFileReader._COMMENT) &
+                      (first_bytes != ContinuousFileReader._NEW_LINE)]
+
+    def _complete(self):
+        """Returns True if all the rows have been found, joining the rows
+        found from the start and from the end.
+        """
+
+        if self._starts is None and self._head_end >= self._tail_begin:
+            tail = np.concatenate(self._tail[::-1]) if self._tail_count > 0 \
+                else np.zeros(0, dtype=np.int64)
+
+            self._starts = np.concatenate(
+                self._head + [ tail[tail >= self._head_end] ]).astype(np.int64)
+
+        return self._starts is not None
+
+    def _scan_forward(self):
+        """Find the rows of the next chunk from the start."""
+
+        end = min(self._head_end + ContinuousFileReader.CHUNK_SIZE,
+                  self._tail_begin)
+
+        if end < self._tail_begin:
+            # Stop at the end of the last line of the chunk.
+            new_line = self._mmap.rfind("\n", self._head_end, end)
+
+            end = new_line + 1 if new_line >= 0 else \
+                self._mmap.find("\n", end, self._tail_begin) + 1
+
+            if end == 0:
+                end = self._tail_begin
+
+        starts = self._row_starts(self._head_end, end)
+
+        self._head.append(starts)
+        self._head_count += len(starts)
+        self._head_end = end
+
+    def _scan_backward(self):
+        """Find the rows of the previous chunk from the end."""
+
+        begin = max(self._tail_begin - ContinuousFileReader.CHUNK_SIZE,
+                    self._head_end)
+
+        if begin > self._head_end:
+            # Start at the first line starting in the chunk, the new line
+            # ending the chunk is that of the line before.
+            new_line = self._mmap.find("\n", begin - 1, self._tail_begin - 1)
+
+            begin = new_line + 1 if new_line >= 0 else \
+                self._mmap.rfind("\n", self._head_end, begin) + 1
+
+            if begin <= self._head_end:
+                begin = self._head_end
+
+        starts = self._row_starts(begin, self._tail_begin)
+
+        self._tail.append(starts)
+        self._tail_count += len(starts)
+        self._tail_begin = begin
+
+    def _head_starts(self, count):
+        """Returns the starts of the first rows, less if there aren't so
+        many.
+        """
+
+        while not self._complete() and self._head_count < count:
+            self._scan_forward()
+
+        if self._complete():
+            starts = self._starts[:count]
+        else:
+            starts = np.concatenate(self._head)[:count]
+
+        return starts
+
+    def _tail_starts(self, count):
+        """Returns the starts of the last rows, less if there aren't so
+        many.
+        """
+
+        while not self._complete() and self._tail_count < count:
+            self._scan_backward()
+
+        if self._complete():
+            starts = self._starts[max(0, len(self._starts) - count):]
+        else:
+            starts = np.concatenate(self._tail[::-1])
+            starts = starts[max(0, len(starts) - count):]
+
+        return starts
+
+    def _all_starts(self):
+
+        while not self._complete():
+            self._scan_forward()
+
+        return self._starts
+
+    def __len__(self):
+        """Returns the number of rows, scanning the whole file if it hasn't
+        been done yet.
+        """
+
+        return len(self._all_starts())
+
+    def _line(self, start):
+        """Returns the line starting at the offset."""
+
+        end = self._mmap.find("\n", start)
+
+        return self._mmap[start:end if end >= 0 else self._size]
+
+    def _parse(self, start):
+        """Returns the time, MJD and measure of the row starting at the
+        offset, nan if the row isn't valid.
+        """
+
+        reading = parse_continuous_line(self._line(start))
+
+        if reading is None:
+            row = (np.nan, np.nan, np.nan)
+        else:
+            try:
+                row = (reading[0], reading[1], float(reading[2]))
+            except ValueError:
+                row = (reading[0], reading[1], np.nan)
+
+        return row
+
+    def rows(self, starts):
+        """Parse the rows starting at the offsets given.
+
+        Args:
+            starts: Offsets of the rows.
+
+        Returns:
+            A tuple with the arrays of times, MJDs and measures.
+        """
+
+        values = np.array([ self._parse(s) for s in starts ],
+                          dtype=np.float64).reshape(-1, 3)
+
+        return values[:, 0], values[:, 1], values[:, 2]
+
+    def head(self, count):
+        """Returns the first rows, only the beginning of the file is read.
+
+        Args:
+            count: Number of rows.
+        """
+
+        return self.rows(self._head_starts(count))
+
+    def tail(self, count):
+        """Returns the last rows, only the end of the file is read.
+
+        Args:
+            count: Number of rows.
+        """
+
+        return self.rows(self._tail_starts(count))
+
+    def __getitem__(self, index):
+
+        if isinstance(index, slice):
+            start, stop, step = index.start, index.stop, index.step
+
+            # Going backwards the rows could be anywhere in the file.
+            forward = step is None or step > 0
+
+            if forward and (start is None or start >= 0) and \
+                stop is not None and stop >= 0:
+                # The first rows are enough.
+                rows = self.rows(self._head_starts(stop)[start:stop:step])
+
+            elif forward and start is not None and start < 0 and \
+                (stop is None or stop < 0):
+                # The last rows are enough.
+                starts = self._tail_starts(-start)
+
+                rows = self.rows(starts[:stop:step] if stop is not None
+                                 else starts[::step])
+            else:
+                rows = self.rows(self._all_starts()[index])
+        else:
+            if index >= 0:
+                starts = self._head_starts(index + 1)
+            else:
+                starts = self._tail_starts(-index)
+
+            if len(starts) < abs(index) + (1 if index >= 0 else 0):
+                raise IndexError("Row %d out of range in %s" %
+                                 (index, self._filename))
+
+            rows = self._parse(starts[index if index < 0 else -1])
+
+        return rows
+
+    def _row_at_or_after(self, offset):
+        """Returns the start and time of the first valid row at or after a
+        offset, None if there isn't any.
+        """
+
+        if offset > 0:
+            new_line = self._mmap.find("\n", offset - 1)
+            offset = new_line + 1 if new_line >= 0 else self._size
+
+        found = None
+
+        while found is None and offset < self._size:
+            timestamp = self._parse(offset)[0]
+
+            if not np.isnan(timestamp):
+                found = (offset, timestamp)
+            else:
+                new_line = self._mmap.find("\n", offset)
+                offset = new_line + 1 if new_line >= 0 else self._size
+
+        return found
+
+    def find_time(self, timestamp):
+        """Returns the offset of the first row at or after a time, reading
+        only a few lines as the rows are in time order.
+
+        Args:
+            timestamp: Time in seconds since the epoch.
+
+        Returns:
+            The offset, the size of the file if all the rows are before.
+        """
+
+        low = 0
+        high = self._size
+
+        while low < high:
+            middle = (low + high) // 2
+
+            row = self._row_at_or_after(middle)
+
+            if row is None or row[1] >= timestamp:
+                high = middle
+            else:
+                # The row found is before, continue after it.
+                low = row[0] + 1
+
+        row = self._row_at_or_after(low)
+
+        return row[0] if row is not None else self._size
+
+    def between(self, start_time, end_time):
+        """Returns the rows with times in an interval.
+
+        Args:
+            start_time: First time, in seconds since the epoch.
+            end_time: Time after the last one.
+
+        Returns:
+            A tuple with the arrays of times, MJDs and measures.
+        """
+
+        begin = self.find_time(start_time)
+        end = self.find_time(end_time)
+
+        starts = []
+
+        # The lines of the interval are contiguous, only they are scanned.
+        if end > begin:
+            starts = self._row_starts(begin, end)
+
+        return self.rows(starts)
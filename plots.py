@@ -0,0 +1,444 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Plots the all sky maps and the continuous measures to PNG files.
+
+The plots are drawn without display. The geometry of each grid of the all
+sky maps and the fixed normalization of the colors are calculated once, and
+each kind of plot reuses its figure, only updating the values drawn, so
+many files are plotted quickly.
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+
+import numpy as np
+
+import matplotlib
+
+# Without display, must be set before importing pyplot.
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+from matplotlib.colors import Normalize
+
+from outfile import OutputFileException
+from outreader import read_all_sky_file, is_continuous_file
+from decimate import decimate, ZoomPyramid
+
+# Range of magnitudes of the colors with PLOT_COLORS = FIXED.
+FIXED_MIN_MAGNITUDE = 16.0
+FIXED_MAX_MAGNITUDE = 22.0
+
+# The darkest skies have the highest magnitudes.
+COLOR_MAP = "viridis"
+
+PLOT_EXT = "png"
+PLOT_DPI = 100
+
+# Margin of the magnitudes of the continuous plots, part of their range, and
+# its minimum in magnitudes.
+MAGNITUDE_MARGIN = 0.05
+MIN_MAGNITUDE_MARGIN = 0.1
+
+# Intervals longer than these times the usual one are drawn as gaps.
+GAP_FACTOR = 3.0
+
+# Altitude of the zenith.
+ZENITH_ALTITUDE = 90.0
+
+_SKY_FIGURE_SIZE = (7, 6)
+_CONTINUOUS_FIGURE_SIZE = (10, 4)
+
+# Points of the continuous plots, two for each pixel of their width.
+CONTINUOUS_POINTS = 2 * _CONTINUOUS_FIGURE_SIZE[0] * PLOT_DPI
+
+# Geometry of each grid of the all sky maps.
+_sky_meshes = {}
+
+_FIXED_NORM = Normalize(FIXED_MIN_MAGNITUDE, FIXED_MAX_MAGNITUDE)
+
+def plot_file_name(original_filename, output_dir=None):
+    """Returns the name of the plot of an output file.
+
+    Args:
+        original_filename: Name of the output file or of the measures.
+        output_dir: Directory of the plot, that of the file if None.
+    """
+
+    base = os.path.splitext(os.path.basename(original_filename))[0]
+
+    if output_dir is None:
+        output_dir = os.path.dirname(original_filename)
+
+    return os.path.join(output_dir, "%s.%s" % (base, PLOT_EXT))
+
+def session_plot_name(name):
+    """Returns the name of the plot of the measures taken now, as that of
+    their output file.
+
+    Args:
+        name: Name of the measures.
+    """
+
+    return "%s_%s.%s" % (time.strftime("%Y%m%d%H%M%S", time.localtime()),
+                         name, PLOT_EXT)
+
+def sky_mesh(azimuths, verticals):
+    """Returns the edges of the cells of an all sky map in polar
+    coordinates, the angle the azimuth and the radius the distance to the
+    zenith. Calculated once for each grid.
+
+    Args:
+        azimuths: Azimuth values in degrees.
+        verticals: Vertical values in degrees.
+
+    Returns:
+        A tuple with the meshes of angles and radii of the cells, and the
+        meshes of the cell of the zenith.
+    """
+
+    key = (tuple(azimuths), tuple(verticals))
+
+    mesh = _sky_meshes.get(key)
+
+    if mesh is None:
+        azimuths = np.asarray(azimuths, dtype=np.float64)
+        verticals = np.asarray(verticals, dtype=np.float64)
+
+        # Each cell extends half way to its neighbours.
+        az_step = 360.0 / len(azimuths)
+        az_edges = np.radians(np.append(azimuths - az_step / 2.0,
+                                        azimuths[-1] + az_step / 2.0))
+
+        middles = (verticals[:-1] + verticals[1:]) / 2.0
+        vert_edges = np.concatenate(
+            ([ verticals[0] - (middles[0] - verticals[0]) ], middles,
+             [ (verticals[-1] + ZENITH_ALTITUDE) / 2.0 ]))
+
+        theta, radius = np.meshgrid(az_edges, ZENITH_ALTITUDE - vert_edges)
+
+        zenith_theta, zenith_radius = np.meshgrid(
+            np.radians([ 0.0, 360.0 ]),
+            [ 0.0, ZENITH_ALTITUDE - vert_edges[-1] ])
+
+        mesh = (theta, radius, zenith_theta, zenith_radius)
+
+        _sky_meshes[key] = mesh
+
+    return mesh
+
+def color_norm(values, extend_colors):
+    """Returns the normalization of the colors of the values.
+
+    Args:
+        values: Magnitudes to draw.
+        extend_colors: True to extend the colors to the range of the values,
+            otherwise the fixed range is used.
+    """
+
+    norm = _FIXED_NORM
+
+    if extend_colors:
+        finite = np.asarray(values)[np.isfinite(values)]
+
+        if len(finite) > 0 and finite.max() > finite.min():
+            norm = Normalize(finite.min(), finite.max())
+
+    return norm
+
+def magnitude_limits(magnitudes):
+    """Returns the limits of the axis of the magnitudes, inverted as the
+    brightest skies have the lowest magnitudes.
+
+    The limits are those of the magnitudes with a margin, whatever the range
+    of the colors, so twilight or cloudy readings are also drawn. The fixed
+    range is used if there aren't magnitudes.
+
+    Args:
+        magnitudes: Magnitudes to draw.
+
+    Returns:
+        A tuple with the limits of the bottom and the top of the axis.
+    """
+
+    finite = np.asarray(magnitudes)[np.isfinite(magnitudes)]
+
+    if len(finite) > 0:
+        low = np.nanmin(finite)
+        high = np.nanmax(finite)
+    else:
+        low = FIXED_MIN_MAGNITUDE
+        high = FIXED_MAX_MAGNITUDE
+
+    margin = max((high - low) * MAGNITUDE_MARGIN, MIN_MAGNITUDE_MARGIN)
+
+    return high + margin, low - margin
+
+def break_gaps(times, magnitudes):
+    """Insert a nan after the intervals much longer than usual, so the gaps
+    are not joined when drawn.
+
+    Args:
+        times: Array of times.
+        magnitudes: Array of magnitudes.
+
+    Returns:
+        The times and magnitudes with the gaps.
+    """
+
+    if len(times) > 2:
+        intervals = np.diff(times)
+
+        gaps = np.flatnonzero(intervals > GAP_FACTOR * np.median(intervals))
+
+        if len(gaps) > 0:
+            times = np.insert(times, gaps + 1,
+                              times[gaps] + intervals[gaps] / 2)
+            magnitudes = np.insert(magnitudes, gaps + 1, np.nan)
+
+    return times, magnitudes
+
+class PlotRenderer(object):
+    """Draws the plots reusing a figure for each kind of plot."""
+
+    def __init__(self, extend_colors=False):
+        """Initializes the renderer, the figures are created when needed.
+
+        Args:
+            extend_colors: True to extend the colors to the range of the
+                values of each plot, otherwise a fixed range is used.
+        """
+
+        self._extend_colors = extend_colors
+
+        self._sky = None
+        self._sky_grid = None
+        self._continuous = None
+
+    def close(self):
+
+        for figure in (self._sky, self._continuous):
+            if figure is not None:
+                plt.close(figure["figure"])
+
+        self._sky = None
+        self._continuous = None
+
+    def _create_sky_figure(self, azimuths, verticals):
+        """Create the figure of the all sky maps of a grid."""
+
+        if self._sky is not None:
+            plt.close(self._sky["figure"])
+
+        theta, radius, zenith_theta, zenith_radius = \
+            sky_mesh(azimuths, verticals)
+
+        figure = plt.figure(figsize=_SKY_FIGURE_SIZE)
+        axes = figure.add_subplot(111, projection="polar")
+
+        # North up and the azimuth growing to the east.
+        axes.set_theta_zero_location("N")
+        axes.set_theta_direction(-1)
+        axes.set_ylim(0, radius.max())
+        axes.set_yticks(ZENITH_ALTITUDE - np.asarray(verticals))
+        axes.set_yticklabels([ "%d" % v for v in verticals ])
+
+        empty = np.ma.masked_all((len(verticals), len(azimuths)))
+
+        mesh = axes.pcolormesh(theta, radius, empty, cmap=COLOR_MAP,
+                               norm=_FIXED_NORM)
+
+        zenith_mesh = axes.pcolormesh(zenith_theta, zenith_radius,
+                                      np.ma.masked_all((1, 1)), cmap=COLOR_MAP,
+                                      norm=_FIXED_NORM)
+
+        colorbar = figure.colorbar(mesh, ax=axes, pad=0.1)
+        colorbar.set_label("mag/arcsec2")
+
+        # A label with the value of each cell, updated for each map.
+        labels = [ axes.text(np.radians(a), ZENITH_ALTITUDE - v, "",
+                             ha="center", va="center", fontsize=7)
+                   for v in verticals for a in azimuths ]
+
+        labels.append(axes.text(0, 0, "", ha="center", va="center",
+                                fontsize=7))
+
+        self._sky = { "figure" : figure, "axes" : axes, "mesh" : mesh,
+                      "zenith" : zenith_mesh, "labels" : labels,
+                      "colorbar" : colorbar }
+        self._sky_grid = (tuple(azimuths), tuple(verticals))
+
+    def all_sky(self, azimuths, verticals, values, zenith, file_name,
+                title=""):
+        """Plot an all sky map.
+
+        Args:
+            azimuths: Azimuth values in degrees.
+            verticals: Vertical values in degrees.
+            values: Magnitudes by vertical value and azimuth.
+            zenith: Magnitude of the zenith.
+            file_name: Name of the file to save the plot.
+            title: Title of the plot.
+        """
+
+        if self._sky_grid != (tuple(azimuths), tuple(verticals)):
+            self._create_sky_figure(azimuths, verticals)
+
+        values = np.asarray(values, dtype=np.float64)
+        zenith = float(zenith)
+
+        norm = color_norm(np.append(values.ravel(), zenith),
+                          self._extend_colors)
+
+        for mesh, data in ((self._sky["mesh"], values),
+                           (self._sky["zenith"], np.array([[ zenith ]]))):
+            mesh.set_array(np.ma.masked_invalid(data).ravel())
+            mesh.set_clim(norm.vmin, norm.vmax)
+
+        for label, value in zip(self._sky["labels"],
+                                np.append(values.ravel(), zenith)):
+            label.set_text("" if np.isnan(value) else "%.2f" % value)
+
+        self._sky["axes"].set_title(title)
+
+        self._sky["figure"].savefig(file_name, dpi=PLOT_DPI)
+
+    def _create_continuous_figure(self):
+
+        figure = plt.figure(figsize=_CONTINUOUS_FIGURE_SIZE)
+        axes = figure.add_subplot(111)
+
+        line, = axes.plot([], [], "-", linewidth=0.8)
+
+        axes.set_ylabel("mag/arcsec2")
+        axes.xaxis.set_major_formatter(mdates.DateFormatter("%d-%m %H:%M"))
+        axes.grid(True, alpha=0.3)
+
+        figure.autofmt_xdate()
+
+        self._continuous = { "figure" : figure, "axes" : axes, "line" : line }
+
+    def continuous(self, times, magnitudes, file_name, title=""):
+        """Plot the continuous measures along the time.
+
+        Args:
+            times: Array of times in seconds since the epoch.
+            magnitudes: Array of magnitudes.
+            file_name: Name of the file to save the plot.
+            title: Title of the plot.
+        """
+
+        if self._continuous is None:
+            self._create_continuous_figure()
+
+        times, magnitudes = break_gaps(*decimate(times, magnitudes,
+                                                 CONTINUOUS_POINTS))
+
+        axes = self._continuous["axes"]
+
+        self._continuous["line"].set_data(mdates.epoch2num(times), magnitudes)
+
+        if len(times) > 0:
+            axes.set_xlim(mdates.epoch2num(times[0]),
+                          mdates.epoch2num(max(times[-1], times[0] + 1)))
+
+        axes.set_ylim(*magnitude_limits(magnitudes))
+        axes.set_title(title)
+
+        self._continuous["figure"].savefig(file_name, dpi=PLOT_DPI)
+
+    def plot_file(self, file_name, output_dir=None, vertical_values=None):
+        """Plot an output file, continuous or all sky.
+
+        Args:
+            file_name: Name of the output file.
+            output_dir: Directory of the plot, that of the file if None.
+            vertical_values: Vertical values of the all sky files, those of
+                the all sky measures if None.
+
+        Returns:
+            The name of the plot.
+        """
+
+        plot_name = plot_file_name(file_name, output_dir)
+
+        if is_continuous_file(file_name):
+            # The levels decimated are kept to plot the file again.
+            times, magnitudes = ZoomPyramid.from_file(file_name).query(
+                points=CONTINUOUS_POINTS)
+
+            self.continuous(times, magnitudes, plot_name,
+                            os.path.basename(file_name))
+        else:
+            from allsky import AZIMUTH_VALUES, VERTICAL_VALUES
+
+            if vertical_values is None:
+                vertical_values = VERTICAL_VALUES
+
+            info, by_azimuth, zenith = read_all_sky_file(
+                file_name, len(vertical_values))
+
+            azimuths = AZIMUTH_VALUES[:len(by_azimuth)]
+
+            values = np.array(by_azimuth, dtype=np.float64).T
+
+            self.all_sky(azimuths, vertical_values, values, zenith, plot_name,
+                         info)
+
+        return plot_name
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Plot output files to " +
+                                     "PNG files.")
+
+    parser.add_argument("files", nargs="+", help="Output files to plot.")
+
+    parser.add_argument("-o", dest="output_dir", default=None,
+                        help="Directory of the plots, that of each file " +
+                        "by default.")
+
+    parser.add_argument("-e", dest="extend_colors", action="store_true",
+                        help="Extend the colors to the range of each plot.")
+
+    args = parser.parse_args()
+
+    renderer = PlotRenderer(args.extend_colors)
+
+    start_time = time.time()
+
+    plotted = 0
+
+    for f in args.files:
+        try:
+            print "Plotted %s" % renderer.plot_file(f, args.output_dir)
+            plotted += 1
+        except (OutputFileException, ValueError) as e:
+            logging.error(e)
+            print "Not plotted %s: %s" % (f, e)
+
+    renderer.close()
+
+    print "%d files plotted in %.1f s." % (plotted, time.time() - start_time)
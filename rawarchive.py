@@ -0,0 +1,494 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Archive of the raw replies of the SQM.
+
+Every reply is kept as received, with the time of its request and of its
+reply, so the measures can be processed again with all the fields of the
+SQM: magnitude, frequency, counts, period and temperature.
+
+The archive is a sequence of blocks, each one starting with a sync marker
+followed by its header, the records are compressed or not, and its CRC:
+
+    SYNC_MARKER | flags (1 byte) | records (4) | size (4) | crc32 (4) | data
+
+Each record of the data is prefixed by its lengths:
+
+    request time (8) | reply time (8) | device length (2) | reply length (2)
+    | device | reply
+
+The blocks are written every BLOCK_RECORDS replies or BLOCK_SECONDS, also
+while no reply arrives, and appended to the file of previous sessions. A
+block damaged is skipped looking for the next sync marker, so only its
+replies are lost.
+"""
+
+import sys
+import time
+import zlib
+import struct
+import logging
+import argparse
+import threading
+
+from outfile import OutputFileException
+
+# Marks the start of each block.
+SYNC_MARKER = "\xa5SQMRAW\x5a"
+
+_BLOCK_HEADER = struct.Struct("<BIII")
+_RECORD_HEADER = struct.Struct("<ddHH")
+
+# Flags of the block.
+COMPRESSED_FLAG = 0x01
+
+# Replies and seconds of each block.
+BLOCK_RECORDS = 256
+BLOCK_SECONDS = 60
+
+DEFAULT_ARCHIVE_FILE_NAME = "sqm_raw.bin"
+
+# Larger blocks are taken as damaged headers.
+_MAX_BLOCK_SIZE = 1 << 24
+
+# Bytes read at once looking for a sync marker.
+_SCAN_SIZE = 65536
+
+# Fields of the reply, as written by the SQM, and their units.
+REPLY_FIELDS = ( "magnitude", "frequency", "counts", "period",
+                 "temperature" )
+_REPLY_UNITS = ( "m", "Hz", "c", "s", "C" )
+_REPLY_PREFIX = "r"
+_REPLY_SEP = ","
+
+class RawArchiveWriter(object):
+    """Appends the raw replies to an archive, a block at a time."""
+
+    def __init__(self, file_name, compress=True,
+                 block_records=BLOCK_RECORDS, block_seconds=BLOCK_SECONDS):
+        """Opens the archive to append blocks.
+
+        Args:
+            file_name: Name of the archive.
+            compress: Compress the blocks with zlib.
+            block_records: Replies of each block.
+            block_seconds: Maximum seconds a reply waits to be written.
+        """
+
+        self._file_name = file_name
+        self._compress = compress
+        self._block_records = block_records
+        self._block_seconds = block_seconds
+
+        # The ports of the daemon and a rig could add replies from several
+        # threads.
+        self._lock = threading.Lock()
+
+        self._records = []
+        self._count = 0
+        self._block_start = None
+
+        # Time the first reply of the block was added, by the clock of the
+        # flusher.
+        self._first_added = None
+
+        try:
+            self._file = open(file_name, "ab")
+        except IOError as ioe:
+            raise OutputFileException("Opening archive %s: %s" %
+                                      (file_name, ioe))
+
+        # The replies are written after block_seconds even if no other reply
+        # arrives, as during the day or between jobs.
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_when_due,
+                                         name="archive flusher")
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    @property
+    def file_name(self):
+        return self._file_name
+
+    def add(self, request_time, reply_time, device, reply):
+        """Add a reply to the archive.
+
+        Args:
+            request_time: Time of the request in seconds since the epoch.
+            reply_time: Time of the reply in seconds since the epoch.
+            device: Path of the device.
+            reply: Reply as received, empty if there wasn't.
+        """
+
+        device = device or ""
+
+        with self._lock:
+            self._records.append(_RECORD_HEADER.pack(request_time, reply_time,
+                                                     len(device), len(reply)))
+            self._records.append(device)
+            self._records.append(reply)
+
+            self._count += 1
+
+            if self._block_start is None:
+                self._block_start = reply_time
+                self._first_added = time.time()
+
+            if self._count >= self._block_records or \
+                reply_time - self._block_start >= self._block_seconds:
+                self._write_block()
+
+    def _write_block(self):
+
+        if self._count > 0:
+            data = "".join(self._records)
+
+            flags = 0
+
+            if self._compress:
+                data = zlib.compress(data)
+                flags |= COMPRESSED_FLAG
+
+            try:
+                self._file.write(SYNC_MARKER +
+                                 _BLOCK_HEADER.pack(flags, self._count,
+                                                    len(data),
+                                                    zlib.crc32(data) &
+                                                    0xffffffff) +
+                                 data)
+                self._file.flush()
+            except IOError as ioe:
+                logging.error("Writing archive %s: %s" %
+                              (self._file_name, ioe))
+
+            self._records = []
+            self._count = 0
+            self._block_start = None
+            self._first_added = None
+
+    def _flush_when_due(self):
+        """Write the block when its first reply has waited block_seconds."""
+
+        while not self._closed.is_set():
+            with self._lock:
+                if self._first_added is None:
+                    wait = self._block_seconds
+                else:
+                    wait = self._first_added + self._block_seconds - \
+                        time.time()
+
+                    if wait <= 0:
+                        self._write_block()
+
+                        wait = self._block_seconds
+
+            self._closed.wait(wait)
+
+    def flush(self):
+        """Write the replies not written yet."""
+
+        with self._lock:
+            self._write_block()
+
+    def close(self):
+
+        self._closed.set()
+        self._flusher.join()
+
+        self.flush()
+
+        self._file.close()
+
+def _decode_block(data, count):
+    """Returns the records of the data of a block."""
+
+    records = []
+
+    offset = 0
+
+    for i in range(count):
+        request_time, reply_time, device_length, reply_length = \
+            _RECORD_HEADER.unpack_from(data, offset)
+
+        offset += _RECORD_HEADER.size
+
+        device = data[offset:offset + device_length]
+
+        offset += device_length
+
+        reply = data[offset:offset + reply_length]
+
+        offset += reply_length
+
+        records.append((request_time, reply_time, device, reply))
+
+    return records
+
+def read_raw_archive(file_name):
+    """Read the replies of an archive a block at a time.
+
+    Args:
+        file_name: Name of the archive.
+
+    Returns:
+        A generator of tuples with the time of the request and of the reply
+        in seconds since the epoch, the device and the reply.
+    """
+
+    try:
+        fr = open(file_name, "rb")
+    except IOError as ioe:
+        raise OutputFileException("Reading archive %s: %s" % (file_name, ioe))
+
+    header_size = len(SYNC_MARKER) + _BLOCK_HEADER.size
+
+    with fr:
+        while True:
+            start = fr.tell()
+
+            header = fr.read(header_size)
+
+            if len(header) < header_size:
+                if len(header) > 0:
+                    logging.warning("Incomplete block at %d of %s." %
+                                    (start, file_name))
+                break
+
+            records = None
+
+            if header.startswith(SYNC_MARKER):
+                flags, count, size, crc = \
+                    _BLOCK_HEADER.unpack_from(header, len(SYNC_MARKER))
+
+                data = fr.read(min(size, _MAX_BLOCK_SIZE))
+
+                if len(data) == size and zlib.crc32(data) & 0xffffffff == crc:
+                    try:
+                        if flags & COMPRESSED_FLAG:
+                            data = zlib.decompress(data)
+
+                        records = _decode_block(data, count)
+                    except (zlib.error, struct.error):
+                        records = None
+
+            if records is None:
+                logging.warning("Damaged block at %d of %s, looking for the "
+                                "next one." % (start, file_name))
+
+                if not _next_sync(fr, start + 1):
+                    break
+            else:
+                for record in records:
+                    yield record
+
+def _next_sync(fr, offset):
+    """Move the file to the next sync marker from an offset.
+
+    Returns:
+        False if there isn't another sync marker.
+    """
+
+    fr.seek(offset)
+
+    while True:
+        position = fr.tell()
+
+        data = fr.read(_SCAN_SIZE + len(SYNC_MARKER) - 1)
+
+        index = data.find(SYNC_MARKER)
+
+        if index >= 0:
+            fr.seek(position + index)
+
+            return True
+
+        if len(data) < _SCAN_SIZE + len(SYNC_MARKER) - 1:
+            return False
+
+        # The marker could start at the end of the data read.
+        fr.seek(position + _SCAN_SIZE)
+
+def parse_reply(reply):
+    """Returns the fields of a reply of the SQM as floats, in the order of
+    REPLY_FIELDS, or None if the reply is not valid.
+
+    Args:
+        reply: Reply of the SQM.
+    """
+
+    fields = [ f.strip() for f in reply.split(_REPLY_SEP) ]
+
+    values = None
+
+    if len(fields) > len(REPLY_FIELDS) and fields[0] == _REPLY_PREFIX:
+        try:
+            values = [ float(f[:-len(unit)]) if f.endswith(unit) else None
+                       for f, unit in zip(fields[1:], _REPLY_UNITS) ]
+        except ValueError:
+            values = None
+
+        if values is not None and None in values:
+            values = None
+
+    return values
+
+def select_replies(replies, device=None, start_time=None, end_time=None):
+    """Filter the replies of an archive by device and time of the request.
+
+    Args:
+        replies: Replies as returned by read_raw_archive.
+        device: Path of the device of the replies kept, all if None.
+        start_time: Replies requested before this time are skipped.
+        end_time: Replies requested at or after this time are skipped.
+
+    Returns:
+        A generator of the replies selected.
+    """
+
+    for request_time, reply_time, reply_device, reply in replies:
+        if (device is None or reply_device == device) and \
+            (start_time is None or request_time >= start_time) and \
+            (end_time is None or request_time < end_time):
+
+            yield request_time, reply_time, reply_device, reply
+
+def regenerate_continuous(file_name, output_filename, offset=0.0,
+                          device=None, start_time=None, end_time=None):
+    """Write a continuous output file from the replies of an archive, as it
+    would have been written while measuring.
+
+    Every reply selected is written, so the file is only the same as the
+    one written while measuring for the archive of the continuous measures
+    of a single SQM. The archive of a rig, of the positions of an all-sky
+    scan or of the requests that check if it is too bright to measure
+    mixes other replies, those of a device and of the time of the
+    continuous measures must be selected.
+
+    Args:
+        file_name: Name of the archive.
+        output_filename: Name of the output file.
+        offset: Magnitude added to each measure to recalibrate it.
+        device: Path of the device whose replies are written, all if None.
+        start_time: Replies requested before this time, in seconds since
+            the epoch, are skipped.
+        end_time: Replies requested at or after this time, in seconds
+            since the epoch, are skipped.
+
+    Returns:
+        The number of measures written and of replies not valid, skipped as
+        they could be followed by a valid retry.
+    """
+
+    from outfile import OutputFile
+    from sqmcontrol import process_continuous_measure
+    from console import PlainConsole
+
+    class _Quiet(PlainConsole):
+
+        def show_measure(self, text, measure=None, measure_time=None):
+            pass
+
+    console = _Quiet()
+
+    output_file = OutputFile(output_filename)
+
+    output_file.write_com("Regenerated from %s, offset %.3f" %
+                          (file_name, offset))
+
+    if device is not None:
+        output_file.write_com("Device %s" % device)
+
+    measures = 0
+    invalid = 0
+
+    for request_time, reply_time, reply_device, reply in \
+        select_replies(read_raw_archive(file_name), device, start_time,
+                       end_time):
+
+        values = parse_reply(reply)
+
+        if values is None:
+            invalid += 1
+        else:
+            process_continuous_measure("%.2f" % (values[0] + offset),
+                                       output_file, request_time, console)
+            measures += 1
+
+    return measures, invalid
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Decode an archive of the "
+                                     "raw replies of the SQM.")
+
+    parser.add_argument("archive", help="File of the archive.")
+
+    parser.add_argument("-c", dest="continuous", metavar="name",
+                        help="Write a continuous output file instead of "
+                        "the fields of the replies.")
+
+    parser.add_argument("-o", dest="offset", type=float, default=0.0,
+                        help="Magnitude added to recalibrate the measures.")
+
+    parser.add_argument("-d", dest="device", help="Only the replies of this "
+                        "device.")
+
+    parser.add_argument("-s", dest="start_time", type=float,
+                        help="Only the replies requested from this time, in "
+                        "seconds since the epoch.")
+
+    parser.add_argument("-e", dest="end_time", type=float,
+                        help="Only the replies requested before this time, "
+                        "in seconds since the epoch.")
+
+    args = parser.parse_args()
+
+    try:
+        if args.continuous is not None:
+            measures, invalid = regenerate_continuous(args.archive,
+                                                      args.continuous,
+                                                      args.offset,
+                                                      args.device,
+                                                      args.start_time,
+                                                      args.end_time)
+
+            print "Measures: %d, replies not valid: %d" % (measures, invalid)
+        else:
+            print "# request_time reply_time device %s" % \
+                " ".join(REPLY_FIELDS)
+
+            for request_time, reply_time, device, reply in \
+                select_replies(read_raw_archive(args.archive), args.device,
+                               args.start_time, args.end_time):
+
+                values = parse_reply(reply)
+
+                if values is None:
+                    fields = "invalid %r" % reply
+                else:
+                    values[0] += args.offset
+
+                    fields = " ".join([ "%g" % v for v in values ])
+
+                print "%.3f %.3f %s %s" % (request_time, reply_time, device,
+                                           fields)
+
+    except OutputFileException as ofe:
+        print ofe
+        sys.exit(1)
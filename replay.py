@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Replays the measures recorded in output files.
+
+The measures read are processed as if they had been taken from the SQM,
+keeping the times recorded, so the outputs can be regenerated from past
+sessions at the speed indicated.
+"""
+
+import time
+import logging
+
+from outfile import OutputFile
+from outreader import read_continuous_file, read_all_sky_file, \
+    is_continuous_file
+from sqmcontrol import process_continuous_measure, wait_until, \
+    DEFAULT_CONSOLE, DEFAULT_CONT_OUT_FILE_NAME, DEFAULT_SKY_OUT_FILE_NAME
+
+# Prefix of the names of the output files of the replays.
+REPLAY_PREFIX = "replay_"
+
+# Speed to replay the measures as fast as possible.
+MAX_SPEED = 0
+
+def replay_continuous(filename, output_filename, speed=MAX_SPEED, sinks=None,
+                      console=DEFAULT_CONSOLE):
+    """Replay the measures of a continuous output file.
+
+    Args:
+        filename: Name of the file to replay.
+        output_filename: Name of the output file.
+        speed: Times the real speed to replay the measures, as fast as
+            possible if 0.
+        sinks: Optional objects that also receive each measure through their
+            add_reading(timestamp, measure, temperature) method.
+        console: Console to show the measures.
+
+    Returns:
+        The number of measures replayed.
+    """
+
+    logging.debug("Replaying continuous measures from: %s" % filename)
+
+    if sinks is None:
+        sinks = []
+
+    output_file = OutputFile(output_filename)
+
+    output_file.write_com("Replay of %s" % filename)
+
+    count = 0
+    first_time = None
+    start_time = time.time()
+
+    for measure_time, mjd, measure in read_continuous_file(filename):
+
+        if first_time is None:
+            first_time = measure_time
+
+        # Keep the intervals recorded scaled by the speed.
+        if speed > 0:
+            wait_until(start_time + (measure_time - first_time) / speed)
+
+        process_continuous_measure(measure, output_file, measure_time, console)
+
+        for sink in sinks:
+            sink.add_reading(measure_time, measure, None)
+
+        count += 1
+
+    logging.debug("Replayed %d measures in %.3f s" %
+                  (count, time.time() - start_time))
+
+    return count
+
+def replay_all_sky(filename, output_filename, info=None):
+    """Replay the measures of an all sky file saved as a list, saving them
+    again in all the formats.
+
+    Args:
+        filename: Name of the file to replay.
+        output_filename: Name of the output files.
+        info: Information to add to the files, that of the file replayed if
+            not provided.
+    """
+
+    from allsky import AllSkyMeasures, AZIMUTH_VALUES, VERTICAL_VALUES
+
+    logging.debug("Replaying all sky measures from: %s" % filename)
+
+    file_info, azimuths, zenith = read_all_sky_file(filename,
+                                                    len(VERTICAL_VALUES))
+
+    all_sky_values = AllSkyMeasures(len(AZIMUTH_VALUES), len(VERTICAL_VALUES))
+
+    for i, vertical_values in enumerate(azimuths):
+        for j, value in enumerate(vertical_values):
+            all_sky_values.set(i, j, value)
+
+    all_sky_values.zenith = zenith
+
+    if info is None:
+        info = file_info
+
+    all_sky_values.save_as_list(output_filename, info)
+    all_sky_values.save_as_list_by_vertical(output_filename, info)
+
+def replay(filename, speed=MAX_SPEED, sinks=None, console=DEFAULT_CONSOLE):
+    """Replay an output file, continuous or all sky.
+
+    Args:
+        filename: Name of the file to replay.
+        speed: Times the real speed to replay continuous measures, as fast as
+            possible if 0.
+        sinks: Optional objects that also receive each continuous measure.
+        console: Console to show the measures.
+    """
+
+    if is_continuous_file(filename):
+        replay_continuous(filename, REPLAY_PREFIX + DEFAULT_CONT_OUT_FILE_NAME,
+                          speed, sinks, console)
+    else:
+        replay_all_sky(filename, REPLAY_PREFIX + DEFAULT_SKY_OUT_FILE_NAME)
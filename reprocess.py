@@ -0,0 +1,547 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Reprocess the output files of a directory tree night by night.
+
+The files found are grouped by the night of their measures and each night is
+processed in a pool of processes, summarizing the continuous measures and
+converting the all sky measures to NELM. The summaries are merged sorted by
+night, and a manifest with the inputs of each night allows to skip the
+nights not changed since the last run.
+"""
+
+import os
+import json
+import time
+import logging
+import argparse
+import multiprocessing
+
+import numpy as np
+
+from outfile import OutputFile, OutputFileException
+from outreader import read_continuous_file, parse_continuous_line, \
+    read_all_sky_file, is_continuous_file, ALL_SKY_VALUES_SEP
+from mpass2nelm import mpass_to_nelm
+from rollup import night_name, night_rollups, rollup_file_name, \
+    write_rollups
+
+# Name of the files written in the output directory.
+MANIFEST_FILE_NAME = "reprocess_manifest.json"
+SUMMARY_FILE_NAME = "nights_summary.out"
+
+# Suffix of the all sky files converted to NELM.
+NELM_SUFFIX = "_nelm"
+
+# Directory of the rollups of the continuous measures in the output directory.
+ROLLUP_DIR_NAME = "rollups"
+
+# Changing it invalidates the results kept in the manifests.
+MANIFEST_VERSION = 2
+
+# Format of the date and time at the start of the output file names.
+FILE_TIME_FORMAT = "%Y%m%d%H%M%S"
+
+# Kinds of output files.
+CONTINUOUS_KIND = "continuous"
+ALL_SKY_KIND = "all_sky"
+
+# Length of the date and hour at the start of the continuous lines.
+_HOUR_PREFIX_LEN = len("dd-mm-YYYY HH")
+
+# Number of vertical values of the all sky files.
+ALL_SKY_VERT_DIM = 4
+
+# Columns of the summary of each night.
+SUMMARY_COLUMNS = ( "night", "readings", "first", "last", "mean", "median",
+                    "min", "max", "nelm_median", "all_sky", "zenith_nelm" )
+
+def night_of(timestamp):
+    """Returns the name of the night of a time, the same of its rollups.
+
+    Args:
+        timestamp: Time in seconds since the epoch.
+    """
+
+    return night_name(timestamp)
+
+def file_time(filename):
+    """Returns the time the output file was created, taken from its name or
+    from its modification time if the name hasn't it.
+
+    Args:
+        filename: Name of the file.
+    """
+
+    prefix = os.path.basename(filename).split("_", 1)[0]
+
+    try:
+        timestamp = time.mktime(time.strptime(prefix, FILE_TIME_FORMAT))
+    except ValueError:
+        timestamp = os.path.getmtime(filename)
+
+    return timestamp
+
+def find_output_files(input_dir, excluded_dirs=()):
+    """Returns the output files of measures in a directory tree, the files
+    by vertical value, the NELM conversions and the summaries of the nights
+    are not included.
+
+    Args:
+        input_dir: Directory to search.
+        excluded_dirs: Directories not searched, as the results of the
+            reprocessing when they are inside the tree.
+
+    Returns:
+        A sorted list with the paths of the files.
+    """
+
+    ext = "." + OutputFile.FILE_EXT
+
+    excluded = set([ os.path.realpath(d) for d in excluded_dirs ])
+
+    files = []
+
+    for dir_path, dir_names, file_names in os.walk(input_dir):
+        dir_names[:] = sorted([ d for d in dir_names
+                                if os.path.realpath(os.path.join(dir_path, d))
+                                not in excluded ])
+
+        for name in file_names:
+            base = name[:-len(ext)]
+
+            if name.endswith(ext) and not base.endswith("_NN") and \
+                not base.endswith(NELM_SUFFIX) and name != SUMMARY_FILE_NAME:
+                files.append(os.path.join(dir_path, name))
+
+    return sorted(files)
+
+def scan_continuous_file(filename):
+    """Returns the part of a continuous file with the measures of each night.
+
+    Args:
+        filename: Name of the file.
+
+    Returns:
+        A list with the night, start and end offsets of each part.
+    """
+
+    segments = []
+
+    night = None
+    hour_prefix = None
+    position = 0
+
+    try:
+        with open(filename, "r") as fr:
+            for line in fr:
+                # The lines of the same hour are of the same night, only the
+                # first one is parsed.
+                if line[:_HOUR_PREFIX_LEN] != hour_prefix:
+                    reading = parse_continuous_line(line)
+
+                    if reading is not None:
+                        hour_prefix = line[:_HOUR_PREFIX_LEN]
+
+                        if night_of(reading[0]) != night:
+                            night = night_of(reading[0])
+
+                            if len(segments) > 0:
+                                segments[-1][2] = position
+
+                            segments.append([ night, position, None ])
+
+                position += len(line)
+
+    except IOError as ioe:
+        raise OutputFileException("Reading file %s: %s" % (filename, ioe))
+
+    if len(segments) > 0:
+        segments[-1][2] = position
+
+    return segments
+
+def describe_file(filename, previous=None):
+    """Returns the kind of an output file and the parts of each night, those
+    of the last run if the file hasn't changed.
+
+    Args:
+        filename: Name of the file.
+        previous: Description of the file in the last run.
+
+    Returns:
+        A dictionary with the size, modification time, kind and the night,
+        start and end offsets of each part of the file.
+    """
+
+    size = os.path.getsize(filename)
+    mtime = os.path.getmtime(filename)
+
+    if previous is not None and previous["size"] == size and \
+        previous["mtime"] == mtime:
+        description = previous
+    else:
+        if is_continuous_file(filename):
+            kind = CONTINUOUS_KIND
+            segments = scan_continuous_file(filename)
+        else:
+            kind = ALL_SKY_KIND
+            segments = [ [ night_of(file_time(filename)), 0, size ] ]
+
+        description = { "size" : size, "mtime" : mtime, "kind" : kind,
+                        "segments" : segments }
+
+    return description
+
+def plan_nights(files):
+    """Group the parts of the files by night.
+
+    Args:
+        files: Dictionary with the description of each file.
+
+    Returns:
+        A dictionary with a tuple of the parts of the continuous files, as
+        name, start and end offsets, and the names of the all sky files of
+        each night.
+    """
+
+    nights = {}
+
+    for filename in sorted(files):
+        description = files[filename]
+
+        for night, start, end in description["segments"]:
+            continuous, all_sky = nights.setdefault(night, ([], []))
+
+            if description["kind"] == CONTINUOUS_KIND:
+                continuous.append([ filename, start, end ])
+            else:
+                all_sky.append(filename)
+
+    return nights
+
+def signature(continuous, all_sky, files):
+    """Returns what identifies the inputs of a night, to know if they have
+    changed. The continuous files are written only appending lines, so their
+    parts are identified by their offsets.
+
+    Args:
+        continuous: Parts of the continuous files.
+        all_sky: Names of the all sky files.
+        files: Dictionary with the description of each file.
+    """
+
+    return continuous + [ [ f, files[f]["size"], files[f]["mtime"] ]
+                          for f in all_sky ]
+
+def nelm_file_name(output_dir, filename):
+    """Returns the name of the NELM conversion of an all sky file.
+
+    Args:
+        output_dir: Directory of the outputs.
+        filename: Name of the all sky file.
+    """
+
+    base = os.path.splitext(os.path.basename(filename))[0]
+
+    return os.path.join(output_dir, "%s%s.%s" % (base, NELM_SUFFIX,
+                                                 OutputFile.FILE_EXT))
+
+def _read_continuous(segments):
+    """Returns the times and the values of the continuous measures of a
+    night, in order of time.
+    """
+
+    times = []
+    measures = []
+
+    for filename, start, end in segments:
+        for timestamp, mjd, measure in read_continuous_file(filename, start,
+                                                            end):
+            times.append(timestamp)
+            measures.append(float(measure))
+
+    times = np.array(times)
+    measures = np.array(measures)
+
+    # The files of a night could overlap.
+    order = np.argsort(times, kind="mergesort")
+
+    return times[order], measures[order]
+
+def _summarize_continuous(times, measures):
+    """Returns the summary of the continuous measures of a night."""
+
+    valid = np.isfinite(measures)
+
+    times = times[valid]
+    measures = measures[valid]
+
+    summary = { "readings" : len(measures) }
+
+    if len(measures) > 0:
+        median = float(np.median(measures))
+
+        summary.update({ "first" : float(times[0]),
+                         "last" : float(times[-1]),
+                         "mean" : float(measures.mean()), "median" : median,
+                         "min" : float(measures.min()),
+                         "max" : float(measures.max()),
+                         "nelm_median" : mpass_to_nelm(median) })
+
+    return summary
+
+def _convert_all_sky(filename, output_dir):
+    """Convert an all sky file to NELM.
+
+    Returns:
+        The NELM value of the zenith.
+    """
+
+    info, azimuths, zenith = read_all_sky_file(filename, ALL_SKY_VERT_DIM)
+
+    def to_nelm(value):
+        return "%.4f" % mpass_to_nelm(float(value))
+
+    with open(nelm_file_name(output_dir, filename), "w") as fw:
+        fw.write("%s %s\n" % (OutputFile.COMMENT_CHAR, info))
+
+        # The same layout of the all sky files, the zenith after each azimuth.
+        fw.write(ALL_SKY_VALUES_SEP.join(
+            [ ALL_SKY_VALUES_SEP.join([ to_nelm(v) for v in values ] +
+                                      [ to_nelm(zenith) ])
+              for values in azimuths ]))
+
+    return mpass_to_nelm(float(zenith))
+
+def process_night(task):
+    """Process the files of a night, to be run in the pool.
+
+    Args:
+        task: Tuple with the night, the parts of the continuous files and
+            the all sky files of the night and the output directory.
+
+    Returns:
+        A tuple with the night and its summary.
+    """
+
+    night, segments, all_sky_files, output_dir = task
+
+    summary = { "readings" : 0 }
+
+    try:
+        times, measures = _read_continuous(segments)
+
+        summary = _summarize_continuous(times, measures)
+
+        if len(segments) > 0:
+            write_rollups(rollup_file_name(os.path.join(output_dir,
+                                                        ROLLUP_DIR_NAME),
+                                           night),
+                          night_rollups(times, measures))
+
+        summary["all_sky"] = len(all_sky_files)
+
+        zeniths = [ _convert_all_sky(f, output_dir) for f in all_sky_files ]
+
+        if len(zeniths) > 0:
+            summary["zenith_nelm"] = float(np.nanmean(zeniths))
+
+    except (OutputFileException, IOError, ValueError) as e:
+        logging.error("Processing night %s: %s" % (night, e))
+        summary["error"] = str(e)
+
+    return night, summary
+
+def read_manifest(output_dir):
+    """Returns the manifest of the last run, empty if there isn't any."""
+
+    manifest = {}
+
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILE_NAME), "r") as fr:
+            manifest = json.load(fr)
+
+    except (IOError, ValueError):
+        pass
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        manifest = { "files" : {}, "nights" : {} }
+
+    return manifest
+
+def write_manifest(output_dir, files, nights):
+    """Write the manifest of the files and nights processed.
+
+    Args:
+        output_dir: Directory of the outputs.
+        files: Dictionary with the description of each file.
+        nights: Dictionary with the signature and summary of each night.
+    """
+
+    file_name = os.path.join(output_dir, MANIFEST_FILE_NAME)
+
+    # Replaced at once so an interrupted run doesn't leave it corrupt.
+    with open(file_name + ".tmp", "w") as fw:
+        json.dump({ "version" : MANIFEST_VERSION, "files" : files,
+                    "nights" : nights }, fw, indent=1, sort_keys=True)
+
+    os.rename(file_name + ".tmp", file_name)
+
+def _format_value(value):
+
+    if value is None:
+        text = "-"
+    elif isinstance(value, float):
+        text = "%.4f" % value
+    else:
+        text = str(value)
+
+    return text
+
+def write_summary(output_dir, summaries):
+    """Write the summaries of the nights sorted by night.
+
+    Args:
+        output_dir: Directory of the outputs.
+        summaries: Dictionary with the summary of each night.
+    """
+
+    with open(os.path.join(output_dir, SUMMARY_FILE_NAME), "w") as fw:
+        fw.write("%s %s\n" % (OutputFile.COMMENT_CHAR,
+                              "\t".join(SUMMARY_COLUMNS)))
+
+        for night in sorted(summaries):
+            summary = dict(summaries[night], night=night)
+
+            fw.write("\t".join([ _format_value(summary.get(c))
+                                 for c in SUMMARY_COLUMNS ]) + "\n")
+
+def reprocess(input_dir, output_dir, processes=None, force=False):
+    """Reprocess the output files of a directory tree.
+
+    Args:
+        input_dir: Directory with the output files.
+        output_dir: Directory to write the results.
+        processes: Number of processes, the number of CPUs if None.
+        force: True to process also the nights not changed.
+
+    Returns:
+        A tuple with the number of nights processed and skipped.
+    """
+
+    rollup_dir = os.path.join(output_dir, ROLLUP_DIR_NAME)
+
+    if not os.path.isdir(rollup_dir):
+        os.makedirs(rollup_dir)
+
+    previous = read_manifest(output_dir)
+
+    if force:
+        previous = { "files" : {}, "nights" : {} }
+
+    files = {}
+
+    for filename in find_output_files(input_dir, (output_dir, rollup_dir)):
+        try:
+            files[filename] = describe_file(filename,
+                                            previous["files"].get(filename))
+        except (OutputFileException, OSError) as e:
+            logging.warning("Ignoring %s: %s" % (filename, e))
+
+    nights = plan_nights(files)
+
+    manifest = {}
+    tasks = []
+
+    for night in sorted(nights):
+        continuous, all_sky = nights[night]
+
+        night_signature = signature(continuous, all_sky, files)
+
+        entry = previous["nights"].get(night)
+
+        outputs_exist = all([ os.path.exists(nelm_file_name(output_dir, f))
+                              for f in all_sky ]) and \
+            (len(continuous) == 0 or
+             os.path.exists(rollup_file_name(rollup_dir, night)))
+
+        if entry is not None and entry["signature"] == night_signature and \
+            outputs_exist:
+            manifest[night] = entry
+        else:
+            manifest[night] = { "signature" : night_signature }
+
+            tasks.append((night, continuous, all_sky, output_dir))
+
+    logging.info("Nights to process: %d, not changed: %d" %
+                 (len(tasks), len(nights) - len(tasks)))
+
+    if len(tasks) > 0:
+        pool = multiprocessing.Pool(processes)
+
+        try:
+            # The results arrive in any order, they are sorted when written.
+            for night, summary in pool.imap_unordered(process_night, tasks):
+                manifest[night]["summary"] = summary
+
+                print "Processed night %s: %d readings, %d all sky." % \
+                    (night, summary["readings"], summary.get("all_sky", 0))
+
+            pool.close()
+
+        except KeyboardInterrupt:
+            pool.terminate()
+            raise
+
+        finally:
+            pool.join()
+
+    write_summary(output_dir, dict([ (n, manifest[n]["summary"])
+                                     for n in manifest ]))
+
+    write_manifest(output_dir, files, manifest)
+
+    return len(tasks), len(nights) - len(tasks)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Reprocess the output " +
+                                     "files of a directory tree by night.")
+
+    parser.add_argument("input_dir", help="Directory with the output files.")
+
+    parser.add_argument("output_dir", help="Directory for the results.")
+
+    parser.add_argument("-j", dest="processes", type=int, default=None,
+                        help="Number of processes, all the CPUs by default.")
+
+    parser.add_argument("-f", dest="force", action="store_true",
+                        help="Process also the nights not changed.")
+
+    args = parser.parse_args()
+
+    start_time = time.time()
+
+    processed, skipped = reprocess(args.input_dir, args.output_dir,
+                                   args.processes, args.force)
+
+    print "Nights processed: %d, not changed: %d, in %.1f s." % \
+        (processed, skipped, time.time() - start_time)
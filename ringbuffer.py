@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Keeps the recent readings in memory in a ring buffer of fixed capacity."""
+
+import threading
+
+import numpy as np
+
+# Readings kept by default, a day of measures taken every second.
+DEFAULT_CAPACITY = 86400
+
+class ReadingsRingBuffer(object):
+    """Ring buffer with the time, magnitude and temperature of the last
+    readings.
+
+    Each reading is stored twice, at its position and at its position plus
+    the capacity, so the last readings are always contiguous in memory and
+    are returned as views, without copying them. The views show the values
+    stored in the buffer, they must be copied to keep them while appending.
+    The readers of other threads than the one appending ask for copies,
+    taken with the appends locked.
+    """
+
+    _TIME_ROW = 0
+    _MAGNITUDE_ROW = 1
+    _TEMPERATURE_ROW = 2
+
+    def __init__(self, capacity):
+        """Initializes the buffer.
+
+        Args:
+            capacity: Maximum number of readings kept.
+        """
+
+        self._capacity = capacity
+        self._data = np.full((3, 2 * capacity), np.nan)
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def append(self, timestamp, magnitude, temperature=np.nan):
+        """Add a reading, replacing the oldest one if the buffer is full.
+
+        Args:
+            timestamp: Time of the reading in seconds since the epoch.
+            magnitude: Value measured.
+            temperature: Temperature of the SQM.
+        """
+
+        with self._lock:
+            i = self._next
+
+            self._data[:, i] = (timestamp, magnitude, temperature)
+            self._data[:, i + self._capacity] = \
+                (timestamp, magnitude, temperature)
+
+            self._next = (i + 1) % self._capacity
+            self._count = min(self._count + 1, self._capacity)
+
+    def add_reading(self, timestamp, measure, temperature=None):
+        """Add a reading received as a sink of the continuous measures.
+
+        Args:
+            timestamp: Time of the reading in seconds since the epoch.
+            measure: Value measured, as a string.
+            temperature: Temperature of the SQM, if known.
+        """
+
+        self.append(timestamp, float(measure),
+                    np.nan if temperature is None else float(temperature))
+
+    def _copied(self, query, *args):
+        """Returns copies of the arrays of a query taken with the appends
+        locked.
+        """
+
+        with self._lock:
+            return tuple([ a.copy() for a in query(*args) ])
+
+    def last(self, count, copy=False):
+        """Returns the last readings, the oldest first.
+
+        Args:
+            count: Number of readings.
+            copy: Return copies instead of views, to read from other thread
+                than the one appending.
+
+        Returns:
+            A tuple with the views of the times, magnitudes and temperatures.
+        """
+
+        if copy:
+            return self._copied(self.last, count)
+
+        count = max(0, min(count, self._count))
+
+        end = self._next + self._capacity
+        start = end - count
+
+        return (self._data[ReadingsRingBuffer._TIME_ROW, start:end],
+                self._data[ReadingsRingBuffer._MAGNITUDE_ROW, start:end],
+                self._data[ReadingsRingBuffer._TEMPERATURE_ROW, start:end])
+
+    def since(self, seconds, now=None, copy=False):
+        """Returns the readings of the last seconds indicated.
+
+        Args:
+            seconds: Number of seconds.
+            now: Time to count the seconds from, the last reading if not
+                provided.
+            copy: Return copies instead of views, to read from other thread
+                than the one appending.
+
+        Returns:
+            A tuple with the views of the times, magnitudes and temperatures.
+        """
+
+        if copy:
+            return self._copied(self.since, seconds, now)
+
+        times, magnitudes, temperatures = self.last(self._count)
+
+        if len(times) > 0:
+            if now is None:
+                now = times[-1]
+
+            # The readings are appended in time order.
+            first = np.searchsorted(times, now - seconds)
+
+            times = times[first:]
+            magnitudes = magnitudes[first:]
+            temperatures = temperatures[first:]
+
+        return times, magnitudes, temperatures
+
+    def latest(self):
+        """Returns the last reading as a tuple of time, magnitude and
+        temperature, or None if the buffer is empty.
+        """
+
+        reading = None
+
+        with self._lock:
+            if self._count > 0:
+                i = self._next - 1 + self._capacity
+
+                reading = tuple(self._data[:, i])
+
+        return reading
+
+    def stats(self, seconds):
+        """Returns statistics of the magnitudes of the last seconds.
+
+        Args:
+            seconds: Number of seconds.
+
+        Returns:
+            A dictionary with the count, mean, standard deviation, minimum
+            and maximum of the magnitudes.
+        """
+
+        magnitudes = self.since(seconds, copy=True)[1]
+
+        stats = { "count" : len(magnitudes) }
+
+        if len(magnitudes) > 0:
+            stats["mean"] = float(magnitudes.mean())
+            stats["std"] = float(magnitudes.std())
+            stats["min"] = float(magnitudes.min())
+            stats["max"] = float(magnitudes.max())
+
+        return stats
@@ -0,0 +1,624 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Rollups of the continuous measures by minute, hour and night.
+
+Each rollup is a record of fixed size with the count, mean, standard
+deviation, minimum, maximum and some quantiles of the measures of an
+interval. The records of a night are kept in a file of the rollup directory
+named by the night, so only the nights changed are written again, and a
+query reads only the files of the nights in its range at the coarsest level
+enough for the resolution requested.
+
+The rollups are calculated while measuring, keeping a histogram of the
+values at the resolution of the SQM for the quantiles, or from the measures
+of a night at once when reprocessing.
+"""
+
+import os
+import sys
+import glob
+import math
+import time
+import logging
+import argparse
+
+import numpy as np
+
+from nightsched import night_start
+
+MINUTE_LEVEL = "minute"
+HOUR_LEVEL = "hour"
+NIGHT_LEVEL = "night"
+
+# Levels from the finest, with their duration in seconds.
+LEVELS = ( MINUTE_LEVEL, HOUR_LEVEL, NIGHT_LEVEL )
+LEVEL_DURATIONS = { MINUTE_LEVEL : 60, HOUR_LEVEL : 3600,
+                    NIGHT_LEVEL : 24 * 3600 }
+
+QUANTILES = ( 0.1, 0.25, 0.5, 0.75, 0.9 )
+
+ROLLUP_DTYPE = np.dtype([ ("start", "<f8"), ("end", "<f8"),
+                          ("count", "<u4"), ("mean", "<f4"), ("std", "<f4"),
+                          ("min", "<f4"), ("max", "<f4"),
+                          ("quantiles", "<f4", (len(QUANTILES),)) ])
+
+# Range and resolution of the histograms of the quantiles, the values of the
+# SQM have two decimals.
+HISTOGRAM_MIN = 0.0
+HISTOGRAM_MAX = 30.0
+HISTOGRAM_STEP = 0.01
+
+_HISTOGRAM_BINS = int(round((HISTOGRAM_MAX - HISTOGRAM_MIN) / HISTOGRAM_STEP))
+
+# The rollups of a night are written again after these seconds.
+FLUSH_INTERVAL = 3600
+
+NIGHT_FORMAT = "%Y%m%d"
+
+ROLLUP_EXT = "rollup.npz"
+
+DEFAULT_ROLLUP_DIR = "rollups"
+
+def night_name(timestamp):
+    """Returns the name of the night of a time, the date of its evening."""
+
+    return time.strftime(NIGHT_FORMAT, time.localtime(night_start(timestamp)))
+
+def rollup_file_name(directory, night):
+    """Returns the name of the file of the rollups of a night."""
+
+    return os.path.join(directory, "%s.%s" % (night, ROLLUP_EXT))
+
+def _histogram_quantiles(histogram, count):
+    """Returns the quantiles of the values counted in a histogram, the
+    values of the positions nearest to each quantile in the values sorted.
+
+    Args:
+        histogram: Dictionary with the count of each bin not empty.
+        count: Number of values.
+    """
+
+    bins = np.array(sorted(histogram))
+
+    cumulative = np.cumsum([ histogram[b] for b in bins ])
+
+    ranks = np.floor(np.array(QUANTILES) * (count - 1))
+
+    return HISTOGRAM_MIN + HISTOGRAM_STEP * \
+        bins[np.searchsorted(cumulative, ranks, "right")]
+
+def interval_keys(times, level):
+    """Returns the start of the interval of each time at a level.
+
+    Args:
+        times: Array of times in seconds since the epoch, in order.
+        level: Level of the intervals.
+    """
+
+    if level == NIGHT_LEVEL:
+        # The nights start at noon, the start of an hour, so the night of
+        # each hour is enough.
+        hours = np.floor(times / LEVEL_DURATIONS[HOUR_LEVEL]) * \
+            LEVEL_DURATIONS[HOUR_LEVEL]
+
+        unique_hours, positions = np.unique(hours, return_inverse=True)
+
+        keys = np.array([ night_start(h) for h in unique_hours ])[positions]
+    else:
+        keys = np.floor(times / LEVEL_DURATIONS[level]) * \
+            LEVEL_DURATIONS[level]
+
+    return keys
+
+def build_rollups(times, values, level):
+    """Returns the rollups of some measures at a level, all calculated at
+    once.
+
+    Args:
+        times: Array of times in seconds since the epoch, in order.
+        values: Array of values.
+        level: Level of the rollups.
+
+    Returns:
+        Array of records of ROLLUP_DTYPE.
+    """
+
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+
+    finite = np.isfinite(values)
+
+    times = times[finite]
+    values = values[finite]
+
+    records = np.zeros(0, dtype=ROLLUP_DTYPE)
+
+    if len(times) > 0:
+        keys = interval_keys(times, level)
+
+        starts = np.concatenate(([ 0 ], np.flatnonzero(np.diff(keys)) + 1))
+        ends = np.append(starts[1:], len(times))
+
+        counts = ends - starts
+
+        # Shifted to keep the precision of the sums of the squares.
+        shifted = values - values[0]
+
+        sums = np.add.reduceat(shifted, starts)
+        means = sums / counts
+
+        variances = np.add.reduceat(shifted * shifted, starts) / counts - \
+            means * means
+
+        records = np.zeros(len(starts), dtype=ROLLUP_DTYPE)
+
+        records["start"] = keys[starts]
+        records["end"] = times[ends - 1]
+        records["count"] = counts
+        records["mean"] = means + values[0]
+        records["std"] = np.sqrt(np.maximum(variances, 0))
+        records["min"] = np.minimum.reduceat(values, starts)
+        records["max"] = np.maximum.reduceat(values, starts)
+
+        # Sorted by interval and value, the quantiles are at the same
+        # positions the histograms of the measures would give.
+        order = np.lexsort((values, np.repeat(np.arange(len(starts)),
+                                               counts)))
+
+        sorted_values = values[order]
+
+        ranks = np.floor(np.outer(counts - 1, QUANTILES)).astype(np.int64)
+
+        records["quantiles"] = sorted_values[starts[:, np.newaxis] + ranks]
+
+    return records
+
+def merge_rollups(records, start=None):
+    """Returns a record joining several records.
+
+    The count, mean, standard deviation, minimum and maximum are exact. The
+    quantiles are the means of those of the records weighted by their
+    counts, an approximation.
+
+    Args:
+        records: Array of records of ROLLUP_DTYPE.
+        start: Start of the record returned, that of the first record if
+            None.
+    """
+
+    merged = np.zeros(1, dtype=ROLLUP_DTYPE)[0]
+
+    counts = records["count"].astype(np.float64)
+
+    total = counts.sum()
+
+    if total > 0:
+        means = records["mean"].astype(np.float64)
+
+        mean = (counts * means).sum() / total
+
+        # The variance of each record and the spread of their means.
+        variance = (counts * (records["std"].astype(np.float64) ** 2 +
+                              (means - mean) ** 2)).sum() / total
+
+        merged["start"] = records["start"][0] if start is None else start
+        merged["end"] = records["end"].max()
+        merged["count"] = total
+        merged["mean"] = mean
+        merged["std"] = np.sqrt(variance)
+        merged["min"] = records["min"][counts > 0].min()
+        merged["max"] = records["max"][counts > 0].max()
+        merged["quantiles"] = (counts[:, np.newaxis] *
+                               records["quantiles"]).sum(axis=0) / total
+
+    return merged
+
+class _RollupAccumulator(object):
+    """Statistics of the measures of the current interval of a level."""
+
+    def __init__(self, level):
+
+        self._level = level
+        self.clear(None)
+
+    @property
+    def key(self):
+        return self._key
+
+    @property
+    def count(self):
+        return self._count
+
+    def clear(self, key):
+        """Start a new interval."""
+
+        self._key = key
+        self._count = 0
+        self._shift = None
+        self._sum = 0.0
+        self._sum_squares = 0.0
+        self._min = float("inf")
+        self._max = float("-inf")
+        self._end = None
+
+        # Only the bins not empty, fewer than the values of an interval.
+        self._histogram = {}
+
+    def add(self, timestamp, value, bin):
+        """Add a value.
+
+        Args:
+            timestamp: Time of the value.
+            value: Value as a float.
+            bin: Bin of the histogram of the value.
+        """
+
+        if self._shift is None:
+            self._shift = value
+
+        shifted = value - self._shift
+
+        self._count += 1
+        self._sum += shifted
+        self._sum_squares += shifted * shifted
+        self._min = min(self._min, value)
+        self._max = max(self._max, value)
+        self._end = timestamp
+
+        self._histogram[bin] = self._histogram.get(bin, 0) + 1
+
+    def record(self):
+        """Returns the record of the interval."""
+
+        record = np.zeros(1, dtype=ROLLUP_DTYPE)[0]
+
+        mean = self._sum / self._count
+
+        record["start"] = self._key
+        record["end"] = self._end
+        record["count"] = self._count
+        record["mean"] = mean + self._shift
+        record["std"] = np.sqrt(max(self._sum_squares / self._count -
+                                    mean * mean, 0))
+        record["min"] = self._min
+        record["max"] = self._max
+        record["quantiles"] = _histogram_quantiles(self._histogram,
+                                                   self._count)
+
+        return record
+
+class RollupSink(object):
+    """Calculates the rollups of the measures as they are taken, to be used
+    as a sink of the measures. The rollups of the current night are written
+    when an hour has passed, when the night ends and when it is closed.
+    """
+
+    def __init__(self, directory=DEFAULT_ROLLUP_DIR):
+        """Initializes the sink.
+
+        Args:
+            directory: Directory of the files of the rollups.
+        """
+
+        self._directory = directory
+        self._accumulators = dict([ (l, _RollupAccumulator(l))
+                                    for l in LEVELS ])
+        self._night = None
+        self._night_end = None
+        self._records = None
+        self._last_flush = None
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def add_reading(self, timestamp, measure, temperature=None):
+        """Add a measure to the rollups.
+
+        Args:
+            timestamp: Time of the measure in seconds since the epoch.
+            measure: Value measured, as a string.
+            temperature: Temperature of the SQM, not used.
+        """
+
+        value = float(measure)
+
+        if not math.isnan(value) and not math.isinf(value):
+            if self._night is None or \
+                not self._accumulators[NIGHT_LEVEL].key <= timestamp < \
+                    self._night_end:
+                self._start_night(night_name(timestamp), timestamp)
+
+            bin = min(max(int(round((value - HISTOGRAM_MIN) /
+                                    HISTOGRAM_STEP)), 0), _HISTOGRAM_BINS - 1)
+
+            for level in LEVELS:
+                accumulator = self._accumulators[level]
+
+                # The key of the night is set when it starts.
+                if level == NIGHT_LEVEL:
+                    key = accumulator.key
+                else:
+                    key = math.floor(timestamp / LEVEL_DURATIONS[level]) * \
+                        LEVEL_DURATIONS[level]
+
+                if key != accumulator.key:
+                    self._close_interval(level)
+                    accumulator.clear(key)
+
+                accumulator.add(timestamp, value, bin)
+
+            if timestamp - self._last_flush >= FLUSH_INTERVAL:
+                self.flush()
+
+    def _start_night(self, night, timestamp):
+        """Write the rollups of the night ended and start those of a new
+        one, keeping the records already written of it, as after a restart.
+        """
+
+        if self._night is not None:
+            self.close()
+
+        self._night = night
+        self._records = dict([ (l, []) for l in LEVELS ])
+        self._last_flush = timestamp
+
+        start = night_start(timestamp)
+
+        # The next noon, even with a day of 25 hours.
+        self._night_end = night_start(start + 30 * 3600)
+
+        saved = read_rollups(rollup_file_name(self._directory, night))
+
+        for level in LEVELS:
+            self._records[level] = list(saved.get(level, []))
+
+        self._accumulators[NIGHT_LEVEL].clear(start)
+
+    def _close_interval(self, level):
+
+        accumulator = self._accumulators[level]
+
+        if accumulator.count > 0:
+            self._records[level].append(accumulator.record())
+
+        accumulator.clear(None)
+
+    def _night_records(self):
+        """Returns the records of the night with those of the intervals not
+        finished, the night joined with the parts of previous runs.
+        """
+
+        records = {}
+
+        for level in LEVELS:
+            level_records = list(self._records[level])
+
+            if self._accumulators[level].count > 0:
+                level_records.append(self._accumulators[level].record())
+
+            records[level] = np.array(level_records, dtype=ROLLUP_DTYPE)
+
+        if len(records[NIGHT_LEVEL]) > 1:
+            records[NIGHT_LEVEL] = np.array([ merge_rollups(
+                records[NIGHT_LEVEL]) ], dtype=ROLLUP_DTYPE)
+
+        return records
+
+    def flush(self):
+        """Write the rollups of the current night."""
+
+        if self._night is not None:
+            try:
+                write_rollups(rollup_file_name(self._directory, self._night),
+                              self._night_records())
+            except (IOError, OSError) as e:
+                logging.error("Writing rollups: %s" % e)
+
+            self._last_flush = self._accumulators[NIGHT_LEVEL]._end
+
+    def close(self):
+        """Write the rollups of the current night and finish them."""
+
+        if self._night is not None:
+            self.flush()
+
+            for level in LEVELS:
+                self._accumulators[level].clear(None)
+
+            self._night = None
+
+def write_rollups(file_name, records):
+    """Write the records of the levels of a night.
+
+    Args:
+        file_name: Name of the file.
+        records: Dictionary with the array of records of each level.
+    """
+
+    # Written at once, a query never reads a file half written.
+    temp_name = "%s.%d.npz" % (file_name, os.getpid())
+
+    np.savez(temp_name, **records)
+
+    os.rename(temp_name, file_name)
+
+def read_rollups(file_name, levels=LEVELS):
+    """Returns the records of some levels of a night, empty if the file
+    doesn't exist or is not valid.
+
+    Args:
+        file_name: Name of the file.
+        levels: Levels to read.
+
+    Returns:
+        Dictionary with the array of records of each level.
+    """
+
+    records = {}
+
+    try:
+        data = np.load(file_name)
+
+        try:
+            for level in levels:
+                if level in data.files and data[level].dtype == ROLLUP_DTYPE:
+                    records[level] = data[level]
+        finally:
+            data.close()
+
+    except (IOError, OSError, ValueError) as e:
+        if os.path.exists(file_name):
+            logging.warning("Invalid rollups %s: %s" % (file_name, e))
+
+    return records
+
+def night_rollups(times, values):
+    """Returns the rollups of all the levels of the measures of a night.
+
+    Args:
+        times: Array of times in seconds since the epoch, in order.
+        values: Array of values.
+    """
+
+    return dict([ (l, build_rollups(times, values, l)) for l in LEVELS ])
+
+class RollupStore(object):
+    """Queries the rollups of a directory."""
+
+    def __init__(self, directory=DEFAULT_ROLLUP_DIR):
+
+        self._directory = directory
+
+    def nights(self):
+        """Returns the names of the nights with rollups, in order."""
+
+        names = [ os.path.basename(f)[:-len(ROLLUP_EXT) - 1] for f in
+                  glob.glob(os.path.join(self._directory,
+                                         "*.%s" % ROLLUP_EXT)) ]
+
+        return sorted(names)
+
+    @staticmethod
+    def level_for(resolution):
+        """Returns the coarsest level with intervals not longer than the
+        resolution.
+
+        Args:
+            resolution: Seconds of the intervals requested.
+        """
+
+        level = LEVELS[0]
+
+        for l in LEVELS:
+            if LEVEL_DURATIONS[l] <= resolution:
+                level = l
+
+        return level
+
+    def query(self, start_time=None, end_time=None, resolution=3600):
+        """Returns the rollups of a range of times at a resolution.
+
+        The records of the coarsest level enough for the resolution are
+        read, only from the files of the nights in the range, and joined if
+        the resolution is longer than the level.
+
+        Args:
+            start_time: First time of the range, from the first night if
+                None.
+            end_time: Time after the range, to the last night if None.
+            resolution: Seconds of the intervals, a night for those of the
+                night level.
+
+        Returns:
+            Array of records of ROLLUP_DTYPE.
+        """
+
+        level = RollupStore.level_for(resolution)
+
+        first = None if start_time is None else night_name(start_time)
+        last = None if end_time is None else night_name(end_time)
+
+        parts = []
+
+        for night in self.nights():
+            if (first is None or night >= first) and \
+                (last is None or night <= last):
+
+                records = read_rollups(rollup_file_name(self._directory,
+                                                        night),
+                                       (level,)).get(level)
+
+                if records is not None:
+                    parts.append(records)
+
+        records = np.concatenate(parts) if len(parts) > 0 else \
+            np.zeros(0, dtype=ROLLUP_DTYPE)
+
+        if start_time is not None:
+            records = records[records["end"] >= start_time]
+
+        if end_time is not None:
+            records = records[records["start"] < end_time]
+
+        if level != NIGHT_LEVEL and resolution > LEVEL_DURATIONS[level] and \
+            len(records) > 0:
+            keys = np.floor(records["start"] / resolution) * resolution
+
+            starts = np.concatenate(([ 0 ],
+                                     np.flatnonzero(np.diff(keys)) + 1))
+            ends = np.append(starts[1:], len(records))
+
+            records = np.array([ merge_rollups(records[s:e], keys[s])
+                                 for s, e in zip(starts, ends) ],
+                               dtype=ROLLUP_DTYPE)
+
+        return records
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Show the rollups of the " +
+                                     "continuous measures.")
+
+    parser.add_argument("directory", nargs="?", default=DEFAULT_ROLLUP_DIR,
+                        help="Directory of the rollups.")
+
+    parser.add_argument("-r", dest="resolution", type=float, default=3600,
+                        help="Seconds of each interval shown.")
+
+    parser.add_argument("-d", dest="days", type=float, default=None,
+                        help="Days until now to show, all by default.")
+
+    args = parser.parse_args()
+
+    start_time = None if args.days is None else \
+        time.time() - args.days * 24 * 3600
+
+    query_start = time.time()
+
+    records = RollupStore(args.directory).query(start_time, None,
+                                                args.resolution)
+
+    for r in records:
+        print "%s %6d %6.2f %5.2f %6.2f %6.2f %s" % \
+            (time.strftime("%d-%m-%Y %H:%M", time.localtime(r["start"])),
+             r["count"], r["mean"], r["std"], r["min"], r["max"],
+             " ".join([ "%6.2f" % q for q in r["quantiles"] ]))
+
+    print "%d rollups in %.3f s." % (len(records), time.time() - query_start)
@@ -0,0 +1,973 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Cooperative runtime where the modes of measure are tasks of one loop.
+
+The tasks are generators that yield what they wait for:
+
+- Sleep or SleepUntil, a time.
+- Readable or Writable, a file descriptor ready or a deadline.
+- A Future, the result of a call run by a Worker in its own thread.
+- A Task, the end of another task.
+- A generator, called as a subroutine, its value is raised with Return.
+- None, to let the other tasks run.
+
+The loop waits with poll for the devices and the wakeups of the workers and
+signals, so a task only runs while it has something to do. The devices are
+read with the non-blocking transports, and the calls that could block, the
+output files, the sinks, the console and the night scheduler, are run by the
+workers. A step of a task that takes longer than SLOW_STEP is logged, as it
+delays the rest.
+
+SIGINT and SIGTERM cancel the tasks raising Cancelled where they wait, so
+their finally clauses are run.
+"""
+
+import os
+import time
+import heapq
+import fcntl
+import errno
+import select
+import signal
+import logging
+import threading
+import collections
+import Queue
+
+from sqmserial import SerialPort
+from sqmtransport import TransportException
+from outfile import OutputFile
+from sound import start_sound, end_sound
+
+# Steps of a task longer than this in seconds are logged.
+SLOW_STEP = 0.1
+
+class RuntimeException(Exception):
+
+    def __init__(self, msg):
+
+        self._msg = msg
+
+    def __str__(self):
+        return self._msg
+
+class Cancelled(Exception):
+    """Raised in the tasks waiting when the runtime is stopped."""
+
+class Return(Exception):
+    """Raised to return a value from a generator called as a subroutine."""
+
+    def __init__(self, value=None):
+
+        self.value = value
+
+class Sleep(object):
+    """Wait some seconds."""
+
+    def __init__(self, seconds):
+
+        self.wake_time = time.time() + max(0, seconds)
+
+class SleepUntil(Sleep):
+    """Wait until a time in seconds since the epoch."""
+
+    def __init__(self, wake_time):
+
+        self.wake_time = wake_time
+
+class Readable(object):
+    """Wait until a file descriptor has data to read, the task receives
+    False if the deadline passes before.
+    """
+
+    EVENTS = select.POLLIN | select.POLLPRI
+
+    def __init__(self, fd, deadline):
+
+        self.fd = fd
+        self.deadline = deadline
+
+class Writable(Readable):
+    """Wait until a file descriptor accepts data to write, the task receives
+    False if the deadline passes before.
+    """
+
+    EVENTS = select.POLLOUT
+
+class Future(object):
+    """Result of a call run by a worker."""
+
+    def __init__(self):
+
+        self._done = False
+        self._value = None
+        self._exception = None
+        self._waiters = []
+
+    @property
+    def done(self):
+        return self._done
+
+    def result(self):
+        """Returns the result of the call or raises its exception."""
+
+        if self._exception is not None:
+            raise self._exception
+
+        return self._value
+
+    def _finish(self, value=None, exception=None):
+
+        self._value = value
+        self._exception = exception
+        self._done = True
+
+class Task(Future):
+    """A generator run by the runtime, its result is the value it returns."""
+
+    def __init__(self, coroutine, name):
+
+        Future.__init__(self)
+
+        self._stack = [ coroutine ]
+        self._name = name
+        self._waiting = None
+
+    @property
+    def name(self):
+        return self._name
+
+class Worker(object):
+    """Runs in its own thread, in order, the calls that could block the
+    loop.
+    """
+
+    def __init__(self, runtime, name):
+        """Starts the thread of the worker.
+
+        Args:
+            runtime: Runtime of the tasks waiting for the calls.
+            name: Name of the worker.
+        """
+
+        self._runtime = runtime
+        self._calls = Queue.Queue()
+
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, function, *args, **kwargs):
+        """Queue a call, the task that yields the future returned waits for
+        its result, the others go on.
+
+        Returns:
+            The future of the call.
+        """
+
+        future = Future()
+
+        self._calls.put((future, function, args, kwargs))
+
+        return future
+
+    def _run(self):
+
+        while True:
+            call = self._calls.get()
+
+            if call is None:
+                break
+
+            future, function, args, kwargs = call
+
+            value = None
+            exception = None
+
+            try:
+                value = function(*args, **kwargs)
+            except Exception as e:
+                logging.error("Call %s failed: %s" % (function.__name__, e))
+
+                exception = e
+
+            # The future is finished by the loop, only it uses the futures.
+            self._runtime._post(future, value, exception)
+
+    def close(self):
+        """Wait for the calls queued and stop the thread."""
+
+        self._calls.put(None)
+
+        self._thread.join()
+
+class Runtime(object):
+    """Loop that runs the tasks while they aren't waiting."""
+
+    _STOP_SIGNALS = ( signal.SIGINT, signal.SIGTERM )
+
+    def __init__(self):
+
+        self._ready = collections.deque()
+        self._timers = []
+        self._timer_count = 0
+        self._readers = {}
+        self._tasks = []
+        self._poller = select.poll()
+
+        # The threads and the signals wake up the loop writing to the pipe.
+        self._wakeup_read, self._wakeup_write = os.pipe()
+
+        for fd in ( self._wakeup_read, self._wakeup_write ):
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        self._poller.register(self._wakeup_read, select.POLLIN)
+
+        self._posted = collections.deque()
+        self._signal = None
+
+    def close(self):
+
+        os.close(self._wakeup_read)
+        os.close(self._wakeup_write)
+
+    def spawn(self, coroutine, name=None):
+        """Start a task.
+
+        Args:
+            coroutine: Generator of the task.
+            name: Name of the task for the log.
+
+        Returns:
+            The task, it can be yielded to wait for its end.
+        """
+
+        task = Task(coroutine, name or coroutine.__name__)
+
+        self._tasks.append(task)
+
+        self._ready.append((task, None, None))
+
+        return task
+
+    def _post(self, future, value, exception):
+        """Pass to the loop the result of a call of another thread."""
+
+        self._posted.append((future, value, exception))
+
+        self._wakeup()
+
+    def _wakeup(self):
+
+        try:
+            os.write(self._wakeup_write, "x")
+        except OSError as oe:
+            # The pipe is full, the loop will wake up anyway.
+            if oe.errno != errno.EAGAIN:
+                raise
+
+    def _on_signal(self, signum, frame):
+
+        self._signal = signum
+
+    def cancel(self):
+        """Raise Cancelled in all the tasks not finished."""
+
+        for task in self._tasks:
+            if not task.done:
+                self._stop_waiting(task)
+
+                self._ready.append((task, None, Cancelled()))
+
+    def _stop_waiting(self, task):
+        """Remove a task from what it is waiting for."""
+
+        waiting = task._waiting
+
+        if isinstance(waiting, Readable):
+            self._remove_reader(waiting.fd)
+        elif isinstance(waiting, Future) and task in waiting._waiters:
+            waiting._waiters.remove(task)
+
+        # The timers are discarded when they expire.
+        task._waiting = None
+
+    def _remove_reader(self, fd):
+
+        del self._readers[fd]
+
+        self._poller.unregister(fd)
+
+    def _finish(self, future, value=None, exception=None):
+        """Finish a future or a task, resuming the tasks waiting for it."""
+
+        future._finish(value, exception)
+
+        for task in future._waiters:
+            task._waiting = None
+
+            self._ready.append((task, value, exception))
+
+        future._waiters = []
+
+    def _wait(self, task, waited):
+        """Make a task wait for what it has yielded.
+
+        Returns:
+            False if the task must go on at once.
+        """
+
+        if isinstance(waited, Sleep):
+            self._timer_count += 1
+
+            heapq.heappush(self._timers, (waited.wake_time,
+                                          self._timer_count, task, waited))
+        elif isinstance(waited, Readable):
+            if waited.fd in self._readers:
+                raise RuntimeException("Two tasks reading from %d." %
+                                       waited.fd)
+
+            self._readers[waited.fd] = (task, waited)
+
+            self._poller.register(waited.fd, waited.EVENTS)
+        elif isinstance(waited, Future):
+            waited._waiters.append(task)
+        elif waited is None:
+            # Let the other tasks run before going on.
+            self._ready.append((task, None, None))
+
+            return True
+        else:
+            raise RuntimeException("Task %s yielded %r." % (task.name, waited))
+
+        task._waiting = waited
+
+        return True
+
+    def _step(self, task, value, exception):
+        """Run a task until it waits for something or ends."""
+
+        start_time = time.time()
+
+        # A task could be cancelled after being resumed, before running.
+        if isinstance(exception, Cancelled):
+            self._stop_waiting(task)
+
+        while len(task._stack) > 0:
+            coroutine = task._stack[-1]
+
+            try:
+                if exception is not None:
+                    waited = coroutine.throw(exception)
+                else:
+                    waited = coroutine.send(value)
+
+                value = None
+                exception = None
+
+            except (StopIteration, Return) as r:
+                task._stack.pop()
+
+                value = getattr(r, "value", None)
+                exception = None
+
+                continue
+
+            except Exception as e:
+                task._stack.pop()
+
+                value = None
+                exception = e
+
+                continue
+
+            # A generator is called as a subroutine.
+            if hasattr(waited, "throw"):
+                task._stack.append(waited)
+            elif isinstance(waited, Future) and waited.done:
+                try:
+                    value = waited.result()
+                except Exception as e:
+                    exception = e
+            elif self._wait(task, waited):
+                break
+
+        elapsed = time.time() - start_time
+
+        if elapsed > SLOW_STEP:
+            logging.warning("Task %s has run %.3f s without waiting." %
+                            (task.name, elapsed))
+
+        if len(task._stack) == 0:
+            if exception is not None and \
+                not isinstance(exception, Cancelled):
+                logging.error("Task %s ended with: %s" %
+                              (task.name, exception))
+
+            self._finish(task, value, exception)
+
+    def _next_deadline(self):
+        """Returns the time of the first timer or reader deadline."""
+
+        deadlines = [ r.deadline for t, r in self._readers.values() ]
+
+        if len(self._timers) > 0:
+            deadlines.append(self._timers[0][0])
+
+        return min(deadlines) if len(deadlines) > 0 else None
+
+    def _poll(self):
+        """Wait for the devices, the timers and the wakeups."""
+
+        deadline = self._next_deadline()
+
+        if deadline is None:
+            timeout = None
+        else:
+            timeout = max(0, deadline - time.time()) * 1000
+
+        try:
+            events = self._poller.poll(timeout)
+        except select.error as se:
+            # Interrupted by a signal.
+            if se.args[0] != errno.EINTR:
+                raise
+
+            events = []
+
+        for fd, event in events:
+            if fd == self._wakeup_read:
+                try:
+                    os.read(self._wakeup_read, 4096)
+                except OSError:
+                    pass
+            elif fd in self._readers:
+                task, readable = self._readers[fd]
+
+                self._remove_reader(fd)
+
+                task._waiting = None
+
+                self._ready.append((task, True, None))
+
+        while len(self._posted) > 0:
+            self._finish(*self._posted.popleft())
+
+        now = time.time()
+
+        for fd, (task, readable) in self._readers.items():
+            if readable.deadline <= now:
+                self._remove_reader(fd)
+
+                task._waiting = None
+
+                self._ready.append((task, False, None))
+
+        while len(self._timers) > 0 and self._timers[0][0] <= now:
+            wake_time, count, task, sleep = heapq.heappop(self._timers)
+
+            # Cancelled tasks have stopped waiting for their timer.
+            if task._waiting is sleep:
+                task._waiting = None
+
+                self._ready.append((task, None, None))
+
+    def run(self, coroutine, name=None):
+        """Run a task and the tasks it starts until it ends.
+
+        Args:
+            coroutine: Generator of the main task.
+            name: Name of the main task.
+
+        Returns:
+            The value of the main task.
+        """
+
+        main_task = self.spawn(coroutine, name)
+
+        handlers = [ (s, signal.signal(s, self._on_signal))
+                     for s in Runtime._STOP_SIGNALS ]
+
+        previous_wakeup = signal.set_wakeup_fd(self._wakeup_write)
+
+        try:
+            while not main_task.done:
+                if self._signal is not None:
+                    logging.info("Signal %d received, cancelling the tasks."
+                                 % self._signal)
+
+                    self._signal = None
+
+                    self.cancel()
+
+                while len(self._ready) > 0:
+                    task, value, exception = self._ready.popleft()
+
+                    if not task.done:
+                        self._step(task, value, exception)
+
+                self._tasks = [ t for t in self._tasks if not t.done ]
+
+                if not main_task.done:
+                    self._poll()
+        finally:
+            signal.set_wakeup_fd(previous_wakeup)
+
+            for s, handler in handlers:
+                signal.signal(s, handler)
+
+        return main_task.result()
+
+def countdown(services, seconds, msg_format, last_second_callback=None):
+    """Wait the seconds indicated showing the time remaining.
+
+    Args:
+        services: Services of the measures.
+        seconds: Time to wait in seconds.
+        msg_format: Message to show with the seconds remaining.
+        last_second_callback: Function to call, by the console worker, a
+            second before the end.
+    """
+
+    end_time = time.time() + seconds
+
+    remaining = int(seconds)
+
+    while remaining > 0:
+        services.ui.submit(services.console.show_countdown, remaining,
+                           msg_format)
+
+        if remaining == 1 and last_second_callback is not None:
+            services.ui.submit(last_second_callback)
+
+        yield SleepUntil(end_time - remaining + 1 - (seconds % 1))
+
+        remaining -= 1
+
+    if int(seconds) == 0 and last_second_callback is not None:
+        services.ui.submit(last_second_callback)
+
+    yield SleepUntil(end_time)
+
+    services.ui.submit(services.console.show_countdown, 0, msg_format)
+
+def read_measure(port, writer=None):
+    """Returns, raising Return, a measure taken by the SQM of a port kept
+    open, with the retry policy of the port.
+
+    The errors of the device are failed attempts, the port is opened again
+    before the next one.
+
+    Args:
+        port: Serial port of the SQM.
+        writer: Worker to add the replies to the archive of the port, added
+            by the task if None.
+    """
+
+    transport = port.transport
+
+    measure = None
+
+    start_time = time.time()
+    deadline = port.begin_measure()
+    backoff = SerialPort.RETRY_BACKOFF
+
+    while measure is None and port.retry_allowed(deadline):
+
+        if len(port.last_attempts) > 0:
+            yield Sleep(min(backoff, max(0, deadline - time.time())))
+            backoff *= 2
+
+        attempt_start = time.time()
+
+        request_deadline = attempt_start + \
+            min(SerialPort.REQUEST_TIMEOUT, deadline - attempt_start)
+
+        reply = None
+
+        try:
+            port.ensure_open()
+
+            # Discarding the input with tcflush doesn't block.
+            transport.flush_input()
+
+            command = transport.write_available(SerialPort.SQM_READ_COMMAND)
+
+            while len(command) > 0 and \
+                (yield Writable(transport.fileno(), request_deadline)):
+                command = transport.write_available(command)
+
+            if len(command) == 0:
+                while reply is None and (yield Readable(transport.fileno(),
+                                                        request_deadline)):
+                    if not transport.on_readable():
+                        raise TransportException("Device %s closed." %
+                                                 transport.device_path)
+
+                    reply = transport.pop_line()
+            else:
+                logging.warning("Timeout sending to %s" %
+                                transport.device_path)
+        except TransportException as te:
+            port.process_error(te, time.time() - attempt_start)
+
+            continue
+
+        elapsed = time.time() - attempt_start
+
+        # The archive compresses and writes its blocks.
+        if writer is not None:
+            writer.submit(port.archive_reply, reply or "", elapsed,
+                          time.time())
+
+        measure = port.process_reply(reply or "", elapsed,
+                                     archive=writer is None)
+
+    if measure is None:
+        port.log_gap(time.time() - start_time)
+
+    raise Return(measure)
+
+def read_measures(runtime, ports, writer=None):
+    """Returns, raising Return, a measure taken by each SQM at the same time,
+    a task for each one.
+
+    Args:
+        runtime: Runtime of the tasks.
+        ports: Serial ports of the SQMs.
+        writer: Worker to add the replies to the archives of the ports.
+    """
+
+    tasks = [ runtime.spawn(read_measure(p, writer), "read %s" % p.device)
+              for p in ports ]
+
+    measures = []
+
+    for task in tasks:
+        measures.append((yield task))
+
+    raise Return(measures)
+
+class Services(object):
+    """What the modes share: the runtime, the devices, the configuration,
+    the console and the sinks, and the workers for the calls that block.
+    """
+
+    def __init__(self, runtime, ser, sqm_config, console, sinks=None,
+                 watcher=None, rig_ports=None):
+
+        self.runtime = runtime
+        self.ser = ser
+        self.sqm_config = sqm_config
+        self.console = console
+        self.sinks = sinks or []
+        self.watcher = watcher
+        self.rig_ports = rig_ports
+
+        # The console and the sounds, the output files and sinks, and the
+        # calculations, so a slow one doesn't delay the others.
+        self.ui = Worker(runtime, "ui")
+        self.writer = Worker(runtime, "writer")
+        self.compute = Worker(runtime, "compute")
+
+    def close(self):
+        """Wait for the calls queued to the workers."""
+
+        for worker in ( self.writer, self.compute, self.ui ):
+            worker.close()
+
+    def check_config(self, output_file=None, console=None):
+        """Returns, raising Return, True if the configuration has been
+        reloaded.
+        """
+
+        changed = False
+
+        if self.watcher is not None:
+            changed = yield self.writer.submit(self.watcher.check,
+                                               output_file, console)
+
+        raise Return(changed)
+
+def continuous_mode(services, output_filename, scheduler=None, cadence=None):
+    """Task of the continuous measures, as sqmcontrol.continuous_measures
+    with the same functions for each period.
+
+    Args:
+        services: Services of the measures.
+        output_filename: Name of the output file.
+        scheduler: Optional scheduler of the nights.
+        cadence: Optional adaptive cadence.
+    """
+
+    from sqmcontrol import write_continuous_header, continuous_parameters, \
+        night_wait, night_wait_message, reading_fields, update_cadence, \
+        process_burst, next_period
+
+    sqm_config = services.sqm_config
+    writer = services.writer
+    console = services.console
+
+    logging.debug("Starting continuous measures.")
+
+    output_file = yield writer.submit(OutputFile, output_filename)
+
+    writer.submit(write_continuous_header, output_file, sqm_config, scheduler,
+                  cadence)
+
+    periodicity, duration, burst = continuous_parameters(sqm_config)
+
+    start_time = time.time()
+
+    next_time = start_time
+
+    while next_time - start_time < duration:
+
+        # During the day the measures restart at dusk.
+        if scheduler is not None:
+            dusk = yield services.compute.submit(night_wait, scheduler,
+                                                 time.time())
+
+            if dusk is not None:
+                msg = night_wait_message(scheduler, dusk)
+
+                logging.info(msg)
+                services.ui.submit(console.message, msg)
+                writer.submit(output_file.write_com, msg)
+
+                yield SleepUntil(min(dusk, start_time + duration))
+
+                next_time = time.time()
+
+                if cadence is not None:
+                    cadence.reset()
+
+                continue
+
+        readings = []
+
+        for i in range(burst):
+
+            measure_time = time.time()
+
+            measure = yield read_measure(services.ser, services.writer)
+
+            extra_fields = []
+
+            if measure is not None and scheduler is not None:
+                extra_fields = yield services.compute.submit(
+                    reading_fields, scheduler, measure_time, measure)
+
+            readings.append((measure_time, measure,
+                             services.ser.last_temperature, extra_fields))
+
+        update_cadence(cadence, readings)
+
+        writer.submit(process_burst, readings, output_file, services.sinks,
+                      console)
+
+        # Apply any configuration change before the next measure.
+        if (yield services.check_config(output_file)):
+            periodicity, duration, burst = \
+                continuous_parameters(sqm_config, cadence)
+
+        next_time = next_period(next_time, periodicity, cadence)
+
+        yield SleepUntil(next_time)
+
+def one_mode(services):
+    """Task of the independent measures, as sqmcontrol.one_measures.
+
+    Args:
+        services: Services of the measures.
+    """
+
+    from sqmcontrol import process_one_measure
+
+    sqm_config = services.sqm_config
+
+    logging.debug("Starting independent measures.")
+
+    periodicity = float(sqm_config.periodicity)
+
+    while True:
+        yield countdown(services, periodicity,
+                        "Waiting %d seconds before measuring ...",
+                        lambda: start_sound(sqm_config))
+
+        measure_time = time.time()
+
+        measure = yield read_measure(services.ser, services.writer)
+
+        services.ui.submit(end_sound, sqm_config)
+
+        services.writer.submit(process_one_measure, measure, measure_time,
+                               services.ser.last_temperature, services.sinks,
+                               services.console)
+
+        # Without an output file the reloads are shown.
+        if (yield services.check_config(console=services.console)):
+            periodicity = float(sqm_config.periodicity)
+
+def all_sky_mode(services, output_filename):
+    """Task of the all sky measures, as allsky.all_sky_measures with the
+    same functions for each position, the SQMs of a rig are read by a task
+    each.
+
+    Args:
+        services: Services of the measures.
+        output_filename: Name of the output files.
+
+    Returns:
+        The measures taken, raising Return.
+    """
+
+    from allsky import AllSkyMeasures, AZIMUTH_VALUES, VERTICAL_VALUES, \
+        DELAY_BETWEEN_REPEATED_MEASURES, plan_session, plan_delays, \
+        position_ports, store_position, store_zenith, save_all_sky
+
+    sqm_config = services.sqm_config
+    console = services.console
+    ui = services.ui
+    rig_ports = services.rig_ports
+
+    logging.debug("Starting all sky measures.")
+
+    ser = services.ser if rig_ports is None else rig_ports[0]
+
+    plan, messages = plan_session(sqm_config, rig_ports)
+
+    for msg in messages:
+        ui.submit(console.message, msg)
+
+    all_sky_values = AllSkyMeasures(len(AZIMUTH_VALUES), len(VERTICAL_VALUES))
+
+    delays = plan_delays(plan, sqm_config)
+
+    total_positions = len(plan) + 1
+
+    for k, position in enumerate(plan.positions):
+
+        # The reloads are written in the files saved.
+        if (yield services.check_config(all_sky_values)):
+            delays = plan_delays(plan, sqm_config)
+
+        label = plan.label(position)
+
+        ui.submit(console.progress, k, total_positions, label)
+
+        yield countdown(services, delays[k],
+                        "Waiting %d seconds before next measure ...",
+                        lambda: start_sound(sqm_config))
+
+        ui.submit(console.message, "Measuring next value: %s" % label)
+
+        pointings, ports = position_ports(plan, k, ser, rig_ports)
+
+        measures = [ [] for p in ports ]
+
+        for r in range(int(sqm_config.repetitions)):
+            taken = yield read_measures(services.runtime, ports,
+                                        services.writer)
+
+            for i, measure in enumerate(taken):
+                if measure is not None:
+                    measures[i].append(float(measure))
+
+            yield Sleep(DELAY_BETWEEN_REPEATED_MEASURES)
+
+        ui.submit(end_sound, sqm_config)
+
+        for text, measure in store_position(all_sky_values, pointings,
+                                            measures):
+            ui.submit(console.show_measure, text, measure)
+
+    ui.submit(console.progress, total_positions - 1, total_positions,
+              "zenith")
+
+    yield countdown(services, delays[-1],
+                    "Waiting %d seconds to move to the zenith.")
+
+    ui.submit(console.message, "Measuring next value: zenith.")
+
+    measure = yield read_measure(ser, services.writer)
+
+    ui.submit(console.show_measure, *store_zenith(all_sky_values, measure))
+
+    ui.submit(console.progress, total_positions, total_positions, "done")
+
+    yield services.writer.submit(save_all_sky, all_sky_values,
+                                 output_filename, sqm_config)
+
+    raise Return(all_sky_values)
+
+def run_mode(ser, sqm_config, console, sinks=None, watcher=None,
+             rig_ports=None):
+    """Run the measures of the mode configured in the runtime, until they
+    end or a SIGINT or SIGTERM is received.
+
+    Args:
+        ser: Serial object used to communicate with SQM, kept open.
+        sqm_config: Configuration parameters.
+        console: Console to show the measures.
+        sinks: Objects that also receive each measure.
+        watcher: Optional watcher to reload the configuration.
+        rig_ports: Serial objects of the SQMs of the rig, if any.
+
+    Returns:
+        The all sky measures taken, if any.
+    """
+
+    from sqmcontrol import DEFAULT_CONT_OUT_FILE_NAME, \
+        DEFAULT_SKY_OUT_FILE_NAME
+
+    runtime = Runtime()
+
+    services = Services(runtime, ser, sqm_config, console, sinks, watcher,
+                        rig_ports)
+
+    all_sky_values = None
+
+    try:
+        if sqm_config.mode_continuous:
+            from nightsched import create_scheduler
+            from adaptive import create_cadence
+
+            runtime.run(continuous_mode(services, DEFAULT_CONT_OUT_FILE_NAME,
+                                        create_scheduler(sqm_config),
+                                        create_cadence(sqm_config)))
+        elif sqm_config.mode_all_sky:
+            all_sky_values = runtime.run(all_sky_mode(
+                services, DEFAULT_SKY_OUT_FILE_NAME))
+        elif sqm_config.mode_one:
+            runtime.run(one_mode(services))
+        else:
+            msg = "The mode specified is not recognized."
+            logging.warning(msg)
+            print msg
+    except Cancelled:
+        logging.debug("Measures cancelled.")
+    finally:
+        services.close()
+
+        runtime.close()
+
+    return all_sky_values
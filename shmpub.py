@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Publishes the latest readings in shared memory for other local processes.
+
+The readings are written in a file of the shared memory file system mapped
+by the publisher and the readers. The segment has a header followed by a
+ring of the last readings:
+
+    magic        8 bytes   "SQMSHM02"
+    capacity     uint32    number of readings of the ring
+    record size  uint32    bytes of each reading
+    sequence     uint64    odd while a reading is being written
+    count        uint64    readings written since the start
+    readings     capacity records of time, magnitude and temperature as
+                 three doubles, the CRC32 of the number of the reading and
+                 the three doubles as uint32 and 4 bytes of padding, the
+                 last one at (count - 1) % capacity
+
+There is only one writer. A reader copies what it needs between two reads
+of the sequence and repeats if it was odd or has changed, so it never blocks
+the writer. The sequence alone is enough on x86, but there are no memory
+barriers between the writes to the mapping, and on ARM, as in the Raspberry
+Pi, a reader could see a new reading with an old sequence or the reverse.
+The reader also checks the CRC of each reading copied against the number of
+the reading expected in its position and repeats if it doesn't match, so it
+never uses a reading half written nor one of a previous turn of the ring.
+"""
+
+import os
+import sys
+import mmap
+import time
+import zlib
+import struct
+
+import numpy as np
+
+from sprogargs import ProgramArguments
+
+DEFAULT_SHM_PATH = ProgramArguments.DEFAULT_SHM_PATH
+
+# Readings kept in the segment by default.
+DEFAULT_HISTORY = 600
+
+MAGIC = "SQMSHM02"
+
+_HEADER = struct.Struct("<8sIIQQ")
+_SEQUENCE = struct.Struct("<Q")
+_SEQUENCE_OFFSET = 16
+_COUNT_OFFSET = 24
+_PAYLOAD = struct.Struct("<3d")
+_RECORD = struct.Struct("<%dsI4x" % _PAYLOAD.size)
+
+RECORD_DTYPE = np.dtype({ "names" : [ "time", "magnitude", "temperature",
+                                      "checksum" ],
+                          "formats" : [ "<f8", "<f8", "<f8", "<u4" ],
+                          "itemsize" : _RECORD.size })
+
+# Returned by the copies of the readings that don't match their checksum.
+_TORN = object()
+
+# Times to repeat a read interrupted by a write before yielding the CPU.
+_SPIN_READS = 100
+
+# Maximum seconds to repeat a read by default, a publisher stopped while
+# writing leaves a reading that never matches.
+DEFAULT_READ_TIMEOUT = 1.0
+
+# Time between checks while waiting for a new reading.
+_WAIT_INTERVAL = 0.001
+
+def _checksum(number, payload):
+    """Returns the CRC32 of a reading and its number since the start.
+
+    Args:
+        number: Number of the reading, count - 1 for the last one.
+        payload: The three doubles of the reading packed.
+    """
+
+    return zlib.crc32(_SEQUENCE.pack(number) + payload) & 0xffffffff
+
+class SharedMemoryException(Exception):
+
+    def __init__(self, msg):
+
+        self._msg = msg
+
+    def __str__(self):
+
+        return self._msg
+
+class SharedReadingsPublisher(object):
+    """Writes the readings in the shared memory segment, to be used as a
+    sink of the measures.
+    """
+
+    def __init__(self, path=DEFAULT_SHM_PATH, capacity=DEFAULT_HISTORY):
+        """Creates the segment, replacing any previous one.
+
+        Args:
+            path: Path of the segment.
+            capacity: Number of readings kept.
+        """
+
+        self._path = path
+        self._capacity = capacity
+        self._size = _HEADER.size + capacity * _RECORD.size
+        self._sequence = 0
+        self._count = 0
+
+        temp_path = "%s.%d" % (path, os.getpid())
+
+        try:
+            with open(temp_path, "w+b") as fw:
+                fw.write("\0" * self._size)
+                fw.flush()
+
+                self._mmap = mmap.mmap(fw.fileno(), self._size)
+
+            _HEADER.pack_into(self._mmap, 0, MAGIC, capacity, _RECORD.size,
+                              0, 0)
+
+            # Replaced at once, the readers of a previous segment see it has
+            # been replaced.
+            os.rename(temp_path, path)
+
+        except (IOError, OSError, mmap.error) as e:
+            raise SharedMemoryException("Creating segment %s: %s" % (path, e))
+
+    @property
+    def path(self):
+        return self._path
+
+    def publish(self, timestamp, magnitude, temperature=float("nan")):
+        """Write a reading.
+
+        Args:
+            timestamp: Time of the reading in seconds since the epoch.
+            magnitude: Value measured.
+            temperature: Temperature of the SQM.
+        """
+
+        index = self._count % self._capacity
+
+        payload = _PAYLOAD.pack(timestamp, magnitude, temperature)
+
+        _SEQUENCE.pack_into(self._mmap, _SEQUENCE_OFFSET, self._sequence + 1)
+
+        _RECORD.pack_into(self._mmap, _HEADER.size + index * _RECORD.size,
+                          payload, _checksum(self._count, payload))
+
+        self._count += 1
+        _SEQUENCE.pack_into(self._mmap, _COUNT_OFFSET, self._count)
+
+        self._sequence += 2
+        _SEQUENCE.pack_into(self._mmap, _SEQUENCE_OFFSET, self._sequence)
+
+    def add_reading(self, timestamp, measure, temperature=None):
+        """Write a reading received as a sink of the measures.
+
+        Args:
+            timestamp: Time of the reading in seconds since the epoch.
+            measure: Value measured, as a string.
+            temperature: Temperature of the SQM, if known.
+        """
+
+        self.publish(timestamp, float(measure),
+                     float("nan") if temperature is None else
+                     float(temperature))
+
+    def close(self, unlink=True):
+        """Unmap the segment.
+
+        Args:
+            unlink: True to remove the segment.
+        """
+
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+            if unlink:
+                try:
+                    os.remove(self._path)
+                except OSError:
+                    pass
+
+class SharedReadingsReader(object):
+    """Reads the readings published in the shared memory segment."""
+
+    def __init__(self, path=DEFAULT_SHM_PATH,
+                 read_timeout=DEFAULT_READ_TIMEOUT):
+        """Maps the segment.
+
+        Args:
+            path: Path of the segment.
+            read_timeout: Maximum seconds to repeat a read interrupted by a
+                write or that doesn't match its checksum.
+        """
+
+        self._path = path
+        self._read_timeout = read_timeout
+
+        try:
+            with open(path, "rb") as fr:
+                self._inode = os.fstat(fr.fileno()).st_ino
+
+                self._mmap = mmap.mmap(fr.fileno(), 0, access=mmap.ACCESS_READ)
+
+        except (IOError, OSError, mmap.error) as e:
+            raise SharedMemoryException("Opening segment %s: %s" % (path, e))
+
+        magic, capacity, record_size, sequence, count = \
+            _HEADER.unpack_from(self._mmap, 0)
+
+        if magic != MAGIC or record_size != _RECORD.size:
+            self.close()
+            raise SharedMemoryException("Invalid segment %s" % path)
+
+        self._capacity = capacity
+
+        # The readings are used in place, copied only in the snapshots.
+        self._records = np.frombuffer(self._mmap, dtype=RECORD_DTYPE,
+                                      count=capacity, offset=_HEADER.size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+
+        self._records = None
+
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def count(self):
+        """Readings published since the publisher started."""
+
+        return _SEQUENCE.unpack_from(self._mmap, _COUNT_OFFSET)[0]
+
+    def is_stale(self):
+        """Returns True if the publisher has been restarted or stopped, the
+        reader must be opened again.
+        """
+
+        try:
+            stale = os.stat(self._path).st_ino != self._inode
+        except OSError:
+            stale = True
+
+        return stale
+
+    def _snapshot(self, copy_function):
+        """Calls the function with the count of readings until it runs
+        without the publisher writing at the same time and the readings
+        copied match their checksums.
+
+        Returns:
+            What the function returns.
+
+        Raises:
+            SharedMemoryException: If the readings don't match before the
+                timeout, as when the publisher stopped while writing.
+        """
+
+        deadline = time.time() + self._read_timeout
+
+        reads = 0
+
+        while True:
+            sequence = _SEQUENCE.unpack_from(self._mmap, _SEQUENCE_OFFSET)[0]
+
+            if sequence % 2 == 0:
+                count = _SEQUENCE.unpack_from(self._mmap, _COUNT_OFFSET)[0]
+
+                result = copy_function(count)
+
+                if result is not _TORN and \
+                    sequence == _SEQUENCE.unpack_from(self._mmap,
+                                                      _SEQUENCE_OFFSET)[0]:
+                    return result
+
+            reads += 1
+
+            # The publisher may have been preempted while writing.
+            if reads % _SPIN_READS == 0:
+                if time.time() > deadline:
+                    raise SharedMemoryException("Readings of segment %s not "
+                                                "consistent after %g s, the "
+                                                "publisher may have stopped "
+                                                "while writing." %
+                                                (self._path,
+                                                 self._read_timeout))
+
+                time.sleep(0)
+
+    def latest(self):
+        """Returns the last reading as a tuple of time, magnitude and
+        temperature, or None if nothing has been published.
+
+        Raises:
+            SharedMemoryException: If the reading doesn't match before the
+                timeout.
+        """
+
+        def copy_latest(count):
+            reading = None
+
+            if count > 0:
+                offset = _HEADER.size + \
+                    (count - 1) % self._capacity * _RECORD.size
+
+                payload, checksum = _RECORD.unpack(
+                    self._mmap[offset:offset + _RECORD.size])
+
+                if checksum == _checksum(count - 1, payload):
+                    reading = _PAYLOAD.unpack(payload)
+                else:
+                    reading = _TORN
+
+            return reading
+
+        return self._snapshot(copy_latest)
+
+    def history(self, size=None):
+        """Returns the last readings, the oldest first.
+
+        Args:
+            size: Number of readings, all those kept if None.
+
+        Returns:
+            A tuple with the arrays of times, magnitudes and temperatures.
+
+        Raises:
+            SharedMemoryException: If the readings don't match before the
+                timeout.
+        """
+
+        def copy_history(count):
+            n = min(count, self._capacity)
+
+            if size is not None:
+                n = min(n, size)
+
+            indexes = np.arange(count - n, count) % self._capacity
+
+            records = self._records[indexes]
+
+            data = records.tobytes()
+
+            for i in range(n):
+                payload, checksum = _RECORD.unpack_from(data,
+                                                        i * _RECORD.size)
+
+                if checksum != _checksum(count - n + i, payload):
+                    records = _TORN
+                    break
+
+            return records
+
+        records = self._snapshot(copy_history)
+
+        return records["time"], records["magnitude"], records["temperature"]
+
+    def wait(self, count, timeout=None):
+        """Wait for a reading after those already seen, checking the count
+        in memory.
+
+        Args:
+            count: Readings already seen.
+            timeout: Maximum time to wait in seconds, no limit if None.
+
+        Returns:
+            The new count, the same if the timeout has expired.
+        """
+
+        deadline = None if timeout is None else time.time() + timeout
+
+        new_count = self.count
+
+        while new_count == count and \
+            (deadline is None or time.time() < deadline):
+            time.sleep(_WAIT_INTERVAL)
+
+            new_count = self.count
+
+        return new_count
+
+if __name__ == "__main__":
+
+    # Shows the readings published as they arrive.
+    reader = SharedReadingsReader(sys.argv[1] if len(sys.argv) > 1
+                                  else DEFAULT_SHM_PATH)
+
+    count = reader.count
+
+    try:
+        while not reader.is_stale():
+            new_count = reader.wait(count, 1.0)
+
+            if new_count != count:
+                count = new_count
+
+                print "%.3f %.2f %.1f" % reader.latest()
+
+    except SharedMemoryException as sme:
+        print sme
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
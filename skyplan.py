@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Plans of the order of the positions measured in all sky mode.
+
+A plan sorts the positions of the sky and gives the angle the SQM is moved
+before each measure, the zenith is always the last position. The delay
+before each measure grows with that angle, so the plans that move less are
+shorter.
+"""
+
+import sys
+import math
+
+# Altitude of the zenith, the last position of all the plans.
+ZENITH_ALTITUDE = 90
+
+# Moves up to this angle, as between adjacent positions, only wait the delay.
+ADJACENT_ANGLE = 30.0
+
+# Largest angle between two positions of the sky.
+MAX_ANGLE = 180.0
+
+def angular_distance(azimuth_1, altitude_1, azimuth_2, altitude_2):
+    """Returns the angle between two positions of the sky.
+
+    Args:
+        azimuth_1: Azimuth of the first position in degrees.
+        altitude_1: Altitude of the first position in degrees.
+        azimuth_2: Azimuth of the second position in degrees.
+        altitude_2: Altitude of the second position in degrees.
+
+    Returns:
+        The angle in degrees.
+    """
+
+    alt_1 = math.radians(altitude_1)
+    alt_2 = math.radians(altitude_2)
+
+    cos_angle = math.sin(alt_1) * math.sin(alt_2) + \
+        math.cos(alt_1) * math.cos(alt_2) * \
+        math.cos(math.radians(azimuth_2 - azimuth_1))
+
+    # Rounding could leave the cosine out of its range.
+    return math.degrees(math.acos(max(-1.0, min(1.0, cos_angle))))
+
+def move_delay(angle, delay, delay_between):
+    """Returns the time to wait before measuring after moving the SQM.
+
+    Moving to an adjacent position waits the delay, longer moves add a part
+    of the delay between azimuth and vertical proportional to the angle
+    moved, all of it for the largest move.
+
+    Args:
+        angle: Angle moved in degrees.
+        delay: Delay before each measure.
+        delay_between: Delay for the largest move.
+
+    Returns:
+        The time to wait in seconds.
+    """
+
+    extra = max(0.0, angle - ADJACENT_ANGLE) / (MAX_ANGLE - ADJACENT_ANGLE)
+
+    return delay + delay_between * extra
+
+class MeasurementPlan(object):
+    """Order of the positions of an all sky session. The subclasses
+    implement _sort to set the order.
+    """
+
+    NAME = None
+
+    def __init__(self, azimuths, verticals, order_is_azimuth=True):
+        """Initializes the plan.
+
+        Args:
+            azimuths: Azimuth values in degrees.
+            verticals: Vertical values in degrees.
+            order_is_azimuth: True to measure all the azimuths of each
+                vertical value before the next one, for the plans by rows.
+        """
+
+        self._azimuths = azimuths
+        self._verticals = verticals
+        self._order_is_azimuth = order_is_azimuth
+
+        self._positions = self._sort()
+        self._angles = self._calculate_angles()
+
+    def __len__(self):
+        return len(self._positions)
+
+    @property
+    def name(self):
+        return self.NAME
+
+    @property
+    def positions(self):
+        """Indexes of azimuth and vertical of the positions in the order to
+        measure them, the zenith not included.
+        """
+
+        return list(self._positions)
+
+    @property
+    def angles(self):
+        """Angle moved before each position, the last one to the zenith."""
+
+        return list(self._angles)
+
+    @property
+    def total_angle(self):
+        return sum(self._angles)
+
+    def _rows(self):
+        """Returns the positions by rows, a row for each vertical value if
+        the order is by azimuth or for each azimuth otherwise.
+        """
+
+        if self._order_is_azimuth:
+            rows = [ [ (i, j) for i in range(len(self._azimuths)) ]
+                     for j in range(len(self._verticals)) ]
+        else:
+            rows = [ [ (i, j) for j in range(len(self._verticals)) ]
+                     for i in range(len(self._azimuths)) ]
+
+        return rows
+
+    def _sort(self):
+        raise NotImplementedError()
+
+    def _coordinates(self, position):
+        """Returns the azimuth and altitude of a position, the zenith if it
+        is None.
+        """
+
+        if position is None:
+            coordinates = (0, ZENITH_ALTITUDE)
+        else:
+            coordinates = (self._azimuths[position[0]],
+                           self._verticals[position[1]])
+
+        return coordinates
+
+    def _distance(self, position_1, position_2):
+
+        return angular_distance(*(self._coordinates(position_1) +
+                                  self._coordinates(position_2)))
+
+    def _calculate_angles(self):
+        """Returns the angle moved before each position, the first position
+        doesn't need a move.
+        """
+
+        route = self._positions + [ None ]
+
+        return [ 0.0 ] + [ self._distance(route[k - 1], route[k])
+                           for k in range(1, len(route)) ]
+
+    def label(self, position):
+        """Returns a text describing a position.
+
+        Args:
+            position: Indexes of azimuth and vertical.
+        """
+
+        return "Azimuth %d Vertical %d" % self._coordinates(position)
+
+    def delays(self, delay, delay_between):
+        """Returns the time to wait before each position, the last one for
+        the zenith.
+
+        Args:
+            delay: Delay before each measure.
+            delay_between: Delay for the largest move.
+        """
+
+        return [ move_delay(a, delay, delay_between) for a in self._angles ]
+
+    def slew_time(self, delay, delay_between):
+        """Returns the total time waiting for the moves of the plan.
+
+        Args:
+            delay: Delay before each measure.
+            delay_between: Delay for the largest move.
+        """
+
+        return sum(self.delays(delay, delay_between))
+
+class RasterPlan(MeasurementPlan):
+    """Measures each row in the same direction, the order used originally."""
+
+    NAME = "RASTER"
+
+    def _sort(self):
+
+        return [ p for row in self._rows() for p in row ]
+
+class SerpentinePlan(MeasurementPlan):
+    """Measures the rows alternating their direction, so each row starts
+    next to the end of the previous one.
+    """
+
+    NAME = "SERPENTINE"
+
+    def _sort(self):
+
+        positions = []
+
+        for k, row in enumerate(self._rows()):
+            if k % 2 == 1:
+                row = row[::-1]
+
+            positions.extend(row)
+
+        return positions
+
+class NearestNeighbourPlan(MeasurementPlan):
+    """Goes always to the nearest position not measured, and then improves
+    the route reversing the parts of it that reduce the total angle moved.
+    """
+
+    NAME = "NEAREST"
+
+    # Passes improving the route, it usually converges in a few.
+    _MAX_PASSES = 20
+
+    def _sort(self):
+
+        pending = [ p for row in self._rows() for p in row ]
+
+        # Start from the lowest altitude of the first azimuth.
+        route = [ pending.pop(0) ]
+
+        while len(pending) > 0:
+            nearest = min(pending, key=lambda p: self._distance(route[-1], p))
+
+            pending.remove(nearest)
+            route.append(nearest)
+
+        return self._improve(route)
+
+    def _improve(self, route):
+        """Reverse the parts of the route that make it shorter (2-opt),
+        keeping the first position and the zenith at the ends.
+
+        Args:
+            route: Positions in order.
+
+        Returns:
+            The route improved.
+        """
+
+        # The zenith is added as a fixed end of the route.
+        route = route + [ None ]
+
+        n = len(route)
+
+        for _ in range(NearestNeighbourPlan._MAX_PASSES):
+            improved = False
+
+            for i in range(1, n - 2):
+                for j in range(i + 1, n - 1):
+                    before = self._distance(route[i - 1], route[i]) + \
+                        self._distance(route[j], route[j + 1])
+                    after = self._distance(route[i - 1], route[j]) + \
+                        self._distance(route[i], route[j + 1])
+
+                    if after < before - 1e-9:
+                        route[i:j + 1] = route[i:j + 1][::-1]
+                        improved = True
+
+            if not improved:
+                break
+
+        return route[:-1]
+
+class RigPlan(MeasurementPlan):
+    """Orientations of a rig of several SQMs with fixed pointings, all of
+    them measuring at the same time.
+
+    The positions of the plan are those of the first SQM of the rig. They
+    are taken in the order of the plan of a single SQM, skipping those
+    already measured by another SQM of the rig in a previous orientation.
+    """
+
+    def __init__(self, plan_class, azimuths, verticals, offsets,
+                 order_is_azimuth=True):
+        """Initializes the plan.
+
+        Args:
+            plan_class: Plan followed by the first SQM.
+            azimuths: Azimuth values in degrees.
+            verticals: Vertical values in degrees.
+            offsets: Azimuth and vertical offsets in degrees of the pointing
+                of each SQM of the rig, relative to the first one.
+            order_is_azimuth: True to measure all the azimuths of each
+                vertical value before the next one, for the plans by rows.
+        """
+
+        self._plan_class = plan_class
+        self._offsets = offsets
+        self._assignments = []
+
+        MeasurementPlan.__init__(self, azimuths, verticals, order_is_azimuth)
+
+    @property
+    def name(self):
+        return self._plan_class.NAME
+
+    @property
+    def assignments(self):
+        """For each orientation, a list of the index of each SQM measuring a
+        position not measured before and that position.
+        """
+
+        return [ list(a) for a in self._assignments ]
+
+    def _pointing(self, position, offset):
+        """Returns the position an SQM points to when the first one points to
+        the position given, None if it is out of the positions measured.
+        """
+
+        azimuth = (self._azimuths[position[0]] + offset[0]) % 360
+        vertical = self._verticals[position[1]] + offset[1]
+
+        pointing = None
+
+        if azimuth in self._azimuths and vertical in self._verticals:
+            pointing = (self._azimuths.index(azimuth),
+                        self._verticals.index(vertical))
+
+        return pointing
+
+    def _sort(self):
+
+        single_plan = self._plan_class(self._azimuths, self._verticals,
+                                       self._order_is_azimuth)
+
+        orientations = []
+        measured = set()
+
+        for position in single_plan.positions:
+            if position not in measured:
+                assignment = []
+
+                for k, offset in enumerate(self._offsets):
+                    pointing = self._pointing(position, offset)
+
+                    if pointing is not None and pointing not in measured:
+                        assignment.append((k, pointing))
+                        measured.add(pointing)
+
+                orientations.append(position)
+                self._assignments.append(assignment)
+
+        return orientations
+
+    def label(self, position):
+        """Returns a text describing an orientation of the rig.
+
+        Args:
+            position: Indexes of azimuth and vertical of the first SQM.
+        """
+
+        return "Rig azimuth %d vertical %d" % self._coordinates(position)
+
+# Plans by the name used in the configuration.
+PLANS = dict([ (p.NAME, p) for p in
+               (RasterPlan, SerpentinePlan, NearestNeighbourPlan) ])
+
+def create_plan(sqm_config, azimuths, verticals, offsets=None):
+    """Returns the plan set in the configuration.
+
+    Args:
+        sqm_config: Configuration parameters.
+        azimuths: Azimuth values in degrees.
+        verticals: Vertical values in degrees.
+        offsets: Offsets of the pointings of the SQMs of a rig, relative to
+            the first one, None for a single SQM.
+    """
+
+    if offsets is not None and len(offsets) > 1:
+        plan = RigPlan(PLANS[sqm_config.plan], azimuths, verticals, offsets,
+                       sqm_config.order_is_azimuth)
+    else:
+        plan = PLANS[sqm_config.plan](azimuths, verticals,
+                                      sqm_config.order_is_azimuth)
+
+    return plan
+
+def rig_offsets(rig):
+    """Returns the offsets of the pointings of the SQMs of a rig relative to
+    the first one.
+
+    Args:
+        rig: Devices of the rig with the azimuth and vertical offsets of their
+            pointings.
+    """
+
+    return [ (az - rig[0][1], vert - rig[0][2]) for device, az, vert in rig ]
+
+if __name__ == "__main__":
+
+    from config import SQMControlCfg
+    from allsky import AZIMUTH_VALUES, VERTICAL_VALUES, estimated_session_time
+
+    sqm_config = SQMControlCfg(sys.argv[1] if len(sys.argv) > 1 else "sqm.cfg")
+
+    for name in sorted(PLANS):
+        plan = PLANS[name](AZIMUTH_VALUES, VERTICAL_VALUES,
+                           sqm_config.order_is_azimuth)
+
+        print "%-10s moved %5.0f degrees, estimated time %4.0f s" % \
+            (name, plan.total_angle, estimated_session_time(plan, sqm_config))
+
+        if len(sqm_config.rig) > 1:
+            plan = RigPlan(PLANS[name], AZIMUTH_VALUES, VERTICAL_VALUES,
+                           rig_offsets(sqm_config.rig),
+                           sqm_config.order_is_azimuth)
+
+            print "%-10s rig of %d SQMs, %d orientations, estimated time " \
+                "%4.0f s" % (name, len(sqm_config.rig), len(plan),
+                             estimated_session_time(plan, sqm_config))
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Soak test of the continuous measures.
+
+The continuous measures run against a simulated SQM with a simulated clock,
+so hours of measures at a high cadence take minutes. The readings go to the
+ring buffer, the rollups and the archive of the raw replies, as while
+measuring for days, and the memory used is sampled every simulated hour.
+
+The test fails if, after the warm up, the resident memory grows faster than
+the limit or the number of objects keeps growing.
+"""
+
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+import sqmserial
+import sqmcontrol
+from console import PlainConsole
+from memdiag import MemoryMonitor, memory_slope
+from sqmserial import SerialPort
+
+# Simulated hours by default.
+DEFAULT_HOURS = 72
+
+# Limits of the growth after the warm up.
+DEFAULT_MAX_SLOPE = 256 * 1024
+DEFAULT_MAX_OBJECTS = 1000
+
+# Part of the simulated time taken as warm up, while the ring buffer and
+# the rollups of the first night fill.
+WARM_UP = 0.25
+
+# Every how many requests the simulated SQM doesn't reply or replies garbled.
+_SILENT_EVERY = 97
+_GARBLED_EVERY = 89
+
+_REPLY_FORMAT = "r, %05.2fm,0000022921Hz,0000000020c,0000000.000s, %05.1fC\r\n"
+
+class SimulatedClock(object):
+    """Replaces the time module of the modules that measure, sleeping
+    advances the time without waiting.
+    """
+
+    def __init__(self, start_time):
+
+        self._now = start_time
+
+    def time(self):
+        return self._now
+
+    def sleep(self, seconds):
+        self._now += max(0, seconds)
+
+    def advance(self, seconds):
+        self._now += seconds
+
+    def __getattr__(self, name):
+        # localtime, strftime and the rest as those of the time module.
+        return getattr(time, name)
+
+class _SimulatedTransport(object):
+    """Transport always open of the simulated SQM."""
+
+    device_path = "simulated"
+
+    def is_open(self):
+        return True
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+class SimulatedSQM(SerialPort):
+    """SQM that replies from memory, with a reply not received or garbled
+    from time to time so the retries and gaps are also exercised.
+    """
+
+    # Simulated seconds to reply.
+    REPLY_TIME = 0.05
+
+    def __init__(self, clock):
+
+        super(SimulatedSQM, self).__init__("simulated")
+
+        self._clock = clock
+        self._requests = 0
+        self._device = "simulated"
+        self._transport = _SimulatedTransport()
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def _get_measure(self, timeout=SerialPort.REQUEST_TIMEOUT):
+
+        self._requests += 1
+
+        if self._requests % _SILENT_EVERY == 0:
+            self._clock.advance(timeout)
+
+            return ""
+
+        self._clock.advance(SimulatedSQM.REPLY_TIME)
+
+        if self._requests % _GARBLED_EVERY == 0:
+            return "r, 2x.!"
+
+        return _REPLY_FORMAT % (18.0 + (self._requests % 400) / 100.0,
+                                15.0 + (self._requests % 100) / 10.0)
+
+class _SoakConfig(object):
+    """Parameters of the continuous measures used by the soak test."""
+
+    def __init__(self, periodicity, duration):
+
+        self.periodicity = periodicity
+        self.duration = duration
+        self.burst = 1
+
+    def str_continuous_par(self):
+        return "Soak test, periodicity %g s, duration %d s" % \
+            (self.periodicity, self.duration)
+
+class _QuietConsole(PlainConsole):
+
+    def show_measure(self, text, measure=None, measure_time=None):
+        pass
+
+    def show_gap(self, text):
+        pass
+
+def soak(hours=DEFAULT_HOURS, periodicity=1.0, max_slope=DEFAULT_MAX_SLOPE,
+         max_objects=DEFAULT_MAX_OBJECTS, work_dir=None):
+    """Run the continuous measures against the simulated SQM.
+
+    Args:
+        hours: Simulated hours of measures.
+        periodicity: Simulated seconds between measures.
+        max_slope: Maximum growth of the resident memory after the warm up
+            in bytes per hour.
+        max_objects: Maximum growth of the objects after the warm up.
+        work_dir: Directory of the files written, a temporary one removed
+            at the end if None.
+
+    Returns:
+        A tuple with True if the memory used is flat, the growth of the
+        resident memory in bytes per hour and of the objects after the warm
+        up, and the samples of the memory.
+    """
+
+    from ringbuffer import ReadingsRingBuffer, DEFAULT_CAPACITY
+    from rollup import RollupSink
+    from rawarchive import RawArchiveWriter
+
+    duration = int(hours * 3600)
+
+    remove_dir = work_dir is None
+
+    if remove_dir:
+        work_dir = tempfile.mkdtemp(prefix="sqmsoak")
+
+    clock = SimulatedClock(time.time())
+
+    previous_dir = os.getcwd()
+
+    # The output file is written in the current directory.
+    os.chdir(work_dir)
+
+    sqmcontrol.time = clock
+    sqmserial.time = clock
+
+    try:
+        ser = SimulatedSQM(clock)
+
+        archive = RawArchiveWriter("sqm_raw.bin")
+        ser.set_archive(archive)
+
+        monitor = MemoryMonitor(3600)
+
+        sinks = [ ReadingsRingBuffer(DEFAULT_CAPACITY),
+                  RollupSink("rollups"), monitor ]
+
+        sqmcontrol.continuous_measures(ser, _SoakConfig(periodicity, duration),
+                                       "soak", sinks=sinks,
+                                       console=_QuietConsole())
+
+        archive.close()
+
+        monitor.sample(clock.time())
+    finally:
+        sqmcontrol.time = time
+        sqmserial.time = time
+
+        os.chdir(previous_dir)
+
+        if remove_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    samples = monitor.samples
+
+    warm = [ s for s in samples
+             if s.timestamp - samples[0].timestamp >= WARM_UP * duration ]
+
+    slope = memory_slope(warm)
+    objects = warm[-1].objects - warm[0].objects if len(warm) > 0 else 0
+
+    return slope <= max_slope and objects <= max_objects, slope, objects, \
+        samples
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Soak test of the "
+                                     "continuous measures with a simulated "
+                                     "SQM and clock.")
+
+    parser.add_argument("-n", dest="hours", type=float, default=DEFAULT_HOURS,
+                        help="Simulated hours of measures.")
+
+    parser.add_argument("-p", dest="periodicity", type=float, default=1.0,
+                        help="Simulated seconds between measures.")
+
+    parser.add_argument("-s", dest="max_slope", type=float,
+                        default=DEFAULT_MAX_SLOPE,
+                        help="Maximum growth of the memory after the warm up "
+                        "in bytes per hour.")
+
+    parser.add_argument("-o", dest="max_objects", type=int,
+                        default=DEFAULT_MAX_OBJECTS,
+                        help="Maximum growth of the objects after the warm "
+                        "up.")
+
+    parser.add_argument("-d", dest="work_dir",
+                        help="Directory to keep the files written.")
+
+    parser.add_argument("-v", dest="verbose", action="store_true",
+                        help="Log the samples of the memory.")
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else
+                        logging.ERROR)
+
+    start = time.time()
+
+    flat, slope, objects, samples = soak(args.hours, args.periodicity,
+                                         args.max_slope, args.max_objects,
+                                         args.work_dir)
+
+    print "%d readings in %.1f s" % (samples[-1].readings, time.time() - start)
+    print "RSS %.1f MB at the start, %.1f MB at the end" % \
+        (samples[0].rss / 1048576.0, samples[-1].rss / 1048576.0)
+    print "After the warm up: %.1f KB per hour, %+d objects" % \
+        (slope / 1024.0, objects)
+
+    if flat:
+        print "Memory flat."
+    else:
+        print "Memory growing."
+        sys.exit(1)
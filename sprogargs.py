@@ -30,6 +30,11 @@ class ProgramArguments(object):
     DEFAULT_LOG_LEVEL = "DEBUG"
     DEFAULT_LOG_FILE_NAME = "sqmcontrol.log"
     DEFAULT_CFG_FILE_NAME = "sqm.cfg"       
+    DEFAULT_SOCKET_PATH = "/tmp/sqmcontrol.sock"
+    DEFAULT_SHM_PATH = "/dev/shm/sqmcontrol"
+    DEFAULT_ROLLUP_DIR = "rollups"
+    DEFAULT_RAW_ARCHIVE = "sqm_raw.bin"
+    DEFAULT_MEMORY_INTERVAL = 3600
     
     def __init__(self):
         """Initializes parser. 
@@ -54,6 +59,61 @@ class ProgramArguments(object):
         self.__parser.add_argument("-p", dest="p", action="store_true", 
                                    help="Save plots to files.")           
         
+        self.__parser.add_argument("-t", dest="t", action="store_true", 
+                                   help="Report the time spent importing the " +
+                                   "modules of the mode configured and exit.")
+        
+        self.__parser.add_argument("-u", dest="u", action="store_true", 
+                                   help="Show a live dashboard instead of " +
+                                   "printing each measure.")
+        
+        self.__parser.add_argument("-r", dest="r", metavar="file",
+                                   help="Replay the measures of an output " +
+                                   "file instead of measuring.")
+        
+        self.__parser.add_argument("-s", dest="s", metavar="speed", 
+                                   type=float, default=1.0,
+                                   help="Times the real speed to replay " +
+                                   "the measures, 0 for as fast as possible.")
+        
+        self.__parser.add_argument("-d", dest="d", metavar="socket", nargs="?",
+                                   const=ProgramArguments.DEFAULT_SOCKET_PATH,
+                                   help="Run as a daemon controlled through " +
+                                   "a Unix socket.")
+        
+        self.__parser.add_argument("-m", dest="m", metavar="path", nargs="?",
+                                   const=ProgramArguments.DEFAULT_SHM_PATH,
+                                   help="Publish the latest readings in " +
+                                   "shared memory for other processes.")
+        
+        self.__parser.add_argument("-o", dest="o", metavar="dir", nargs="?",
+                                   const=ProgramArguments.DEFAULT_ROLLUP_DIR,
+                                   help="Keep rollups of the measures by " +
+                                   "minute, hour and night in a directory.")
+        
+        self.__parser.add_argument("-w", dest="w", metavar="file", nargs="?",
+                                   const=ProgramArguments.DEFAULT_RAW_ARCHIVE,
+                                   help="Archive every raw reply of the SQM " +
+                                   "in a file.")
+        
+        self.__parser.add_argument("-a", dest="a", action="store_true",
+                                   help="Run the measures as tasks of the " +
+                                   "cooperative runtime.")
+        
+        self.__parser.add_argument("-x", dest="x", action="store_true",
+                                   help="Export the all sky measures to a " +
+                                   "FITS file.")
+        
+        self.__parser.add_argument("-j", dest="j", metavar="file",
+                                   help="Run the measurement jobs of a job " +
+                                   "file keeping the SQM open between them.")
+        
+        self.__parser.add_argument("-g", dest="g", metavar="seconds", 
+                                   nargs="?", type=int,
+                                   const=ProgramArguments.DEFAULT_MEMORY_INTERVAL,
+                                   help="Log the growth of the memory used " +
+                                   "at intervals of the time measured.")
+        
         # Parse program arguments.
         self.__args = self.__parser.parse_args()  
         
@@ -75,6 +135,54 @@ class ProgramArguments(object):
     def store_plot(self):
         return self.__args.p
     
+    @property
+    def startup_report(self):
+        return self.__args.t
+    
+    @property
+    def dashboard(self):
+        return self.__args.u
+    
+    @property
+    def replay_file(self):
+        return self.__args.r
+    
+    @property
+    def replay_speed(self):
+        return self.__args.s
+    
+    @property
+    def daemon_socket(self):
+        return self.__args.d
+    
+    @property
+    def shm_path(self):
+        return self.__args.m
+    
+    @property
+    def rollup_dir(self):
+        return self.__args.o
+    
+    @property
+    def raw_archive(self):
+        return self.__args.w
+    
+    @property
+    def cooperative(self):
+        return self.__args.a
+    
+    @property
+    def export_fits(self):
+        return self.__args.x
+    
+    @property
+    def job_file(self):
+        return self.__args.j
+    
+    @property
+    def memory_interval(self):
+        return self.__args.g
+    
     @property
     def log_file_name(self):
         return self.__args.l       
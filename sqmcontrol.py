@@ -29,100 +29,421 @@ measures.
 import sys
 import logging
 import time
-from astropy.time import Time
 
+# Only the modules needed by every mode are imported here, the rest are
+# imported by the mode that uses them to keep the start up fast.
 from logutil import init_log
-from sprogargs import *
-from config import *
-from sqmserial import *
-from allsky import *
-from outfile import *
-from sound import *
+from sprogargs import ProgramArguments
+from config import SQMControlCfg, SQMControlException
+from sqmserial import SerialPort, SerialPortException
+from outfile import OutputFile, OutputFileException, unix_to_mjd
+from sound import start_sound, end_sound
+from cfgwatch import ConfigWatcher
+from console import PlainConsole
+from jobqueue import JobQueueException
 
 # Default names for output files.
 DEFAULT_SKY_OUT_FILE_NAME = "all_sky"
 DEFAULT_CONT_OUT_FILE_NAME = "continuous"      
 
+# Modules imported on demand by each mode.
+MODE_MODULES = { "CONTINUOUS" : [ "ringbuffer", "nightsched", "adaptive" ],
+                 "SKY" : [ "allsky" ],
+                 "ONE" : [] }
+
 # To separate time from measure in output messages.
 SEP_STR = "->"       
+
+# Console used when none is indicated.
+DEFAULT_CONSOLE = PlainConsole()
     
-def process_continuous_measure(measure, output_file):
+def process_continuous_measure(measure, output_file, measure_time=None,
+                               console=DEFAULT_CONSOLE, extra_fields=None):
     """Process the continuous measure received, saving it.
     
     Args:
         measure: The value of the measure.
         output_file: Object to write output messages.      
+        measure_time: Time the measure was requested in seconds since the 
+            epoch, current time if not provided.
+        console: Console to show the measure.
+        extra_fields: Optional list of strings written after the measure.
     """
     
-    lo_time = time.localtime()
+    if measure_time is None:
+        measure_time = time.time()
     
-    # Use astropy time to calculate MJD.
-    t_utc = time.strftime("%Y-%m-%dT%H:%M:%S.0", time.localtime())
-    t_astro = Time(t_utc, format='isot', scale='utc')
+    lo_time = time.localtime(measure_time)
     
-    msg ="%s (%.10g) %s %s\n" % (time.strftime("%d-%m-%Y %H:%M:%S", lo_time),
-                            t_astro.mjd, SEP_STR, measure)
+    # Milliseconds are included as the measures could be sub-second.
+    msg ="%s.%03d (%.13g) %s %s%s\n" % \
+        (time.strftime("%d-%m-%Y %H:%M:%S", lo_time), 
+         int((measure_time % 1) * 1000), unix_to_mjd(measure_time), SEP_STR,
+         measure, 
+         "" if extra_fields is None else " " + " ".join(extra_fields))
     
     # Avoid the final new line character.
-    print msg[:-1]
+    console.show_measure(msg[:-1], measure, measure_time)
     
     output_file.write(msg)
+    
+def process_continuous_gap(measure_time, output_file, 
+                           console=DEFAULT_CONSOLE):
+    """Process a continuous measure that couldn't be taken, saving it as a
+    comment so the gap is recorded.
+    
+    Args:
+        measure_time: Time the measure was requested in seconds since the 
+            epoch.
+        output_file: Object to write output messages.      
+        console: Console to show the gap.
+    """
+    
+    msg = "Gap: %s.%03d no valid measure" % \
+        (time.strftime("%d-%m-%Y %H:%M:%S", time.localtime(measure_time)),
+         int((measure_time % 1) * 1000))
+    
+    console.show_gap(msg)
+    
+    output_file.write_com(msg)
+    
+def wait_until(wait_time, stop_event=None):
+    """Wait until the time indicated.
+    
+    A signal could end the wait before, so it goes on until the time is 
+    reached.
+    
+    Args:
+        wait_time: Time to wait for in seconds since the epoch.
+        stop_event: Optional threading.Event to stop waiting.
+    """
+    
+    remaining = wait_time - time.time()
+    
+    while remaining > 0 and (stop_event is None or not stop_event.is_set()):
+        if stop_event is not None:
+            stop_event.wait(remaining)
+        else:
+            time.sleep(remaining)
+            
+        remaining = wait_time - time.time()
+
+def night_wait(scheduler, now):
+    """Returns the dusk to wait for if it is daytime, None if it is night or
+    there isn't a night in the next days.
+    
+    Args:
+        scheduler: Scheduler of the nights at the site.
+        now: Time in seconds since the epoch.
+    """
+    
+    dusk = scheduler.next_dusk(now)
+    
+    if dusk is None:
+        logging.warning("No night in the next days, measuring anyway.")
+    elif dusk <= now:
+        dusk = None
+        
+    return dusk
+
+def night_wait_message(scheduler, dusk):
+    """Returns the message of the wait until the dusk."""
+    
+    return "Daytime, waiting until the %s dusk at %s" % \
+        (scheduler.twilight.lower(), 
+         time.strftime("%d-%m-%Y %H:%M:%S", time.localtime(dusk)))
+
+def wait_for_night(scheduler, end_time, output_file, stop_event=None,
+                   console=DEFAULT_CONSOLE):
+    """Wait until the next dusk if it is daytime.
+    
+    Args:
+        scheduler: Scheduler of the nights at the site.
+        end_time: Time to stop waiting in any case.
+        output_file: Object to write output messages.
+        stop_event: Optional threading.Event to stop waiting.
+        console: Console to show the wait.
+        
+    Returns:
+        True if it has waited.
+    """
+    
+    dusk = night_wait(scheduler, time.time())
+    
+    if dusk is not None:
+        msg = night_wait_message(scheduler, dusk)
+        
+        logging.info(msg)
+        console.message(msg)
+        output_file.write_com(msg)
+        
+        wait_until(min(dusk, end_time), stop_event)
+    
+    return dusk is not None
+
+def continuous_parameters(sqm_config, cadence=None):
+    """Returns the periodicity, duration and burst of the continuous
+    measures configured.
+    
+    Args:
+        sqm_config: Configuration parameters.
+        cadence: Optional adaptive cadence whose bounds are set again from
+            the configuration, after reloading it.
+    """
+    
+    periodicity = float(sqm_config.periodicity)
+    
+    if cadence is not None:
+        cadence.set_bounds(periodicity, sqm_config.max_periodicity,
+                           sqm_config.adaptive_step)
+    
+    return periodicity, float(sqm_config.duration), sqm_config.burst
+
+def write_continuous_header(output_file, sqm_config, scheduler=None,
+                            cadence=None):
+    """Write the parameters of the continuous measures and the fields
+    written after each measure.
+    
+    Args:
+        output_file: Object to write output messages.
+        sqm_config: Configuration parameters.
+        scheduler: Optional scheduler of the nights.
+        cadence: Optional adaptive cadence.
+    """
+    
+    output_file.write_com(sqm_config.str_continuous_par())
+    
+    fields = []
+    
+    if scheduler is not None:
+        fields.append("altitude of the Sun and altitude of the Moon in "
+                      "degrees")
+        
+    if cadence is not None:
+        fields.append("period to the next measure in seconds")
+        
+    if len(fields) > 0:
+        output_file.write_com("Fields after the measure: %s." % 
+                              ", ".join(fields))
+
+def reading_fields(scheduler, measure_time, measure):
+    """Returns the fields written after a measure, the altitudes of the Sun
+    and the Moon if there is a scheduler of the nights.
+    
+    Args:
+        scheduler: Scheduler of the nights, or None.
+        measure_time: Time of the measure in seconds since the epoch.
+        measure: Value measured, None if there isn't.
+    """
+    
+    extra_fields = []
+    
+    if measure is not None and scheduler is not None:
+        extra_fields = [ "%.2f" % a for a in 
+                         scheduler.altitudes(measure_time) ]
+        
+    return extra_fields
 
-def continuous_measures(ser, sqm_config, output_filename):
+def update_cadence(cadence, readings):
+    """Update the cadence once per period with the burst measured, the 
+    interval is added to the fields of its last measure.
+    
+    Args:
+        cadence: Adaptive cadence, or None.
+        readings: List of the readings of the burst as tuples of time, 
+            measure, temperature and list of extra fields.
+    """
+    
+    valid = [ r for r in readings if r[1] is not None ]
+    
+    if cadence is not None and len(valid) > 0:
+        from adaptive import burst_value
+        
+        interval = cadence.update(valid[0][0], 
+                                  burst_value([ r[1] for r in valid ]))
+        
+        valid[-1][3].append("%.2f" % interval)
+
+def process_burst(readings, output_file, sinks, console=DEFAULT_CONSOLE):
+    """Save the readings of a burst, the measures not taken as gaps.
+    
+    Args:
+        readings: List of the readings of the burst as tuples of time, 
+            measure, temperature and list of extra fields.
+        output_file: Object to write output messages.
+        sinks: Objects that also receive each measure.
+        console: Console to show the measures.
+    """
+    
+    for measure_time, measure, temperature, extra_fields in readings:
+        if measure is None:
+            process_continuous_gap(measure_time, output_file, console)
+        else:
+            process_continuous_measure(measure, output_file, measure_time, 
+                                       console, extra_fields or None)
+            
+            for sink in sinks:
+                sink.add_reading(measure_time, measure, temperature)
+
+def next_period(next_time, periodicity, cadence=None):
+    """Returns the time of the next period of the continuous measures.
+    
+    If the measures have taken longer than the period, the periods lost are
+    skipped to keep the cadence.
+    
+    Args:
+        next_time: Time of the current period.
+        periodicity: Seconds between periods.
+        cadence: Optional adaptive cadence, its interval is used instead of
+            the periodicity.
+    """
+    
+    period = periodicity if cadence is None else cadence.interval
+    
+    next_time += period
+    
+    now = time.time()
+    
+    if next_time < now:
+        periods_lost = int((now - next_time) / period) + 1
+        
+        next_time += periods_lost * period
+        
+        logging.warning("Measures overrun the periodicity, %d "
+                        "periods skipped." % periods_lost)
+        
+    return next_time
+
+def continuous_measures(ser, sqm_config, output_filename, watcher=None,
+                        sinks=None, stop_event=None, console=DEFAULT_CONSOLE,
+                        scheduler=None, cadence=None):
     """ Perform the continuous measures.
     
+    Each period a burst of measures is taken back to back, the periods are
+    scheduled from the start time so the time spent measuring doesn't delay
+    the following measures.
+    
     Args:
         ser: Serial object used to communicate with SQM. 
         sqm_config: Configuration parameters.
         output_filename: Object to write output messages.
+        watcher: Optional watcher to reload the configuration between measures.
+        sinks: Optional objects that also receive each measure through their
+            add_reading(timestamp, measure, temperature) method.
+        stop_event: Optional threading.Event to stop the measures.
+        console: Console to show the measures.
+        scheduler: Optional scheduler of the nights, to measure only at 
+            night writing the altitudes of the Sun and the Moon after each 
+            measure.
+        cadence: Optional adaptive cadence to choose the period after each
+            measure, written after the measure, instead of the periodicity.
     """
     
     logging.debug("Starting continuous measures.")
     
     output_file = OutputFile(output_filename)     
     
-    output_file.write_com(sqm_config.str_continuous_par())
+    write_continuous_header(output_file, sqm_config, scheduler, cadence)
+    
+    if sinks is None:
+        sinks = []
     
-    running_time = 0
+    periodicity, duration, burst = continuous_parameters(sqm_config)
     
-    periodicity = int(sqm_config.periodicity)
+    start_time = time.time()
     
-    duration = int(sqm_config.duration)
+    next_time = start_time
     
     # Check if a key has been pressed to exit.
     try:
-        while running_time < duration:
+        while next_time - start_time < duration and \
+            (stop_event is None or not stop_event.is_set()):
             
-            # Get a measure from SQM.
-            measure = ser.get_sqm_measure()
-                        
-            # Process measure.
-            process_continuous_measure(measure, output_file)
+            # During the day the measures restart at dusk.
+            if scheduler is not None and \
+                wait_for_night(scheduler, start_time + duration, output_file,
+                               stop_event, console):
+                next_time = time.time()
+                
+                if cadence is not None:
+                    cadence.reset()
+                
+                continue
+            
+            readings = []
+            
+            for i in range(burst):
+                
+                # The time of the measure is when it is requested.
+                measure_time = time.time()
+                
+                # Get a measure from SQM.
+                measure = ser.get_sqm_measure()
+                
+                readings.append((measure_time, measure, ser.last_temperature,
+                                 reading_fields(scheduler, measure_time, 
+                                                measure)))
+                
+            update_cadence(cadence, readings)
+            
+            process_burst(readings, output_file, sinks, console)
+            
+            # Apply any configuration change before the next measure.
+            if watcher is not None and watcher.check(output_file):
+                periodicity, duration, burst = \
+                    continuous_parameters(sqm_config, cadence)
+                    
+            next_time = next_period(next_time, periodicity, cadence)
                     
             # Wait the time indicated between measures.
-            for i in range(periodicity):                                    
-                time.sleep(1)
-                
-                running_time += 1                    
+            wait_until(next_time, stop_event)
                     
     # To catch a Ctrl-C.
     except KeyboardInterrupt:
         logging.debug("Exiting from continuous measures loop by Ctrl-C.")   
         
-def one_measures(ser, sqm_config):
+def process_one_measure(measure, measure_time, temperature, sinks,
+                        console=DEFAULT_CONSOLE):
+    """Show an independent measure and pass it to the sinks.
+    
+    Args:
+        measure: Value measured, None if there isn't.
+        measure_time: Time of the measure in seconds since the epoch.
+        temperature: Temperature of the SQM.
+        sinks: Objects that also receive each measure.
+        console: Console to show the measure.
+    """
+    
+    if measure is None:
+        console.show_gap("No valid value measured.")
+    else:
+        console.show_measure("Value measured: %s" % measure, measure)
+        
+        for sink in sinks:
+            sink.add_reading(measure_time, measure, temperature)
+
+def one_measures(ser, sqm_config, watcher=None, console=DEFAULT_CONSOLE,
+                 sinks=None):
     """ Perform the continuous measures.
     
     Args:
         ser: Serial object used to communicate with SQM. 
         sqm_config: Configuration parameters.
+        watcher: Optional watcher to reload the configuration between measures.
+        console: Console to show the measures.
+        sinks: Optional objects that also receive each measure through their
+            add_reading(timestamp, measure, temperature) method.
     """
     
+    if sinks is None:
+        sinks = []
+    
     exit = False
     
     logging.debug("Starting independent measures.")   
     
     # Use the periodicity parameter to wait bwtween measures.
-    periodicity = int(sqm_config.periodicity) 
+    periodicity = float(sqm_config.periodicity) 
     
     while not exit:
     
@@ -130,57 +451,340 @@ def one_measures(ser, sqm_config):
         try:       
             
             # Wait the time indicated between measures.
-            for i in range(periodicity):
-                print "Waiting %d seconds before measuring ..." % \
-                    (periodicity - i)
-                    
-                if i == periodicity - 1:
-                    start_sound(sqm_config)
-                                                    
-                time.sleep(1)
+            console.countdown(periodicity, 
+                              "Waiting %d seconds before measuring ...",
+                              lambda: start_sound(sqm_config))
+            
+            measure_time = time.time()
             
             measure = ser.get_sqm_measure()
             
             end_sound(sqm_config)
             
-            print "Value measured: %s" % measure
+            process_one_measure(measure, measure_time, ser.last_temperature,
+                                sinks, console)
+            
+            # Apply any configuration change before the next measure, 
+            # without an output file the reloads are shown.
+            if watcher is not None and watcher.check(console=console):
+                periodicity = float(sqm_config.periodicity)
                              
         # To catch a Ctrl-C.
         except KeyboardInterrupt:
             exit = True
             msg = "Exiting from independent measures by Ctrl-C."
-            print msg
+            console.message(msg)
             logging.debug(msg)   
         
-def sqm_measures(progargs, sqm_config):
-    """Call the methods to perform the measures required.
+def create_console(progargs, sqm_config, readings=None):
+    """Returns the console to show the measures indicated by the arguments.
     
     Args:
         progargs: Program arguments.
         sqm_config: Configuration parameters.
+        readings: Ring buffer with the recent readings, if any.
     """
     
+    console = DEFAULT_CONSOLE
+    
+    if progargs.dashboard:
+        from dashboard import Dashboard
+        
+        # With the adaptive cadence there isn't a period expected.
+        console = Dashboard(readings, float(sqm_config.periodicity) 
+                            if sqm_config.mode_continuous and 
+                            not sqm_config.cadence_adaptive else None)
+        
+    return console
+
+def create_sinks(progargs, readings=None):
+    """Returns the objects that receive the measures besides the output file.
+    
+    Args:
+        progargs: Program arguments.
+        readings: Ring buffer with the recent readings, if any.
+    """
+    
+    sinks = []
+    
+    if readings is not None:
+        sinks.append(readings)
+    
+    if progargs.shm_path is not None:
+        from shmpub import SharedReadingsPublisher, SharedMemoryException
+        
+        # The measures are taken even if they can't be published.
+        try:
+            sinks.append(SharedReadingsPublisher(progargs.shm_path))
+        except SharedMemoryException as sme:
+            logging.error(sme)
+            print sme
+            
+    if progargs.rollup_dir is not None:
+        from rollup import RollupSink
+        
+        sinks.append(RollupSink(progargs.rollup_dir))
+        
+    if progargs.memory_interval is not None:
+        from memdiag import MemoryMonitor
+        
+        sinks.append(MemoryMonitor(progargs.memory_interval))
+    
+    return sinks
+
+def close_sinks(sinks):
+    """Close the sinks that need it."""
+    
+    for sink in sinks:
+        if hasattr(sink, "close"):
+            sink.close()
+
+def replay_measures(progargs, sqm_config):
+    """Replay the measures of the output file indicated in the arguments.
+    
+    Args:
+        progargs: Program arguments.
+        sqm_config: Configuration parameters.
+    """
+    
+    from replay import replay
+    from ringbuffer import ReadingsRingBuffer, DEFAULT_CAPACITY
+    
+    readings = ReadingsRingBuffer(DEFAULT_CAPACITY)
+    
+    console = create_console(progargs, sqm_config, readings)
+    
+    sinks = create_sinks(progargs, readings)
+    
+    console.start()
+    
+    try:
+        replay(progargs.replay_file, progargs.replay_speed, sinks, console)
+    except OutputFileException as ofe:
+        logging.error(ofe)
+        print ofe
+    except KeyboardInterrupt:
+        logging.debug("Exiting from replay by Ctrl-C.")
+    finally:
+        console.stop()
+        close_sinks(sinks)
+
+def save_plot(sqm_config, readings=None, all_sky_values=None):
+    """Save the plot of the measures taken.
+    
+    Args:
+        sqm_config: Configuration parameters.
+        readings: Ring buffer with the continuous measures, if any.
+        all_sky_values: All sky measures, if any.
+    """
+    
+    from plots import PlotRenderer, session_plot_name
+    
+    renderer = PlotRenderer(sqm_config.plot_color_extended)
+    
+    if readings is not None and len(readings) > 0:
+        times, magnitudes, temperatures = readings.last(len(readings))
+        
+        file_name = session_plot_name(DEFAULT_CONT_OUT_FILE_NAME)
+        
+        renderer.continuous(times, magnitudes, file_name, 
+                            sqm_config.str_continuous_par())
+        
+        print "Plot saved to: %s" % file_name
+    
+    if all_sky_values is not None:
+        from allsky import AZIMUTH_VALUES, VERTICAL_VALUES
+        
+        file_name = session_plot_name(DEFAULT_SKY_OUT_FILE_NAME)
+        
+        renderer.all_sky(AZIMUTH_VALUES, VERTICAL_VALUES, 
+                         all_sky_values.values_by_vertical(), 
+                         all_sky_values.zenith, file_name, sqm_config.info)
+        
+        print "Plot saved to: %s" % file_name
+    
+    renderer.close()
+
+def save_export(sqm_config, all_sky_values):
+    """Save the all sky measures taken to a FITS file, with the number of 
+    readings of each position and their deviation.
+    
+    Args:
+        sqm_config: Configuration parameters.
+        all_sky_values: All sky measures.
+    """
+    
+    from export import export_all_sky, session_export_name
+    
+    file_name = session_export_name(DEFAULT_SKY_OUT_FILE_NAME)
+    
     try:
-        ser = SerialPort()
+        export_all_sky(all_sky_values, file_name, sqm_config.info)
+        
+        print "Measures exported to: %s" % file_name
+    except OutputFileException as ofe:
+        logging.error(ofe)
+        print ofe
+
+def create_archive(progargs):
+    """Returns the archive of the raw replies indicated in the arguments, 
+    None if they aren't archived.
+    
+    Args:
+        progargs: Program arguments.
+    """
+    
+    archive = None
+    
+    if progargs.raw_archive is not None:
+        from rawarchive import RawArchiveWriter
         
-        ser.init_port()
+        archive = RawArchiveWriter(progargs.raw_archive)
         
-        if sqm_config.mode_continuous:
-            continuous_measures(ser, sqm_config, DEFAULT_CONT_OUT_FILE_NAME)
+    return archive
+
+def open_port(sqm_config, device_path=None):
+    """Returns the serial port of a SQM, opened to keep it open while 
+    measuring.
+    
+    Args:
+        sqm_config: Configuration parameters.
+        device_path: Path of the device, detected if it is None.
+    """
+    
+    ser = SerialPort(device_path)
+    
+    ser.init_port()
+    
+    ser.open()
+    
+    ser.set_retry_policy(sqm_config.retries, sqm_config.latency_budget)
+    
+    return ser
+
+def open_rig(sqm_config):
+    """Returns the serial ports of the SQMs of the rig configured, in the
+    order of the rig, None if there isn't a rig.
+    
+    Args:
+        sqm_config: Configuration parameters.
+    """
+    
+    rig_ports = None
+    
+    if sqm_config.mode_all_sky and len(sqm_config.rig) > 1:
+        rig_ports = [ open_port(sqm_config, device) 
+                     for device, az, vert in sqm_config.rig ]
+        
+        logging.info("Rig of %d SQMs: %s" % 
+                     (len(rig_ports), [ p.device for p in rig_ports ]))
+        
+    return rig_ports
+
+def run_measures(progargs, sqm_config, ser, rig_ports=None, stop_event=None):
+    """Perform the measures of the mode configured with the devices already
+    opened.
+    
+    Args:
+        progargs: Program arguments.
+        sqm_config: Configuration parameters.
+        ser: Serial object used to communicate with SQM.
+        rig_ports: Serial objects of the SQMs of the rig, if any.
+        stop_event: Optional threading.Event to stop the continuous measures.
+    """
+    
+    # Reload the configuration file if it changes while measuring.
+    watcher = ConfigWatcher(sqm_config)
+    
+    readings = None
+    
+    if sqm_config.mode_continuous:
+        from ringbuffer import ReadingsRingBuffer, DEFAULT_CAPACITY
+        
+        # Recent readings kept in memory.
+        readings = ReadingsRingBuffer(DEFAULT_CAPACITY)
+    
+    console = create_console(progargs, sqm_config, readings)
+    
+    sinks = create_sinks(progargs, readings)
+    
+    all_sky_values = None
+        
+    console.start()
+    
+    try:
+        if progargs.cooperative:
+            # The modes as tasks of one loop, with workers for the calls
+            # that block.
+            from runtime import run_mode
+            
+            all_sky_values = run_mode(ser, sqm_config, console, sinks, 
+                                      watcher, rig_ports)
+        elif sqm_config.mode_continuous:
+            from nightsched import create_scheduler
+            from adaptive import create_cadence
+            
+            continuous_measures(ser, sqm_config, 
+                                DEFAULT_CONT_OUT_FILE_NAME, watcher, 
+                                sinks, stop_event, console, 
+                                create_scheduler(sqm_config),
+                                create_cadence(sqm_config))
         elif sqm_config.mode_all_sky:
-            all_sky_measures(ser, sqm_config, DEFAULT_SKY_OUT_FILE_NAME)
+            from allsky import all_sky_measures
+            
+            all_sky_values = all_sky_measures(ser, sqm_config, 
+                                              DEFAULT_SKY_OUT_FILE_NAME,
+                                              watcher, console, rig_ports)
         elif sqm_config.mode_one:
-            one_measures(ser, sqm_config)
+            one_measures(ser, sqm_config, watcher, console, sinks)
         else:
             msg = "The mode specified is not recognized."
             logging.warning(msg)
             print msg
+    finally:
+        console.stop()
+        close_sinks(sinks)
+        
+    if progargs.store_plot:
+        save_plot(sqm_config, readings, all_sky_values)
+        
+    if progargs.export_fits and all_sky_values is not None:
+        save_export(sqm_config, all_sky_values)
+
+def sqm_measures(progargs, sqm_config):
+    """Call the methods to perform the measures required.
+    
+    Args:
+        progargs: Program arguments.
+        sqm_config: Configuration parameters.
+    """
+    
+    archive = None
+    
+    try:
+        rig_ports = open_rig(sqm_config)
+        
+        # Keep the device open while measuring.
+        if rig_ports is None:
+            ser = open_port(sqm_config)
+        else:
+            ser = rig_ports[0]
+            
+        archive = create_archive(progargs)
+        
+        for port in rig_ports or [ ser ]:
+            port.set_archive(archive)
+        
+        run_measures(progargs, sqm_config, ser, rig_ports)
             
     except SerialPortException as spe:
          logging.error(spe) 
          print spe
     except OutputFileException as ofe:
-        logging.error(ofe)        
+        logging.error(ofe)
+    finally:
+        if archive is not None:
+            archive.close()
 
 def main(progargs):
     """Main function.
@@ -198,6 +802,23 @@ def main(progargs):
         # Initializes logging.
         init_log(progargs)
         
+        if progargs.startup_report:
+            sqm_config = SQMControlCfg(progargs.config_file_name)
+            
+            import startup
+            
+            startup.print_startup_report(sqm_config.mode)
+            
+            return
+        
+        if progargs.job_file is not None:
+            # Run the jobs of the file keeping the SQM open between them.
+            from jobqueue import JobQueue
+            
+            JobQueue(progargs.job_file).run(progargs)
+            
+            return
+        
         logging.debug("Reading configuration file.")
         
         # Read configuration file. 
@@ -206,13 +827,33 @@ def main(progargs):
         # Show information about mode and its parameters.
         print sqm_config.get_info()
         
-        # Perform the measures.
-        sqm_measures(progargs, sqm_config)
+        if progargs.daemon_socket is not None:
+            # Keep the SQM open to perform the measures requested by clients.
+            from daemon import SQMDaemon
+            
+            SQMDaemon(sqm_config, progargs.daemon_socket, 
+                      progargs.shm_path, progargs.rollup_dir,
+                      progargs.raw_archive, 
+                      progargs.memory_interval).serve()
+        elif progargs.replay_file is not None:
+            # Process the measures of a file instead of the SQM.
+            replay_measures(progargs, sqm_config)
+        else:
+            # Perform the measures.
+            sqm_measures(progargs, sqm_config)
         
         logging.debug("Program finished.")
 
     except SQMControlException as sce:
         print sce
+        
+    except JobQueueException as jqe:
+        logging.error(jqe)
+        print jqe
+
+    except SerialPortException as spe:
+        logging.error(spe)
+        print spe
 
     except Exception as e:
         # To catch any other Exception.
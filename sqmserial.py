@@ -19,8 +19,11 @@
 
 """This module performs the communication with SQL using a serial USB. """
 
+import time
 import logging
-import serial
+
+from sqmtransport import SerialTransport, TransportMultiplexer, \
+    TransportException
 
 class SerialPortException(Exception):
     
@@ -33,6 +36,7 @@ class SerialPortException(Exception):
         return self._msg
 
 class SerialPort(object):
+    """Access to the SQM, a thin wrapper over the serial transport."""
     
     SERIAL_DEVICES_UNIX = ["/dev/ttyUSB0", "/dev/ttyUSB1", \
                            "/dev/ttyUSB2", "/dev/ttyUSB3"]
@@ -43,93 +47,117 @@ class SerialPort(object):
     
     BAUD_RATE = 115200
     
-    DATA_BITS = serial.EIGHTBITS  
+    # Maximum time in seconds to wait for the reply of a request.
+    REQUEST_TIMEOUT = 0.5
+    
+    SQM_READ_COMMAND = "rx\r"
+    
+    # Default retry policy, times a request is repeated if the reply is not
+    # valid and the maximum time in seconds to get a valid reply.
+    RETRIES = 3
+    LATENCY_BUDGET = 2.0
     
-    STOP_BITS = serial.STOPBITS_ONE
+    # Initial time in seconds to wait before a retry, doubled each retry.
+    RETRY_BACKOFF = 0.05
     
-    PARITY = serial.PARITY_NONE
+    # Outcomes of the attempts to get a measure.
+    ATTEMPT_OK = "ok"
+    ATTEMPT_TIMEOUT = "timeout"
+    ATTEMPT_GARBLED = "garbled"
+    ATTEMPT_ERROR = "error"
     
-    READ_TIMEOUT = 1
+    SQM_REPLY_PREFIX = "r"
     
-    MAX_BYTES_TO_READ = 255 
+    SQM_MEASURE_UNIT = "m"
+    
+    SQM_TEMPERATURE_UNIT = "C"
     
     SQM_DATA_SEP = ","
     
     MEASURE_POS = 1
     
-    def __init__(self):
+    TEMPERATURE_POS = 5
+    
+    def __init__(self, device_path=None):
+        """Initializes the port.
         
-        self._ser = serial.Serial()
+        Args:
+            device_path: Path of the device to use, if not provided the 
+                device is detected among the serial USB devices.
+        """
+        
+        self._device_path = device_path
+        self._transport = None
         self._device = None
+        self._retries = SerialPort.RETRIES
+        self._latency_budget = SerialPort.LATENCY_BUDGET
+        self._attempts = []
+        self._attempt_counts = {}
+        self._temperature = None
+        self._archive = None
+        self._kept_open = False
         
     def __del__(self):
         
-        if self._ser.isOpen():
-            self._ser.close()
-        
-    def _setup_port(self, port):
-        
-        success = False
-        
-        self._ser.port = SerialPort.SERIAL_DEVICES_UNIX[port]
-        self._ser.baudrate = SerialPort.BAUD_RATE
-        self._ser.bytesize = SerialPort.DATA_BITS
-        self._ser.stopbits = SerialPort.STOP_BITS
-        self._ser.parity = SerialPort.PARITY 
-        self._ser.timeout = SerialPort.READ_TIMEOUT 
-        
-        self._ser.open()
-        
-        if self._ser.isOpen():
-            success = True
-            
-        self._ser.close()
-            
-        return success        
+        self.close()
         
     def _detect_port(self):
         
         found = False
         
+        if self._device_path is not None:
+            devices = [ self._device_path ]
+        else:
+            devices = [ SerialPort.SERIAL_DEVICES_UNIX[sd] 
+                       for sd in SerialPort.SERIAL_DEVICES ]
+        
         # Try all the devices available in order.
-        for sd in SerialPort.SERIAL_DEVICES:
+        for device in devices:
             
-            logging.debug("Trying device %d ..." % sd)
-            try:
+            logging.debug("Trying device %s ..." % device)
             
-                if self._setup_port(sd):
-                    
-                    self._ser.open()
+            transport = SerialTransport(device, SerialPort.BAUD_RATE)
+            
+            try:
+                transport.open()
                 
-                    br = self._get_measure()
-                    
-                    self._ser.close()
+                br = transport.request(SerialPort.SQM_READ_COMMAND, 
+                                       SerialPort.REQUEST_TIMEOUT)
+                
+                transport.close()
                     
-                    # Check if there was a successful reading of data.
-                    if len(br) > 0:
-                        self._device = sd
-                        found = True
-                        break
+                # Check if there was a successful reading of data.
+                if br is not None and len(br) > 0:
+                    self._transport = transport
+                    self._device = device
+                    found = True
+                    break
                     
-            except serial.SerialException as se:
-                logging.error(se)
-            except serial.SerialTimeoutException as ste:
-                logging.error(ste)
+            except TransportException as te:
+                logging.error(te)
             
         return found
         
-    def _get_measure(self):
-        """Get a measure from SQM."""
+    def _get_measure(self, timeout=REQUEST_TIMEOUT):
+        """Get a measure from SQM.
+        
+        Args:
+            timeout: Maximum time in seconds to wait for the reply.
+        
+        Returns:
+            The reply of the SQM, empty if there is no reply.
+        """
         
         bytes_read = None
         
-        if self._ser.isOpen():
+        if self._transport is not None and self._transport.is_open():
             
-            # Send request to SQM.
-            self._ser.write("rx\r")
+            # Send request to SQM and read its reply.
+            bytes_read = self._transport.request(SerialPort.SQM_READ_COMMAND,
+                                                 timeout)
             
-            # Read from SQM.
-            bytes_read = self._ser.readline(SerialPort.MAX_BYTES_TO_READ)
+            if bytes_read is None:
+                bytes_read = ""
             
             logging.debug("SQM Read: %s" % bytes_read.strip())
         else:
@@ -162,27 +190,387 @@ class SerialPort(object):
             
             raise SerialPortException(msg)        
         
-    def get_sqm_measure(self):
-        """Returns a measure taken by the SQM."""
+    def open(self):
+        """Keep the port open between measures."""
         
-        measure = None
+        if self._transport is None:
+            raise SerialPortException("Device not initialized.")
         
-        self._ser.open()
-                
-        sqm_measure = self._get_measure()
+        try:
+            self._transport.open()
+        except TransportException as te:
+            raise SerialPortException(str(te))
+        
+        self._kept_open = True
+            
+    def close(self):
+        """Close the port opened to keep it open between measures."""
+        
+        self._kept_open = False
+        
+        if self._transport is not None:
+            self._transport.close()
+            
+    def ensure_open(self):
+        """Open the transport if an error has closed it.
+        
+        Raises:
+            TransportException if the device can't be opened.
+        """
+        
+        if not self._transport.is_open():
+            self._transport.open()
+        
+    @property
+    def device(self):
+        return self._device
+    
+    @property
+    def transport(self):
+        return self._transport
+    
+    @property
+    def last_temperature(self):
+        """Temperature in Celsius reported with the last measure, or None."""
+        return self._temperature
+    
+    @property
+    def last_attempts(self):
+        """List of (outcome, elapsed seconds) of the attempts of the last
+        measure."""
+        return self._attempts
+    
+    @property
+    def attempt_counts(self):
+        """Dictionary with the number of attempts of each outcome."""
+        return self._attempt_counts
+    
+    def set_archive(self, archive):
+        """Keep every reply received, valid or not, in an archive.
+        
+        Args:
+            archive: Object with a method add(request_time, reply_time, 
+                device, reply), None to stop archiving.
+        """
+        
+        self._archive = archive
+        
+    def set_retry_policy(self, retries, latency_budget):
+        """Set the retries and latency budget to get each measure.
+        
+        Args:
+            retries: Times a request is repeated if the reply is not valid.
+            latency_budget: Maximum time in seconds to get a valid reply.
+        """
+        
+        self._retries = retries
+        self._latency_budget = latency_budget
+        
+    def _get_measure_value(self, sqm_measure):
+        """Returns the value of the measure from the reply of the SQM, or 
+        None if the reply is not valid.
+        
+        Args:
+            sqm_measure: Reply of the SQM.
+        """
         
-        self._ser.close()        
+        only_num_value = None
         
         parsed_data = self._parse_sqm_data(sqm_measure)
         
-        if len(parsed_data) > SerialPort.MEASURE_POS:
+        if len(parsed_data) > SerialPort.MEASURE_POS and \
+            parsed_data[0] == SerialPort.SQM_REPLY_PREFIX:
+            
             measure_value = parsed_data[SerialPort.MEASURE_POS] 
         
-        # Remove the final character used for the unit.
-        only_num_value = measure_value[:-1]
+            # Remove the final character used for the unit.
+            if measure_value.endswith(SerialPort.SQM_MEASURE_UNIT):
+                only_num_value = measure_value[:-1]
+                
+                try:
+                    float(only_num_value)
+                    
+                    logging.debug("Value read: %s, unit removed: %s" % 
+                                  (measure_value, only_num_value))
+                except ValueError:
+                    only_num_value = None
+                    
+        if only_num_value is not None and \
+            len(parsed_data) > SerialPort.TEMPERATURE_POS:
             
-        logging.debug("Value read: %s, unit removed: %s" % 
-                      (measure_value, only_num_value))
+            self._temperature = self._get_temperature_value(
+                parsed_data[SerialPort.TEMPERATURE_POS])
         
         return only_num_value
+    
+    def _get_temperature_value(self, temperature_value):
+        """Returns the temperature from its value in the reply of the SQM, or
+        None if it is not valid.
+        
+        Args:
+            temperature_value: Temperature with its unit.
+        """
+        
+        temperature = None
+        
+        if temperature_value.endswith(SerialPort.SQM_TEMPERATURE_UNIT):
+            try:
+                temperature = float(temperature_value[:-1])
+            except ValueError:
+                logging.debug("Invalid temperature: %s" % temperature_value)
+        
+        return temperature
+    
+    def _record_attempt(self, outcome, elapsed):
+        
+        self._attempts.append((outcome, elapsed))
+        
+        self._attempt_counts[outcome] = \
+            self._attempt_counts.get(outcome, 0) + 1
+        
+        logging.debug("Attempt %d: %s in %.3f s" % 
+                      (len(self._attempts), outcome, elapsed))
+        
+    def get_sqm_measure(self):
+        """Returns a measure taken by the SQM.
+        
+        The request is repeated, with a short backoff, while the reply is not
+        valid up to the retries and latency budget set.
+        
+        Returns:
+            The value measured or None if a valid value couldn't be read 
+            within the latency budget, a gap in the measures.
+        """
+        
+        measure = None
+        
+        start_time = time.time()
+        deadline = self.begin_measure()
+        backoff = SerialPort.RETRY_BACKOFF
+        
+        if self._transport is None:
+            raise SerialPortException("Device not initialized.")
+        
+        # The port is only opened and closed here if it isn't kept open.
+        keep_open = self._kept_open
+                
+        try:
+            while measure is None and self.retry_allowed(deadline):
+                
+                if len(self._attempts) > 0:
+                    time.sleep(min(backoff, max(0, deadline - time.time())))
+                    backoff *= 2
+                
+                attempt_start = time.time()
+                
+                try:
+                    self.ensure_open()
+                    
+                    sqm_measure = self._get_measure(
+                        min(SerialPort.REQUEST_TIMEOUT, 
+                            deadline - attempt_start))
+                    
+                    measure = self.process_reply(sqm_measure, 
+                                                 time.time() - attempt_start)
+                except TransportException as te:
+                    self.process_error(te, time.time() - attempt_start)
+        finally:
+            if not keep_open:
+                self._transport.close()
+                
+        if measure is None:
+            self.log_gap(time.time() - start_time)
+        
+        return measure
+    
+    def begin_measure(self):
+        """Forget the attempts of the previous measure to start a new one.
+        
+        Returns:
+            The deadline to get a valid reply in seconds since the epoch.
+        """
+        
+        self._attempts = []
+        self._temperature = None
+        
+        return time.time() + self._latency_budget
+    
+    def retry_allowed(self, deadline):
+        """Returns True if the measure started can be requested again, by 
+        the retries and the deadline of the retry policy.
+        """
+        
+        return len(self._attempts) <= self._retries and time.time() < deadline
+    
+    def process_reply(self, sqm_measure, elapsed, archive=True):
+        """Returns the value of the reply to an attempt, or None if it is not
+        valid, and records the outcome of the attempt.
+        
+        Args:
+            sqm_measure: Reply of the SQM, empty if there is no reply.
+            elapsed: Time in seconds of the attempt.
+            archive: Add the reply to the archive, False if the caller 
+                archives it with archive_reply.
+        """
+        
+        measure = None
+        
+        if archive:
+            self.archive_reply(sqm_measure, elapsed)
+        
+        if len(sqm_measure) == 0:
+            outcome = SerialPort.ATTEMPT_TIMEOUT
+        else:
+            measure = self._get_measure_value(sqm_measure)
+            
+            if measure is None:
+                outcome = SerialPort.ATTEMPT_GARBLED
+            else:
+                outcome = SerialPort.ATTEMPT_OK
+            
+        self._record_attempt(outcome, elapsed)
+        
+        return measure
+    
+    def archive_reply(self, sqm_measure, elapsed, reply_time=None):
+        """Add a reply to the archive, if there is one.
+        
+        Args:
+            sqm_measure: Reply of the SQM, empty if there is no reply.
+            elapsed: Time in seconds of the attempt.
+            reply_time: Time of the reply, the current time if None.
+        """
+        
+        if self._archive is not None:
+            if reply_time is None:
+                reply_time = time.time()
+            
+            self._archive.add(reply_time - elapsed, reply_time, self._device,
+                              sqm_measure)
+    
+    def process_error(self, error, elapsed):
+        """Record an attempt failed by an error of the device and close the
+        transport, so it is opened again before the next attempt.
+        
+        Args:
+            error: TransportException raised.
+            elapsed: Time in seconds of the attempt.
+        """
+        
+        logging.warning("Error of %s: %s" % (self._device, error))
+        
+        self._transport.close()
+        
+        self._record_attempt(SerialPort.ATTEMPT_ERROR, elapsed)
+    
+    def log_gap(self, elapsed):
+        """Log a measure without a valid reply after the time elapsed."""
+        
+        logging.warning("No valid measure from %s in %.3f s after %d "
+                        "attempts: %s" %
+                        (self._device, elapsed, len(self._attempts),
+                         [ a[0] for a in self._attempts ]))
+        
+class SerialPortGroup(object):
+    """Several SQMs measuring at the same time, each request is sent to all
+    of them at once and their replies are waited for together.
+    """
+    
+    def __init__(self, ports):
+        """Initializes the group.
+        
+        Args:
+            ports: Serial ports of the SQMs, initialized and kept open. 
+                Those closed by an error are opened again before their next
+                attempt.
+        """
+        
+        self._ports = ports
+        
+    def __len__(self):
+        return len(self._ports)
+    
+    @property
+    def ports(self):
+        return list(self._ports)
+        
+    def get_sqm_measures(self):
+        """Returns a measure taken by each SQM at the same time.
+        
+        Each round of requests is sent only to the SQMs without a valid reply
+        yet, following the retry policy of each port.
+        
+        Returns:
+            A list with the value measured by each port, in the order of the 
+            ports, None for the gaps.
+        """
+        
+        measures = [ None ] * len(self._ports)
+        
+        start_time = time.time()
+        backoff = SerialPort.RETRY_BACKOFF
+        
+        for port in self._ports:
+            if port.transport is None:
+                raise SerialPortException("Device not initialized.")
+            
+        deadlines = [ port.begin_measure() for port in self._ports ]
+        
+        pending = range(len(self._ports))
+        
+        rounds = 0
+        
+        while len(pending) > 0:
+            
+            deadline = max([ deadlines[i] for i in pending ])
+            
+            if rounds > 0:
+                time.sleep(min(backoff, max(0, deadline - time.time())))
+                backoff *= 2
+            
+            attempt_start = time.time()
+            
+            errors = {}
+            
+            for i in pending:
+                try:
+                    self._ports[i].ensure_open()
+                except TransportException as te:
+                    errors[self._ports[i].transport] = te
+            
+            multiplexer = TransportMultiplexer([ self._ports[i].transport 
+                                               for i in pending 
+                                               if self._ports[i].transport 
+                                               not in errors ])
+            
+            replies = multiplexer.request_all(SerialPort.SQM_READ_COMMAND,
+                min(SerialPort.REQUEST_TIMEOUT, deadline - attempt_start),
+                errors)
+            
+            elapsed = time.time() - attempt_start
+            
+            rounds += 1
+            
+            for i in pending:
+                port = self._ports[i]
+                
+                if port.transport in errors:
+                    port.process_error(errors[port.transport], elapsed)
+                    continue
+                
+                sqm_measure = replies[port.transport]
+                
+                logging.debug("SQM Read from %s: %s" % 
+                              (port.device, (sqm_measure or "").strip()))
+                
+                measures[i] = port.process_reply(sqm_measure or "", elapsed)
+            
+            pending = [ i for i in pending if measures[i] is None and 
+                       self._ports[i].retry_allowed(deadlines[i]) ]
+            
+        for i, port in enumerate(self._ports):
+            if measures[i] is None:
+                port.log_gap(time.time() - start_time)
+                
+        return measures
         
\ No newline at end of file
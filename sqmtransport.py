@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Non-blocking serial transport based on poll.
+
+The serial devices are opened as non-blocking file descriptors and the
+replies are split in lines by the transport itself, so a request only waits
+for its own deadline and several devices can be attended from one thread.
+"""
+
+import os
+import time
+import errno
+import select
+import logging
+import termios
+
+class TransportException(Exception):
+
+    def __init__(self, msg):
+
+        self._msg = msg
+
+    def __str__(self):
+
+        return self._msg
+
+def _poll(poller, deadline):
+    """Wait for the events of a poll object until the deadline, waiting
+    again for the time remaining if a signal interrupts it.
+
+    Returns:
+        The list of events, empty if the deadline has passed.
+    """
+
+    while True:
+        remaining = deadline - time.time()
+
+        if remaining <= 0:
+            return []
+
+        try:
+            return poller.poll(remaining * 1000)
+        except (select.error, OSError) as e:
+            if e.args[0] != errno.EINTR:
+                raise TransportException("Polling: %s" % (e,))
+
+class SerialTransport(object):
+    """A serial device accessed through a non-blocking file descriptor."""
+
+    LINE_END = "\n"
+
+    READ_SIZE = 4096
+
+    # Replies longer than this without an end of line are discarded.
+    MAX_LINE_LENGTH = 255
+
+    def __init__(self, device_path, baud_rate):
+        """Initializes the transport, the device is not opened.
+
+        Args:
+            device_path: Path of the serial device.
+            baud_rate: Speed of the serial line.
+        """
+
+        self._device_path = device_path
+        self._baud_rate = baud_rate
+        self._fd = None
+        self._buffer = ""
+        self._lines = []
+
+    def __del__(self):
+
+        self.close()
+
+    @property
+    def device_path(self):
+        return self._device_path
+
+    def fileno(self):
+        return self._fd
+
+    def is_open(self):
+        return self._fd is not None
+
+    def open(self):
+        """Open the device in raw mode, 8 data bits, no parity and one stop
+        bit.
+        """
+
+        if self._fd is None:
+            try:
+                self._fd = os.open(self._device_path,
+                                   os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+
+                self._configure()
+
+            except (OSError, termios.error) as e:
+                self.close()
+
+                raise TransportException("Opening device %s: %s" %
+                                         (self._device_path, e))
+
+            self._buffer = ""
+            self._lines = []
+
+    def close(self):
+
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError as oe:
+                logging.error(oe)
+
+            self._fd = None
+
+    def _configure(self):
+        """Set the line in raw mode with the speed of the transport."""
+
+        speed = getattr(termios, "B%d" % self._baud_rate)
+
+        iflag, oflag, cflag, lflag, ispeed, ospeed, cc = \
+            termios.tcgetattr(self._fd)
+
+        iflag = 0
+        oflag = 0
+        lflag = 0
+        cflag = termios.CS8 | termios.CREAD | termios.CLOCAL
+
+        # Reads return immediately with the bytes available.
+        cc[termios.VMIN] = 0
+        cc[termios.VTIME] = 0
+
+        termios.tcsetattr(self._fd, termios.TCSANOW,
+                          [ iflag, oflag, cflag, lflag, speed, speed, cc ])
+
+    def flush_input(self):
+        """Discard the bytes received not read yet."""
+
+        if self._fd is not None:
+            try:
+                termios.tcflush(self._fd, termios.TCIFLUSH)
+            except termios.error as te:
+                raise TransportException("Flushing %s: %s" %
+                                         (self._device_path, te))
+
+        self._buffer = ""
+        self._lines = []
+
+    def send(self, data, deadline):
+        """Write the data to the device.
+
+        Args:
+            data: String to write.
+            deadline: Time, in seconds since the epoch, to finish writing.
+
+        Returns:
+            True if all the data has been written before the deadline.
+        """
+
+        if self._fd is None:
+            raise TransportException("Device %s not open to send." %
+                                     self._device_path)
+
+        poller = select.poll()
+        poller.register(self._fd, select.POLLOUT)
+
+        data = self.write_available(data)
+
+        while len(data) > 0 and time.time() < deadline:
+            _poll(poller, deadline)
+
+            data = self.write_available(data)
+
+        return len(data) == 0
+
+    def write_available(self, data):
+        """Write the data the device accepts without blocking.
+
+        Args:
+            data: String to write.
+
+        Returns:
+            The data not written.
+        """
+
+        if self._fd is None:
+            raise TransportException("Device %s not open to send." %
+                                     self._device_path)
+
+        while len(data) > 0:
+            try:
+                data = data[os.write(self._fd, data):]
+            except OSError as oe:
+                if oe.errno == errno.EAGAIN:
+                    break
+
+                if oe.errno != errno.EINTR:
+                    raise TransportException("Writing to %s: %s" %
+                                             (self._device_path, oe))
+
+        return data
+
+    def on_readable(self):
+        """Read the bytes available and split them in lines. To be called
+        when poll indicates the device is readable.
+
+        Returns:
+            False if the device has been closed at the other end.
+        """
+
+        while True:
+            try:
+                data = os.read(self._fd, SerialTransport.READ_SIZE)
+                break
+            except OSError as oe:
+                if oe.errno == errno.EAGAIN:
+                    return True
+
+                if oe.errno != errno.EINTR:
+                    raise TransportException("Reading from %s: %s" %
+                                             (self._device_path, oe))
+
+        if len(data) == 0:
+            return False
+
+        self._buffer += data
+
+        lines = self._buffer.split(SerialTransport.LINE_END)
+
+        # The last element is the incomplete line, if any.
+        self._buffer = lines.pop()
+
+        if len(self._buffer) > SerialTransport.MAX_LINE_LENGTH:
+            logging.warning("Discarding too long data from %s" %
+                            self._device_path)
+            self._buffer = ""
+
+        self._lines.extend([ l + SerialTransport.LINE_END for l in lines ])
+
+        return True
+
+    def pop_line(self):
+        """Returns the oldest line received or None if there isn't any."""
+
+        line = None
+
+        if len(self._lines) > 0:
+            line = self._lines.pop(0)
+
+        return line
+
+    def request(self, command, timeout):
+        """Send a command and wait for a line in reply.
+
+        Args:
+            command: Command to send.
+            timeout: Maximum time in seconds to wait for the reply.
+
+        Returns:
+            The line received or None if the deadline has passed.
+        """
+
+        multiplexer = TransportMultiplexer([ self ])
+
+        return multiplexer.request_all(command, timeout)[self]
+
+class TransportMultiplexer(object):
+    """Sends requests to several transports and waits for their replies
+    at the same time.
+    """
+
+    def __init__(self, transports=None):
+
+        self._transports = []
+
+        if transports is not None:
+            for t in transports:
+                self.add(t)
+
+    def add(self, transport):
+
+        self._transports.append(transport)
+
+    def remove(self, transport):
+
+        self._transports.remove(transport)
+
+    @property
+    def transports(self):
+        return list(self._transports)
+
+    def request_all(self, command, timeout, errors=None):
+        """Send a command to all the transports and wait for their replies.
+
+        Args:
+            command: Command to send.
+            timeout: Maximum time in seconds to wait for the replies.
+            errors: Optional dictionary to return the TransportException of
+                each transport failed, instead of raising the first one, so
+                the others still get their replies.
+
+        Returns:
+            A dictionary with the line received from each transport, None for
+            those that haven't replied before the deadline or have failed.
+        """
+
+        deadline = time.time() + timeout
+
+        replies = dict([ (t, None) for t in self._transports ])
+
+        # Only the transports waiting for a reply are polled.
+        poller = select.poll()
+        pending = {}
+
+        def failed(t, error):
+            if errors is None:
+                raise error
+
+            errors[t] = error
+
+        for t in self._transports:
+            try:
+                t.flush_input()
+
+                if t.send(command, deadline):
+                    poller.register(t.fileno(),
+                                    select.POLLIN | select.POLLPRI)
+                    pending[t.fileno()] = t
+                else:
+                    logging.warning("Timeout sending to %s" % t.device_path)
+            except TransportException as te:
+                failed(t, te)
+
+        while len(pending) > 0 and time.time() < deadline:
+
+            for fd, event in _poll(poller, deadline):
+
+                t = pending[fd]
+
+                line = None
+
+                try:
+                    if event & (select.POLLIN | select.POLLPRI) and \
+                        not t.on_readable():
+                        raise TransportException("Device %s closed." %
+                                                 t.device_path)
+
+                    line = t.pop_line()
+
+                    # A reply received before the error is still valid.
+                    if line is None and event & (select.POLLERR |
+                                                 select.POLLHUP |
+                                                 select.POLLNVAL):
+                        raise TransportException("Error polling %s" %
+                                                 t.device_path)
+                except TransportException as te:
+                    poller.unregister(fd)
+                    del pending[fd]
+
+                    failed(t, te)
+
+                    continue
+
+                if line is not None:
+                    replies[t] = line
+                    poller.unregister(fd)
+                    del pending[fd]
+
+        for t in pending.values():
+            logging.warning("No reply from %s before the deadline." %
+                            t.device_path)
+
+        return replies
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Felipe Gallego. All rights reserved.
+#
+# This file is part of sqmcontrol: https://github.com/felgari/sqmcontrol
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Reports the time spent importing modules at start up.
+
+The report is similar to the one of 'python -X importtime', each module
+imported is listed with the time spent importing only that module and the
+time including the modules it imports.
+
+Used as a script it checks that the start up of a mode in a new process
+doesn't exceed a time budget, returning a non zero exit code otherwise:
+
+    python startup.py -b 2.0 ONE
+"""
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+import __builtin__
+
+# Budget in seconds for a cold start of a mode.
+DEFAULT_STARTUP_BUDGET = 2.0
+
+DEFAULT_MODE = "ONE"
+
+# Option used to perform the imports in a new process.
+_PROFILE_OPTION = "--profile"
+
+class ImportTimer(object):
+    """Measures the time spent importing each module."""
+
+    def __init__(self):
+
+        self._records = []
+        self._stack = []
+        self._original_import = None
+
+    def install(self):
+        """Start measuring the imports."""
+
+        self._original_import = __builtin__.__import__
+        __builtin__.__import__ = self._import
+
+    def uninstall(self):
+        """Stop measuring the imports."""
+
+        if self._original_import is not None:
+            __builtin__.__import__ = self._original_import
+            self._original_import = None
+
+    def _import(self, name, *args, **kwargs):
+
+        # Modules already imported are not measured.
+        if name in sys.modules:
+            return self._original_import(name, *args, **kwargs)
+
+        depth = len(self._stack)
+
+        # Accumulates the time of the modules imported by this one.
+        self._stack.append(0.0)
+
+        start = time.time()
+
+        try:
+            return self._original_import(name, *args, **kwargs)
+        finally:
+            cumulative = time.time() - start
+
+            children = self._stack.pop()
+
+            if len(self._stack) > 0:
+                self._stack[-1] += cumulative
+
+            self._records.append((depth, name, cumulative - children,
+                                  cumulative))
+
+    @property
+    def records(self):
+        """List of (depth, module, self time, cumulative time) tuples, in the
+        order the imports finish."""
+        return self._records
+
+    def total(self):
+        """Returns the time spent in the top level imports."""
+
+        return sum([ r[3] for r in self._records if r[0] == 0 ])
+
+    def report(self):
+        """Returns the report of the imports measured as a string."""
+
+        lines = [ "import time: self [us] | cumulative | imported package" ]
+
+        for depth, name, self_time, cumulative in self._records:
+            lines.append("import time: %9d | %10d | %s%s" %
+                         (self_time * 1e6, cumulative * 1e6,
+                          "  " * depth, name))
+
+        lines.append("Total import time: %.3f s" % self.total())
+
+        return "\n".join(lines)
+
+def profile_mode_imports(mode):
+    """Import the modules needed by a mode measuring the time spent.
+
+    Args:
+        mode: Name of the mode, as in the configuration file.
+
+    Returns:
+        The ImportTimer with the imports measured.
+    """
+
+    timer = ImportTimer()
+
+    timer.install()
+
+    try:
+        sqmcontrol = __import__("sqmcontrol")
+
+        for module_name in sqmcontrol.MODE_MODULES.get(mode, []):
+            __import__(module_name)
+    finally:
+        timer.uninstall()
+
+    return timer
+
+def cold_start(mode):
+    """Import the modules of a mode in a new process.
+
+    Args:
+        mode: Name of the mode, as in the configuration file.
+
+    Returns:
+        The wall time in seconds of the new process and its report.
+    """
+
+    script = os.path.abspath(__file__)
+
+    start = time.time()
+
+    child = subprocess.Popen([sys.executable, script, _PROFILE_OPTION, mode],
+                             cwd=os.path.dirname(script),
+                             stdout=subprocess.PIPE)
+
+    report = child.communicate()[0]
+
+    elapsed = time.time() - start
+
+    if child.returncode != 0:
+        raise RuntimeError("Start up of mode %s failed" % mode)
+
+    return elapsed, report
+
+def print_startup_report(mode):
+    """Print the report of the imports of a mode in a new process.
+
+    Args:
+        mode: Name of the mode, as in the configuration file.
+    """
+
+    elapsed, report = cold_start(mode)
+
+    print report
+    print "Cold start of mode %s: %.3f s" % (mode, elapsed)
+
+def check_startup_budget(mode, budget):
+    """Check the cold start of a mode doesn't exceed the budget.
+
+    Args:
+        mode: Name of the mode, as in the configuration file.
+        budget: Maximum time in seconds.
+
+    Returns:
+        True if the start up is within the budget.
+    """
+
+    elapsed, report = cold_start(mode)
+
+    within_budget = elapsed <= budget
+
+    print "Cold start of mode %s: %.3f s, budget %.3f s: %s" % \
+        (mode, elapsed, budget, "OK" if within_budget else "EXCEEDED")
+
+    if not within_budget:
+        print report
+
+    return within_budget
+
+if __name__ == "__main__":
+
+    if len(sys.argv) == 3 and sys.argv[1] == _PROFILE_OPTION:
+        print profile_mode_imports(sys.argv[2]).report()
+    else:
+        parser = argparse.ArgumentParser(
+            description="Check the start up time of a mode.")
+
+        parser.add_argument("mode", nargs="?", default=DEFAULT_MODE,
+                            help="Mode to check.")
+
+        parser.add_argument("-b", dest="budget", type=float,
+                            default=DEFAULT_STARTUP_BUDGET,
+                            help="Maximum time in seconds for the start up.")
+
+        args = parser.parse_args()
+
+        if check_startup_budget(args.mode, args.budget):
+            sys.exit(0)
+        else:
+            sys.exit(1)